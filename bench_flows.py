@@ -0,0 +1,83 @@
+#
+# Microbenchmark: flow payloads built as documents vs compiled templates
+#
+# Usage: python bench_flows.py [iterations]
+#
+import sys
+import json
+import timeit
+import srmanager.client as client
+import srmanager.templates as templates
+
+n = 2000
+if len(sys.argv) > 1:
+    n = int(sys.argv[1])
+
+flow = {'switch_id': 'openflow:1', 'flow_id': 'flow:16002', 'label': '16002',
+        'port': 'openflow:1:2', 'penultimate': True}
+table = [dict(flow, flow_id='flow:{}'.format(16000 + i), label=str(16000 + i))
+         for i in range(100)]
+labels = ['16088', 16005, 16003, 16004]
+
+def build_flow_sr(flow):
+    """ Reference for render_flow_sr: the same flow built as a document """
+
+    id = client.sr_flow_id(flow)
+    if flow.get('group') is not None:
+        return id, client.sr_group_flow_doc(id, flow['label'], flow['group'])
+    return id, client.sr_flow_doc(id, flow['label'], flow['port'], client.is_php(flow['penultimate']))
+
+def dict_flow():
+    return json.dumps({"flow-node-inventory:flow": [build_flow_sr(flow)[1]]})
+
+def template_flow():
+    return client.FLOW_BODY.render(flow=templates.Raw(client.render_flow_sr(flow)[1]))
+
+def dict_table():
+    return json.dumps({"flow-node-inventory:table": [
+        {"id": client.SR_TABLE, "flow": [build_flow_sr(f)[1] for f in table]}]})
+
+def template_table():
+    return client.TABLE_BODY.render(table=client.SR_TABLE, flows=templates.raw_list(
+        [client.render_flow_sr(f)[1] for f in table]))
+
+def dict_goto():
+    return json.dumps({"flow-node-inventory:flow": [client.goto_sr_flow_doc(client.GOTO_SR_FLOW_ID)]})
+
+def template_goto():
+    return client.FLOW_BODY.render(flow=templates.Raw(
+        client.GOTO_SR_FLOW.render(id=client.GOTO_SR_FLOW_ID)))
+
+def dict_service():
+    actions = []
+    for label in labels:
+        actions.append({"order": len(actions), "push-mpls-action": {"ethernet-type": 34887}})
+        actions.append({"order": len(actions), "set-field": {
+            "protocol-match-fields": {"mpls-label": label}}})
+    instructions = [{"order": 0, "apply-actions": {"action": actions}},
+                    {"order": 1, "go-to-table": {"table_id": 1}}]
+    ingress = json.dumps({"flow-node-inventory:flow": [
+        client.service_ingress_doc('service-1', 2048, instructions)]})
+    egress = json.dumps({"flow-node-inventory:flow": [
+        client.service_egress_doc('service-1', 2048, '16088', 'openflow:5:2')]})
+    return ingress, egress
+
+def template_service():
+    return (client.render_service_ingress('service-1', 2048, labels),
+            client.render_service_egress('service-1', 2048, '16088', 'openflow:5:2'))
+
+# same payloads either way
+for d, t in [(dict_flow, template_flow), (dict_table, template_table),
+             (dict_goto, template_goto)]:
+    assert json.loads(d()) == json.loads(t())
+assert [json.loads(p) for p in dict_service()] == [json.loads(p) for p in template_service()]
+
+print "codec: {}, {} iterations".format(templates.codec.__name__, n)
+print "{:<16}{:>12}{:>12}{:>10}".format("payload", "dict us", "template us", "speedup")
+for name, d, t in [("sr flow", dict_flow, template_flow),
+                   ("sr table x100", dict_table, template_table),
+                   ("goto sr flow", dict_goto, template_goto),
+                   ("service", dict_service, template_service)]:
+    td = min(timeit.repeat(d, number=n, repeat=3)) / n * 1e6
+    tt = min(timeit.repeat(t, number=n, repeat=3)) / n * 1e6
+    print "{:<16}{:>12.1f}{:>12.1f}{:>9.1f}x".format(name, td, tt, td / tt)
@@ -0,0 +1,66 @@
+#
+# Benchmark: next hop table built serially vs over a process pool
+#
+# Usage: python bench_spf.py [nodes] [max workers]
+#
+import sys
+import time
+import multiprocessing
+import networkx as nx
+from srmanager.csr import CSRGraph
+from srmanager.nexthop import NextHopTable, SearchPool
+
+nodes = 2000
+if len(sys.argv) > 1:
+    nodes = int(sys.argv[1])
+
+most = multiprocessing.cpu_count()
+if len(sys.argv) > 2:
+    most = int(sys.argv[2])
+
+# a ring with chords, every link both ways with its own port
+g = nx.DiGraph()
+names = ['openflow:{}'.format(i) for i in range(1, nodes + 1)]
+for k, a in enumerate(names):
+    for port, step in enumerate([1, 7, 31, 127]):
+        b = names[(k + step) % nodes]
+        g.add_edge(a, b, **{'source-tp': '{}:{}'.format(a, port + 1)})
+        g.add_edge(b, a, **{'source-tp': '{}:{}'.format(b, port + 5)})
+
+compact = CSRGraph.from_graph(g)
+
+def timed(graph, workers=None, pool=None):
+    start = time.time()
+    table = NextHopTable(graph, workers, pool=pool)
+    return time.time() - start, table
+
+def rows(table):
+    return dict([(s, dict(table.next_hops(s))) for s in table])
+
+print "{} nodes, {} links, {} cpus".format(nodes, g.number_of_edges(), multiprocessing.cpu_count())
+print "{:<12}{:>8}{:>10}{:>10}".format("graph", "workers", "seconds", "speedup")
+
+base, expected = timed(g)
+expected = rows(expected)
+print "{:<12}{:>8}{:>10.2f}{:>9.1f}x".format("networkx", 1, base, 1.0)
+
+workers = [1]
+while workers[-1] * 2 <= most:
+    workers.append(workers[-1] * 2)
+if workers[-1] != most:
+    workers.append(most)
+
+for w in workers:
+    took, table = timed(compact, w)
+    # same next hops whichever way they are found
+    assert rows(table) == expected
+    print "{:<12}{:>8}{:>10.2f}{:>9.1f}x".format("csr", w, took, base / took)
+
+    # the daemon keeps its pool, so later tables skip starting one
+    if w > 1:
+        pool = SearchPool(w)
+        timed(compact, pool=pool)
+        took, table = timed(compact, pool=pool)
+        pool.close()
+        assert rows(table) == expected
+        print "{:<12}{:>8}{:>10.2f}{:>9.1f}x".format("csr pooled", w, took, base / took)
@@ -13,22 +13,35 @@ logging.info("SR Daemon starting")
 # get SR class
 srm = srmanager.sr.SR()
 
+# subscribe first, so no change slips in while the topology is read
+srm.open_topology_events()
+
 # grab the latest topology
 top = srm.get_topology()
 
-# start with a clean slate, delete all flows
-srm.del_all_flows(top)
+# shortest paths, kept up to date as the topology changes
+spf = srm.incremental_spf(top)
+
+# program switches in the background so topology events keep flowing
+srm.start_pipeline()
+
+# fix up the flows already installed, or start from a clean slate
+flow_pass = srm.start_sr_flows(top, spf)
 
-# now add sr flows
-srm.add_sr_flows(top)
+# Now wait for topology changes, on one long-lived subscription,
+# folding bursts of events into one update
+logging.info("Listening on stream for topology change... (ctrl-c to exit)")
+for batch in srm.topology_batches():
 
-# Now wait for topology changes
-while True:
-    srm.listen_to_topology()
+    if not flow_pass.done():
+        logging.info("Previous pass still writing, {} operations queued".format(
+            srm.pipeline.pending()))
+        logging.info("Controller load: {}".format(srm.controller_load()))
 
     # Update the old flows
-    logging.info("Updating Topology")
-    top = srm.update_sr_flows(top)
+    logging.info("Updating Topology, batch of {} events".format(len(batch)))
+    spf = srm.update_sr_flows_events(spf, batch)
+    flow_pass = srm.flow_pass
 
 logging.info("SR Daemon finished")
 
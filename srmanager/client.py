@@ -3,12 +3,18 @@ import json
 import requests
 import logging
 import xmltodict
-import sr
+from multiprocessing.pool import ThreadPool
 from requests.auth import HTTPBasicAuth
 from requests.exceptions import ConnectionError, Timeout
 from websocket import create_connection
 
 from srmanager.controller import Controller
+from srmanager.stream import TopologyStream
+from srmanager import jsonstream
+from srmanager.templates import Template, Raw, hole, raw_list, dumps
+from srmanager.shadow import Shadow
+from srmanager.sid import SidRegistry, SidCollision, SRGB_BASE
+from srmanager.groups import GROUP_SELECT, GROUP_FAST_FAILOVER
 
 class SrManagerClientException(Exception):
     def __init__(self, msg):
@@ -23,6 +29,27 @@ FLOW_GO_TO_SR_PRIORITY=100
 
 SR_TABLE=1
 
+GOTO_SR_FLOW_ID="srgoto-table-1"
+
+# Inventory ids of the node sid flows the SR daemon owns start with this
+NODE_FLOW_PREFIX="src-flow:"
+
+# What groups are shadowed under, in place of a table id
+GROUPS='groups'
+
+# Status of a bulk service flow that did not have to be sent
+SERVICE_UNCHANGED='unchanged'
+
+# Inventory datastores
+DATASTORE_CONFIG='config'
+DATASTORE_OPERATIONAL='operational'
+
+# Read-after-write verification modes
+VERIFY_NONE='none'
+VERIFY_SYNC='sync'
+VERIFY_DEFERRED='deferred'
+VERIFY_MODES=[VERIFY_NONE, VERIFY_SYNC, VERIFY_DEFERRED]
+
 LOG = logging.getLogger(__name__)
 
 #-------------------------------------------------------------------------------
@@ -33,7 +60,81 @@ class Client():
 
     def __init__(self, **kwargs):
         """Initializes this object properties."""
-        self.ctrl = Controller(**kwargs)
+
+        # Reuse a controller (and its connection pool) when one is given
+        if kwargs.get('ctrl') is not None:
+            self.ctrl = kwargs['ctrl']
+        else:
+            self.ctrl = Controller(**kwargs)
+
+        # How writes are checked: trust the 200, read back each write,
+        # or read back each touched table once in verify_flows()
+        self.verify = kwargs.get('verify') or self.ctrl.config.get('verify', VERIFY_SYNC)
+        if self.verify not in VERIFY_MODES:
+            raise SrManagerClientException(
+                "unknown verify mode {}, expected one of {}".format(self.verify, VERIFY_MODES))
+
+        # Deferred checks, switch name -> flow id -> expected flow (None if deleted)
+        self.pending = {}
+
+        # What we last wrote, so unchanged flows are not written again
+        shadow = kwargs.get('shadow', self.ctrl.config.get('shadow', True))
+        self.shadow = Shadow(unicode(shadow).lower() == u'true')
+        self.connection_losses = self.ctrl.connection_losses
+
+        # Node sids, shared with SR when it made us
+        self.sids = kwargs.get('sids')
+        if self.sids is None:
+            self.sids = SidRegistry(SRGB_BASE, self.ctrl.config.get('sid_overrides'))
+
+    def check_shadow(self):
+        """ Forget the shadow if the controller connection has been lost """
+
+        if self.ctrl.connection_losses != self.connection_losses:
+            LOG.info("controller connection lost, forgetting written flows")
+            self.connection_losses = self.ctrl.connection_losses
+            self.shadow.clear()
+
+    def put_flow(self, name, table, id, payload):
+        """ Write one flow unless the same payload was the last written
+
+        @param name: switch name
+        @param table: table id
+        @param id: inventory flow id
+        @param payload: JSON text of the flow body
+        @return: the response, None if the write was skipped
+
+        """
+
+        return self.put_item(name, table, id, "table/{}/flow/{}".format(table,id), payload)
+
+    def put_item(self, name, table, id, path, payload):
+        """ Write a flow or group of a switch unless it is unchanged
+
+        @param table: table id, or GROUPS, the item is shadowed under
+        @param path: where the item is, under the switch's node
+        @return: see put_flow
+
+        """
+
+        self.check_shadow()
+
+        digest = Shadow.digest(payload)
+        if self.shadow.unchanged(name, table, id, digest):
+            self.shadow.count(skipped=1)
+            return None
+
+        self.shadow.count(sent=1)
+        resp = self.ctrl.http_put_request(
+                 self.ctrl.get_config_url()+
+                 "/opendaylight-inventory:nodes/node/{}/{}".format(name,path)
+                 ,payload)
+
+        if resp is not None and resp.status_code == 200:
+            self.shadow.wrote(name, table, id, digest)
+        else:
+            self.shadow.forget(name, table, id)
+        return resp
 
     def __str__(self):
         """ Returns string representation of this object. """
@@ -58,22 +159,85 @@ class Client():
         """ get flows from Segment Routing Manager """
         resp = self.ctrl.http_get_request(
                    self.ctrl.get_config_url()
-                        + "/opendaylight-inventory:nodes/node/{}/table/{}".format(name,SR_TABLE))
+                        + "/opendaylight-inventory:nodes/node/{}/table/{}".format(name,SR_TABLE),
+                   stream=jsonstream.streaming(), bulk=True)
 
         if resp is not None:
-            if resp.status_code == 200:
-                flows = json.loads(resp.content)
-                r=[]
-                if ('flow-node-inventory:table' in flows
-                    and len(flows['flow-node-inventory:table']) >0
-                    and 'flow' in flows['flow-node-inventory:table'][0]):
-
-                    for flow in flows['flow-node-inventory:table'][0]['flow']:
-                        if is_sr_flow(flow['id']):
-                            r.append(transfor_flow_sr(name,flow))
-                return r
+            try:
+                if resp.status_code == 200:
+                    # only the SR flows are kept from the reply
+                    return [transfor_flow_sr(name,flow) for flow in
+                            jsonstream.table_flows(resp, is_sr_flow_object)]
+            except jsonstream.PARSE_ERRORS, e:
+                LOG.error("could not read the SR table of {}: {}".format(name, e))
+            finally:
+                resp.close()
         return None
 
+    def get_sr_flows(self, names):
+        """ Get the SR flows of many switches concurrently.
+
+        @param names: list of switch names
+        @return: dict of switch name to list of flows as returned by
+                 get_flows (None for switches that could not be read)
+
+        """
+
+        names = list(names)
+        if len(names) == 0:
+            return {}
+
+        pool = ThreadPool(min(len(names), self.ctrl.config['pool_maxsize']))
+        try:
+            tables = pool.map(self.get_flows, names)
+        finally:
+            pool.close()
+            pool.join()
+
+        return dict(zip(names, tables))
+
+    def get_inventory_snapshot(self, datastore=DATASTORE_CONFIG):
+        """ Get the SR flows and groups of every switch in one request.
+
+        Only the SR flows are kept from the reply, see jsonstream.
+
+        @param datastore: DATASTORE_CONFIG for what we asked for,
+                          DATASTORE_OPERATIONAL for what the switches have
+        @return: dict of switch name to table id to flow id to flow as
+                 returned by transfor_flow_sr, and to GROUPS to group id
+                 to the raw group; None if the request failed
+
+        """
+
+        if datastore == DATASTORE_OPERATIONAL:
+            url = self.ctrl.get_operational_url()
+        elif datastore == DATASTORE_CONFIG:
+            url = self.ctrl.get_config_url()
+        else:
+            raise SrManagerClientException(
+                "unknown datastore {}, expected {} or {}".format(
+                    datastore, DATASTORE_CONFIG, DATASTORE_OPERATIONAL))
+
+        resp = self.ctrl.http_get_request(url + "/opendaylight-inventory:nodes",
+                                          stream=jsonstream.streaming(),
+                                          bulk=True)
+        if resp is None:
+            return None
+
+        try:
+            if resp.status_code == 404:
+                return {}
+            if resp.status_code != 200:
+                return None
+
+            return index_inventory(jsonstream.inventory_flows(resp, is_sr_flow_object, groups=True))
+        except jsonstream.PARSE_ERRORS, e:
+            # callers fall back to reading each switch
+            LOG.error("could not read the inventory reply: {}".format(e))
+            return None
+        finally:
+            resp.close()
+
     def get_flow(self, name, id):
         """ Get a Segment Routing Manager flow given the switch name and id
 
@@ -123,80 +287,168 @@ class Client():
 
         # Make call to Segment Routing Manager
         name = kwargs['flow']['switch_id']
+        id, flow = render_flow_sr(kwargs['flow'])
+        payload = FLOW_BODY.render(flow=Raw(flow))
 
-        label = kwargs['flow']['label']
-        port = kwargs['flow']['port']
-        penultimate = kwargs['flow']['penultimate']
+        written = written_flow_sr(kwargs['flow'])
+        resp = self.put_flow(name, SR_TABLE, id, payload)
 
-        if 'flow_id' in kwargs['flow']:
-            id = "src-" + kwargs['flow']['flow_id']
-        else:
-            id = "sra-" + name + "-" + str(port) + "-" + str(label)
-
-        payload = { "flow-node-inventory:flow": [
-                    {
-                        "id": id,
-                        "table_id": SR_TABLE,
-                        "hard-timeout": 0,
-                        "priority": FLOW_SR_PRIORITY,
-                        "idle-timeout": 0,
-                        "instructions": {
-                            "instruction": [
-                                {
-                                    "order": 0,
-                                    "apply-actions": {
-                                        "action": [
-                                          {
-                                            "order": 2,
-                                            "output-action": {
-                                              "output-node-connector": port
-                                            }
-                                          }
-                                        ]
-                                    }
-                                }
-                            ]
-                        },
-                        "match": {
-                            "protocol-match-fields": {
-                                "mpls-label": label
-                            },
-                            "ethernet-match": {
-                                "ethernet-type": {
-                                    "type": 34887
-                                }
-                            }
-                        }
-                    }
-                ]
-            }
+        # Unchanged since we last wrote it
+        if resp is None:
+            return written
 
-        if (penultimate is not None
-            and (
-                (type(penultimate) is bool and penultimate)
-                or (type(penultimate) is not bool and unicode(penultimate) != u'false'))):
-            payload['flow-node-inventory:flow'][0]['instructions']['instruction'][0]['apply-actions']['action'].append(
-                    {
-                      "order": 0,
-                      "pop-mpls-action": {
-                        "ethernet-type": 34887
-                      }
-                    }
-                    )
+        # Check response
+        if (resp.status_code == 200):
+            if self.verify == VERIFY_SYNC:
+                installed = self.get_flow(name,id)
+                if not flows_equal(written, installed):
+                    self.shadow.forget(name, SR_TABLE, id)
+                return installed
+            if self.verify == VERIFY_DEFERRED:
+                self.defer_verify(name, written['id'], written)
+            return written
+
+        return None
+
+
+    def get_table(self, name, table=SR_TABLE):
+        """ Get the raw flow list of a switch table
+
+        @param name: switch name
+        @param table: table id
+        @return: list of flows, empty if the table does not exist,
+                 None if the request failed
+
+        """
+
+        resp = self.ctrl.http_get_request(
+                   self.ctrl.get_config_url()
+                        + "/opendaylight-inventory:nodes/node/{}/table/{}".format(name,table),
+                   bulk=True)
+
+        if resp is not None:
+            if resp.status_code == 200:
+                tables = json.loads(resp.content)
+                if ('flow-node-inventory:table' in tables
+                    and len(tables['flow-node-inventory:table']) >0
+                    and 'flow' in tables['flow-node-inventory:table'][0]):
+                    return tables['flow-node-inventory:table'][0]['flow']
+                return []
+            elif resp.status_code == 404:
+                return []
+        return None
+
+    def put_sr_table(self, name, flows, replace=True, remove=None):
+        """ Write a whole set of SR flows to a switch in one request.
+
+        @param name: switch name
+        @param flows: list of flow dicts (see add_flow for the keywords)
+        @param replace: True replaces the node flows the daemon owns (see
+                        is_node_flow) with the given flows, keeping every
+                        other flow of the table; False merges them over
+                        the flows already installed
+        @param remove: flow ids to drop while merging
+        @return: list of flows written, None if the write failed
+
+        Unless the shadow shows nothing changed this costs two round
+        trips, a GET of the table and the PUT. The inventory snapshot
+        only keeps SR flows, so it can't stand in for the GET: flows
+        that are not ours have to be read to be kept.
 
+        """
+
+        self.check_shadow()
+
+        # flow id -> JSON text, and what get_flows would return for it
+        table = {}
+        sr_flows = {}
+        digests = {}
+        removed = []
+
+        new = []
+        for f in flows:
+            id, flow = render_flow_sr(f)
+            new.append((id, flow, written_flow_sr(f), Shadow.digest(flow)))
+
+        if replace:
+            if self.shadow.table_unchanged(name, SR_TABLE, dict([(n[0], n[3]) for n in new])):
+                self.shadow.count(skipped=1)
+                return [n[2] for n in new]
+        else:
+            # Leave out what is already there, or already gone
+            skip = [n for n in new if self.shadow.unchanged(name, SR_TABLE, n[0], n[3])]
+            new = [n for n in new if n not in skip]
+            remove = [id for id in remove or []
+                      if not self.shadow.absent(name, SR_TABLE, sr_inventory_id(id))]
+            if len(new) == 0 and len(remove) == 0:
+                self.shadow.count(skipped=1)
+                return [n[2] for n in skip]
+
+        # Keep what is installed unless we are overwriting it, and when
+        # replacing still keep the flows that are not ours
+        current = self.get_table(name)
+        if current is None:
+            return None
+        for flow in current:
+            if replace and is_node_flow(flow['id']):
+                continue
+            table[flow['id']] = dumps(flow)
+            if is_sr_flow(flow['id']):
+                sr_flows[flow['id']] = transfor_flow_sr(name,flow)
+
+        if not replace:
+            for id in remove or []:
+                id = sr_inventory_id(id)
+                if table.pop(id, None) is not None:
+                    sr_flows.pop(id, None)
+                    removed.append(transfor_flow_sr(name, {'id': id})['id'])
+
+            # a flow of ours we did not write, the shadow is out of date
+            known = self.shadow.known(name, SR_TABLE)
+            if known is not None and [id for id in sr_flows
+                                      if is_node_flow(id) and id not in known]:
+                self.shadow.forget(name, SR_TABLE)
+
+        for id, flow, written, digest in new:
+            table[id] = flow
+            sr_flows[id] = written
+            digests[id] = digest
+
+        payload = TABLE_BODY.render(table=SR_TABLE, flows=raw_list(table.values()))
+
+        self.shadow.count(sent=1)
         resp = self.ctrl.http_put_request(
                  self.ctrl.get_config_url()+
-                 "/opendaylight-inventory:nodes/node/{}/table/{}/flow/{}".format(name,SR_TABLE,id)
-                 ,json.dumps(payload))
+                 "/opendaylight-inventory:nodes/node/{}/table/{}".format(name,SR_TABLE)
+                 ,payload, bulk=True)
 
         # Check response
         if resp is not None:
             if (resp.status_code == 200):
-                return self.get_flow(name,id)
-
+                if replace:
+                    self.shadow.wrote_table(name, SR_TABLE, digests)
+                else:
+                    for id in digests:
+                        self.shadow.wrote(name, SR_TABLE, id, digests[id])
+                    for id in remove:
+                        self.shadow.wrote(name, SR_TABLE, sr_inventory_id(id), None)
+
+                if self.verify == VERIFY_SYNC:
+                    installed = self.get_flows(name)
+                    if installed is None or len(installed) != len(sr_flows):
+                        self.shadow.forget(name, SR_TABLE)
+                    return installed
+                written = sr_flows.values()
+                if self.verify == VERIFY_DEFERRED:
+                    for flow in written:
+                        self.defer_verify(name, flow['id'], flow)
+                    for id in removed:
+                        self.defer_verify(name, id, None)
+                return written
+
+        self.shadow.forget(name, SR_TABLE)
         return None
 
-
     def delete_flow(self,name,id):
         """ Delete a flow via Segment Routing Manager.
 
@@ -211,11 +463,112 @@ class Client():
         if not id.startswith("src"):
             id = "src-"+id
 
+        # Already gone
+        self.check_shadow()
+        if self.shadow.absent(name, SR_TABLE, id):
+            self.shadow.count(skipped=1)
+            return None
+
+        self.shadow.count(sent=1)
         resp = self.ctrl.http_delete_request(
                    self.ctrl.get_config_url()+
                    "/opendaylight-inventory:nodes/node/{}/table/{}/flow/{}".format(name,SR_TABLE,id))
 
-        return self.get_flow(name,id)
+        if resp is not None and resp.status_code in (200, 404):
+            self.shadow.wrote(name, SR_TABLE, id, None)
+        else:
+            self.shadow.forget(name, SR_TABLE, id)
+
+        if self.verify == VERIFY_SYNC:
+            installed = self.get_flow(name,id)
+            if installed is not None:
+                self.shadow.forget(name, SR_TABLE, id)
+            return installed
+
+        if resp is not None and resp.status_code in (200, 404):
+            if self.verify == VERIFY_DEFERRED:
+                self.defer_verify(name, transfor_flow_sr(name, {'id': id})['id'], None)
+            return None
+        return {'id': id}
+
+    def defer_verify(self, name, id, flow):
+        """ Queue a flow for the next verify_flows() pass
+
+        @param name: switch name
+        @param id: flow id as returned by get_flows
+        @param flow: expected flow, None if it should be absent
+
+        """
+
+        self.pending.setdefault(name, {})[id] = flow
+
+    def verify_flows(self, names=None):
+        """ Check deferred writes with one table read per switch
+
+        Flows that do not match what was written are written again (or
+        removed again), and checked on the next pass. A switch whose table
+        can't be read stays queued for the next pass as it was.
+
+        @param names: switches to check, all with deferred writes if None
+        @return: dict of switch name to list of flow ids that did not
+                 match what was written (empty if all writes landed)
+
+        """
+
+        mismatches = {}
+
+        # writes may still be queueing checks from other threads
+        if names is None:
+            pending, self.pending = self.pending, {}
+        else:
+            pending = {}
+            for name in names:
+                if name in self.pending:
+                    pending[name] = self.pending.pop(name)
+
+        # many switches to check, one read covers them all
+        snapshot = None
+        if len(pending) > 1:
+            snapshot = self.get_inventory_snapshot()
+
+        for name in pending:
+            installed = {}
+            if snapshot is not None:
+                installed = snapshot.get(name, {}).get(SR_TABLE, {})
+            else:
+                flows = self.get_flows(name)
+                if flows is None:
+                    LOG.error("can't read the SR table of {}, checking it later".format(name))
+                    for id, expected in pending[name].items():
+                        self.pending.setdefault(name, {}).setdefault(id, expected)
+                    continue
+                for flow in flows:
+                    installed[flow['id']] = flow
+
+            for id, expected in pending[name].items():
+                if not flows_equal(expected, installed.get(id)):
+                    LOG.error("flow {} on {} not as written".format(id, name))
+                    mismatches.setdefault(name, []).append(id)
+                    self.shadow.forget(name, SR_TABLE, sr_inventory_id(id))
+
+        for name in mismatches:
+            self.repair_flows(name, dict([(id, pending[name][id]) for id in mismatches[name]]))
+
+        return mismatches
+
+    def repair_flows(self, name, expected):
+        """ Write flows again that did not land as written
+
+        @param name: switch name
+        @param expected: dict of flow id to the flow as get_flows should
+                         return it, None for flows that should be absent
+
+        """
+
+        flows = [sr_flow_of(flow) for flow in expected.values() if flow is not None]
+        remove = [id for id in expected if expected[id] is None]
+        if self.put_sr_table(name, flows, replace=False, remove=remove) is None:
+            LOG.error("failed to write {} flows on {} again".format(len(expected), name))
 
     def delete_flows(self,name):
         """ Delete all flows via Segment Routing Manager.
@@ -225,13 +578,87 @@ class Client():
 
         """
 
-        flows = self.get_flows(name)
-        if flows is not None:
-            for flow in flows:
-                self.delete_flow(name, flow['id'])
+        if self.clear_sr_table(name) is None:
+            return {'name': name}
 
         return None
 
+    def clear_sr_table(self, name):
+        """ Remove every SR flow from a switch in one write.
+
+        The table is read once; if it only holds SR flows it is deleted,
+        otherwise it is replaced by the flows that are not ours. That is
+        two round trips, one if there was nothing to remove.
+
+        @param name: switch name
+        @return: number of flows removed, None if the removal failed
+
+        """
+
+        flows = self.get_table(name)
+        if flows is None:
+            return None
+
+        self.check_shadow()
+
+        keep = [flow for flow in flows if not is_sr_flow(flow['id'])]
+        removed = len(flows) - len(keep)
+        if removed == 0:
+            self.shadow.wrote_table(name, SR_TABLE, {})
+            return 0
+
+        url = (self.ctrl.get_config_url()
+               + "/opendaylight-inventory:nodes/node/{}/table/{}".format(name,SR_TABLE))
+        self.shadow.count(sent=1)
+        if len(keep) == 0:
+            resp = self.ctrl.http_delete_request(url)
+        else:
+            payload = TABLE_BODY.render(table=SR_TABLE, flows=keep)
+            resp = self.ctrl.http_put_request(url, payload, bulk=True)
+
+        if resp is None or resp.status_code not in (200, 404):
+            self.shadow.forget(name, SR_TABLE)
+            return None
+
+        if self.verify == VERIFY_SYNC:
+            flows = self.get_flows(name)
+            if flows is not None and len(flows) > 0:
+                self.shadow.forget(name, SR_TABLE)
+                return None
+
+        self.shadow.wrote_table(name, SR_TABLE, {})
+        return removed
+
+    def clear_sr_tables(self, names, goto=True):
+        """ Remove every SR flow from many switches concurrently.
+
+        @param names: list of switch names
+        @param goto: also delete the go to SR table flow, a third round
+                     trip per switch after the two of clear_sr_table
+        @return: dict of switch name to number of flows removed
+                 (None for switches where the removal failed)
+
+        """
+
+        def clear(name):
+            removed = self.clear_sr_table(name)
+            if goto:
+                self.delete_goto_sr_flow(name)
+            return removed
+
+        names = list(names)
+        if len(names) == 0:
+            return {}
+
+        pool = ThreadPool(min(len(names), self.ctrl.config['pool_maxsize']))
+        try:
+            counts = pool.map(clear, names)
+        finally:
+            pool.close()
+            pool.join()
+
+        return dict(zip(names, counts))
+
 
     def add_goto_sr_flow(self, name):
         """ Add go to table 1 to process sr rules
@@ -241,40 +668,15 @@ class Client():
 
         """
 
-        id = "srgoto-table-1"
-
-        payload = { "flow-node-inventory:flow": [
-                    {
-                        "id": id,
-                        "table_id": 0,
-                        "hard-timeout": 0,
-                        "priority": FLOW_GO_TO_SR_PRIORITY,
-                        "idle-timeout": 0,
-                        "instructions": {
-                            "instruction": [
-                                {
-                                    "order":0,
-                                    "go-to-table":{
-                                        "table_id":1
-                                    }
-                                }
-                            ]
-                        },
-                        "match": {
-                            "ethernet-match": {
-                                "ethernet-type": {
-                                    "type": 34887
-                                }
-                            }
-                        }
-                    }
-                ]
-            }
+        id = GOTO_SR_FLOW_ID
 
-        resp = self.ctrl.http_put_request(
-                 self.ctrl.get_config_url()+
-                 "/opendaylight-inventory:nodes/node/{}/table/0/flow/{}".format(name,id)
-                 ,json.dumps(payload))
+        payload = FLOW_BODY.render(flow=Raw(GOTO_SR_FLOW.render(id=id)))
+
+        resp = self.put_flow(name, 0, id, payload)
+
+        # Unchanged since we last wrote it
+        if resp is None:
+            return { 'id':id}
 
         # Check response
         if resp is not None:
@@ -284,6 +686,26 @@ class Client():
         return None
 
 
+    def get_goto_sr_flow(self, name):
+        """ Get the go to SR table flow of a switch
+
+        @param name: switch name
+        @return: {'id': id} if installed, {} if not, None if the request failed
+
+        """
+
+        id = GOTO_SR_FLOW_ID
+        resp = self.ctrl.http_get_request(
+                   self.ctrl.get_config_url()+
+                   "/opendaylight-inventory:nodes/node/{}/table/0/flow/{}".format(name,id))
+
+        if resp is not None:
+            if resp.status_code == 200:
+                return {'id':id}
+            elif resp.status_code == 404:
+                return {}
+        return None
+
     def delete_goto_sr_flow(self,name):
         """ Delete a flow via Segment Routing Manager.
 
@@ -293,13 +715,17 @@ class Client():
 
         """
 
-        id = "srgoto-table-1"
+        id = GOTO_SR_FLOW_ID
+        self.check_shadow()
+        self.shadow.count(sent=1)
         resp = self.ctrl.http_delete_request(
                    self.ctrl.get_config_url()+
                    "/opendaylight-inventory:nodes/node/{}/table/0/flow/{}".format(name,id))
 
         if resp.status_code == 200 or resp.status_code == 404:
+            self.shadow.wrote(name, 0, id, None)
             return None
+        self.shadow.forget(name, 0, id)
         return {'id':id}
 
 
@@ -336,348 +762,238 @@ class Client():
 
         """
 
-        sid = sr.SR()
+        for switch, id, payload in self.service_flows(kwargs['service']):
+            resp = self.put_flow(switch, 0, id, payload)
+            if resp is not None and resp.status_code != 200:
+                print resp.content
 
-        ingress_switch = kwargs['service']['ingress_switch']
-        if not ingress_switch.startswith("openflow:"):
-            ingress_switch="openflow:"+ingress_switch
+        return None
 
-        ingress_port = kwargs['service']['ingress_port']
-        if ingress_port.startswith(ingress_switch):
-            ingress_port=ingress_port.replace(ingress_switch,"")
-        #if not ingress_port.startswith("openflow:"):
-        #    ingress_port=ingress_switch+":"ingress_port
+    def service_flows(self, service):
+        """ Render the flows of one direction of a service.
 
-        egress_switch = kwargs['service']['egress_switch']
-        if not egress_switch.startswith("openflow:"):
-            egress_switch="openflow:"+egress_switch
+        @param service: service as taken by add_service_unidirectional
+        @return: list of (switch name, flow id, payload), ingress IP and
+                 ARP flows then egress IP and ARP flows
 
-        egress_port = kwargs['service']['egress_port']
-        if not egress_port.startswith("openflow:"):
-            egress_port=egress_switch+":"+egress_port
+        """
+
+        ingress_switch, ingress_port, egress_switch, egress_port, id = service_endpoints(service)
 
         switch_id = ingress_switch[ingress_switch.index(':')+1:]
-        ip_label = switch_id + "88" + str(kwargs['service']['ingress_port'])
-        if 'ip_label' in kwargs['service']:
-            ip_label = kwargs['service']['ip_label']
+        ip_label = switch_id + "88" + str(service['ingress_port'])
+        if 'ip_label' in service:
+            ip_label = service['ip_label']
 
-        arp_label = switch_id + "99" + str(kwargs['service']['ingress_port'])
-        if 'arp_label' in kwargs['service']:
-            arp_label = kwargs['service']['arp_label']
+        arp_label = switch_id + "99" + str(service['ingress_port'])
+        if 'arp_label' in service:
+            arp_label = service['arp_label']
 
         waypoints = []
-        if 'waypoints' in kwargs['service']:
-            waypoints = kwargs['service']['waypoints']
+        if 'waypoints' in service:
+            waypoints = service['waypoints']
 
-        id = "service-" + ingress_switch + ":" + ingress_port + "-" + egress_port
         ip_id = id +"-ip"
         arp_id = id +"-arp"
 
-        ingress_ip = { "flow-node-inventory:flow": [
-                    {
-                        "id": ip_id,
-                        "table_id": 0,
-                        "hard-timeout": 0,
-                        "priority": FLOW_SERVICE_PRIORITY,
-                        "idle-timeout": 0,
-                        "instructions": {
-                            "instruction": [
-                                {
-                                    "order": 0,
-                                    "apply-actions": {
-                                        "action": [
-                                            {
-                                                "order": 0,
-                                                "push-mpls-action": {
-                                                    "ethernet-type": 34887
-                                                }
-                                            },
-                                            {
-                                                "order": 1,
-                                                "set-field": {
-                                                    "protocol-match-fields": {
-                                                        "mpls-label": ip_label
-                                                    }
-                                                }
-                                            },
-                                            {
-                                                "order": 2,
-                                                "push-mpls-action": {
-                                                    "ethernet-type": 34887
-                                                }
-                                            },
-                                            {
-                                                "order": 3,
-                                                "set-field": {
-                                                    "protocol-match-fields": {
-                                                        "mpls-label": sid.get_sid(egress_switch)
-                                                    }
-                                                }
-                                            }
-                                        ]
-                                    }
-                                }
-                            ]
-                        },
-                        "match": {
-                            "in-port": "1",
-                            "ethernet-match": {
-                                "ethernet-type": {
-                                    "type": 2048
-                                }
-                            }
-                        }
-                    }
-                ]
-            }
+        # service label at the bottom, then the egress node, then the
+        # waypoints so the first one ends up on top
+        labels = [self.sids.sid(egress_switch)]
+        latest_label = self.sids.sid(egress_switch)
+        for waypoint in reversed(waypoints):
+            if waypoint.startswith("openflow:"):
+                waypoint=self.sids.sid(waypoint)
+                latest_label=waypoint
+            labels.append(waypoint)
 
-        ingress_arp = { "flow-node-inventory:flow": [
-                    {
-                        "id": arp_id,
-                        "table_id": 0,
-                        "hard-timeout": 0,
-                        "priority": FLOW_SERVICE_PRIORITY,
-                        "idle-timeout": 0,
-                        "instructions": {
-                            "instruction": [
-                                {
-                                    "order": 0,
-                                    "apply-actions": {
-                                        "action": [
-                                            {
-                                                "order": 0,
-                                                "push-mpls-action": {
-                                                    "ethernet-type": 34887
-                                                }
-                                            },
-                                            {
-                                                "order": 1,
-                                                "set-field": {
-                                                    "protocol-match-fields": {
-                                                        "mpls-label": arp_label
-                                                    }
-                                                }
-                                            },
-                                            {
-                                                "order": 2,
-                                                "push-mpls-action": {
-                                                    "ethernet-type": 34887
-                                                }
-                                            },
-                                            {
-                                                "order": 3,
-                                                "set-field": {
-                                                    "protocol-match-fields": {
-                                                        "mpls-label": sid.get_sid(egress_switch)
-                                                    }
-                                                }
-                                            }
-                                        ]
-                                    }
-                                }
-                            ]
-                        },
-                        "match": {
-                            "in-port": "1",
-                            "ethernet-match": {
-                                "ethernet-type": {
-                                    "type": 2054
-                                }
-                            }
-                        }
-                    }
-                ]
-            }
+        # without an SR table, send it out the way the top label goes
+        port = None
+        if SR_TABLE == 0:
+            flow = self.get_flow(ingress_switch,"flow:{}".format(latest_label))
+            if flow is not None and 'port' in flow:
+                port = flow['port']
 
-        order_action=3
+        return [
+            (ingress_switch, ip_id, render_service_ingress(ip_id, 2048, [ip_label] + labels, port)),
+            (ingress_switch, arp_id, render_service_ingress(arp_id, 2054, [arp_label] + labels, port)),
+            (egress_switch, ip_id, render_service_egress(ip_id, 2048, ip_label, egress_port)),
+            (egress_switch, arp_id, render_service_egress(arp_id, 2054, arp_label, egress_port))]
 
-        latest_label = sid.get_sid(egress_switch)
+    def add_services(self, services):
+        """ Add many services, both directions, writing their flows concurrently.
 
-        ## Add waypoints
-        for waypoint in reversed(waypoints):
-            if waypoint.startswith("openflow:"):
-                waypoint=sid.get_sid(waypoint)
-                latest_label=waypoint
+        Every flow of every service is rendered first. They are then
+        grouped by switch, and the flows of a switch are written in order
+        while several switches are written at once.
 
-            order_action = order_action + 1
-            push_mpls = {
-                "order": order_action,
-                "push-mpls-action": {
-                    "ethernet-type": 34887
-                }
-            }
-            ingress_ip['flow-node-inventory:flow'][0]['instructions']['instruction'][0]['apply-actions']['action'].append(push_mpls)
-            ingress_arp['flow-node-inventory:flow'][0]['instructions']['instruction'][0]['apply-actions']['action'].append(push_mpls)
-
-            order_action = order_action + 1
-            set_mpls = {
-                "order": order_action,
-                "set-field": {
-                    "protocol-match-fields": {
-                        "mpls-label": waypoint
-                    }
-                }
-            }
-            ingress_ip['flow-node-inventory:flow'][0]['instructions']['instruction'][0]['apply-actions']['action'].append(set_mpls)
-            ingress_arp['flow-node-inventory:flow'][0]['instructions']['instruction'][0]['apply-actions']['action'].append(set_mpls)
+        @param services: list of services as taken by add_service
+        @return: list of results, one per service in the same order, see
+                 service_result
 
+        """
 
-        if SR_TABLE > 0 :
-            ingress_ip['flow-node-inventory:flow'][0]['instructions']['instruction'].append(
-                {
-                    "order":1,
-                    "go-to-table":{
-                        "table_id":1
-                    }
-                }
-            )
-            ingress_arp['flow-node-inventory:flow'][0]['instructions']['instruction'].append(
-                {
-                    "order":1,
-                    "go-to-table":{
-                        "table_id":1
-                    }
-                }
-            )
+        results = []
+        writes = []
+        for service in services:
+            result = service_result(service)
+            results.append(result)
+            try:
+                flows = self.service_flows(service) + self.service_flows(reverse_service(service))
+            except KeyError, e:
+                result['error'] = "missing {}".format(e)
+                continue
+            except (ValueError, SidCollision), e:
+                result['error'] = str(e)
+                continue
+
+            for switch, id, payload in flows:
+                flow = {'switch': switch, 'id': id, 'status': None}
+                result['flows'].append(flow)
+                writes.append((flow, payload))
+
+        def write(flow, payload):
+            resp = self.put_flow(flow['switch'], 0, flow['id'], payload)
+            if resp is None:
+                return SERVICE_UNCHANGED
+            return resp.status_code
+
+        self.write_by_switch(writes, write)
+        return finish_service_results(results, [200, SERVICE_UNCHANGED])
+
+    def delete_services(self, services):
+        """ Delete many services, both directions, concurrently.
+
+        @param services: list of services as taken by delete_service
+        @return: list of results, one per service in the same order, see
+                 service_result
+
+        """
+
+        results = []
+        writes = []
+        for service in services:
+            result = service_result(service)
+            results.append(result)
+            try:
+                ids = service_flow_ids(service) + service_flow_ids(reverse_service(service))
+            except KeyError, e:
+                result['error'] = "missing {}".format(e)
+                continue
+
+            for switch, id in ids:
+                flow = {'switch': switch, 'id': id, 'status': None}
+                result['flows'].append(flow)
+                writes.append((flow, None))
+
+        def write(flow, payload):
+            resp = self.remove_flow(flow['switch'], 0, flow['id'])
+            if resp is None:
+                return SERVICE_UNCHANGED
+            return resp.status_code
+
+        self.write_by_switch(writes, write)
+        return finish_service_results(results, [200, 404, SERVICE_UNCHANGED])
+
+    def write_by_switch(self, writes, write):
+        """ Run writes grouped by switch, one thread per switch at most.
+
+        @param writes: list of (flow, payload), flow a dict with 'switch'
+                       whose 'status' is set to what write returns, or to
+                       the error if the controller could not be reached
+        @param write: function of flow and payload returning a status
+
+        """
+
+        switches = {}
+        for flow, payload in writes:
+            switches.setdefault(flow['switch'], []).append((flow, payload))
+
+        def run(switch):
+            for flow, payload in switches[switch]:
+                try:
+                    flow['status'] = write(flow, payload)
+                except (ConnectionError, Timeout), e:
+                    flow['status'] = str(e)
+
+        if len(switches) == 0:
+            return
+
+        pool = ThreadPool(min(len(switches), self.ctrl.config['pool_maxsize']))
+        try:
+            pool.map(run, switches.keys())
+        finally:
+            pool.close()
+            pool.join()
+
+    def remove_flow(self, name, table, id):
+        """ Delete one flow unless it is known to be gone
+
+        @param name: switch name
+        @param table: table id
+        @param id: inventory flow id
+        @return: the response, None if the delete was skipped
+
+        """
+
+        return self.remove_item(name, table, id, "table/{}/flow/{}".format(table,id))
+
+    def remove_item(self, name, table, id, path):
+        """ Delete a flow or group of a switch unless it is known to be gone
+
+        @param table: table id, or GROUPS, the item is shadowed under
+        @param path: where the item is, under the switch's node
+        @return: see remove_flow
+
+        """
+
+        self.check_shadow()
+
+        if self.shadow.absent(name, table, id):
+            self.shadow.count(skipped=1)
+            return None
+
+        self.shadow.count(sent=1)
+        resp = self.ctrl.http_delete_request(
+                   self.ctrl.get_config_url()+
+                   "/opendaylight-inventory:nodes/node/{}/{}".format(name,path))
+
+        if resp is not None and resp.status_code in (200, 404):
+            self.shadow.wrote(name, table, id, None)
         else:
-            order_action = order_action + 1
-            flow = self.get_flow(ingress_switch,"flow:{}".format(latest_label))
-            if flow is not None and 'port' in flow:
-                ingress_ip['flow-node-inventory:flow'][0]['instructions']['instruction'][0]['apply-actions']['action'].append(
-                    {
-                        "order": order_action,
-                        "output-action": {
-                            "output-node-connector":flow['port']
-                        }
-                    }
-                )
-                ingress_arp['flow-node-inventory:flow'][0]['instructions']['instruction'][0]['apply-actions']['action'].append(
-                    {
-                        "order": order_action,
-                        "output-action": {
-                            "output-node-connector":flow['port']
-                        }
-                    }
-                )
+            self.shadow.forget(name, table, id)
+        return resp
 
-        egress_ip = { "flow-node-inventory:flow": [
-                    {
-                        "id": ip_id,
-                        "table_id": 0,
-                        "hard-timeout": 0,
-                        "priority": FLOW_SERVICE_PRIORITY,
-                        "idle-timeout": 0,
-                        "instructions": {
-                            "instruction": [
-                                {
-                                    "order": 0,
-                                    "apply-actions": {
-                                        "action": [
-                                          {
-                                            "order": 0,
-                                            "pop-mpls-action": {
-                                              "ethernet-type": 2048
-                                            }
-                                          },
-                                          {
-                                              "order": 1,
-                                              "output-action": {
-                                                  "output-node-connector": egress_port
-                                              }
-                                          }
-                                        ]
-                                    }
-                                }
-                            ]
-                        },
-                        "match": {
-                            "protocol-match-fields": {
-                                "mpls-label": ip_label
-                            },
-                            "ethernet-match": {
-                                "ethernet-type": {
-                                    "type": 34887
-                                }
-                            }
-                        }
-                    }
-                ]
-            }
+    def put_group(self, name, id, type, buckets):
+        """ Write a group of a switch
 
-        egress_arp = { "flow-node-inventory:flow": [
-                    {
-                        "id": arp_id,
-                        "table_id": 0,
-                        "hard-timeout": 0,
-                        "priority": FLOW_SERVICE_PRIORITY,
-                        "idle-timeout": 0,
-                        "instructions": {
-                            "instruction": [
-                                {
-                                    "order": 0,
-                                    "apply-actions": {
-                                        "action": [
-                                          {
-                                            "order": 0,
-                                            "pop-mpls-action": {
-                                              "ethernet-type": 2054
-                                            }
-                                          },
-                                          {
-                                              "order": 1,
-                                              "output-action": {
-                                                  "output-node-connector": egress_port
-                                              }
-                                          }
-                                        ]
-                                    }
-                                }
-                            ]
-                        },
-                        "match": {
-                            "protocol-match-fields": {
-                                "mpls-label": arp_label
-                            },
-                            "ethernet-match": {
-                                "ethernet-type": {
-                                    "type": 34887
-                                }
-                            }
-                        }
-                    }
-                ]
-            }
+        @param name: switch name
+        @param id: group id
+        @param type: group type, e.g. GROUP_SELECT
+        @param buckets: list of (port, php, push) the group forwards over,
+                        see group_doc
+        @return: {'id': id} if written or unchanged, None on failure
 
-        resp = self.ctrl.http_put_request(
-                 self.ctrl.get_config_url()+
-                 "/opendaylight-inventory:nodes/node/{}/table/0/flow/{}".format(ingress_switch,ip_id)
-                 ,json.dumps(ingress_ip))
-        if resp.status_code != 200:
-            print resp.content
+        """
 
-        resp = self.ctrl.http_put_request(
-                 self.ctrl.get_config_url()+
-                 "/opendaylight-inventory:nodes/node/{}/table/0/flow/{}".format(ingress_switch,arp_id)
-                 ,json.dumps(ingress_arp))
-        if resp.status_code != 200:
-            print resp.content
+        resp = self.put_item(name, GROUPS, id, "group/{}".format(id),
+                             render_group(id, type, buckets))
+        if resp is not None and resp.status_code != 200:
+            LOG.error("group {} of {} not written: {} {}".format(id, name, resp.status_code, resp.text))
+            return None
+        return {'id': id}
 
-        resp = self.ctrl.http_put_request(
-                 self.ctrl.get_config_url()+
-                 "/opendaylight-inventory:nodes/node/{}/table/0/flow/{}".format(egress_switch,ip_id)
-                 ,json.dumps(egress_ip))
-        if resp.status_code != 200:
-            print resp.content
+    def delete_group(self, name, id):
+        """ Delete a group of a switch
 
-        resp = self.ctrl.http_put_request(
-                 self.ctrl.get_config_url()+
-                 "/opendaylight-inventory:nodes/node/{}/table/0/flow/{}".format(egress_switch,arp_id)
-                 ,json.dumps(egress_arp))
-        if resp.status_code != 200:
-            print resp.content
+        @return: {'id': id} if deleted or already gone, None on failure
 
-        return None
+        """
 
+        resp = self.remove_item(name, GROUPS, id, "group/{}".format(id))
+        if resp is not None and resp.status_code not in (200, 404):
+            LOG.error("group {} of {} not deleted: {} {}".format(id, name, resp.status_code, resp.text))
+            return None
+        return {'id': id}
 
     def delete_service(self, **kwargs):
         self.delete_service_unidirectional(**kwargs)
@@ -702,44 +1018,8 @@ class Client():
 
         """
 
-        ingress_switch = kwargs['service']['ingress_switch']
-        if not ingress_switch.startswith("openflow:"):
-            ingress_switch="openflow:"+ingress_switch
-
-        ingress_port = kwargs['service']['ingress_port']
-        if ingress_port.startswith(ingress_switch):
-            ingress_port=ingress_port.replace(ingress_switch,"")
-        #if not ingress_port.startswith("openflow:"):
-        #    ingress_port=ingress_switch+":"ingress_port
-
-        egress_switch = kwargs['service']['egress_switch']
-        if not egress_switch.startswith("openflow:"):
-            egress_switch="openflow:"+egress_switch
-
-        egress_port = kwargs['service']['egress_port']
-        if not egress_port.startswith("openflow:"):
-            egress_port=egress_switch+":"+egress_port
-
-
-        id = "service-" + ingress_switch + ":" + ingress_port + "-" + egress_port
-        ip_id = id +"-ip"
-        arp_id = id +"-arp"
-
-        self.ctrl.http_delete_request(
-                   self.ctrl.get_config_url()+
-                   "/opendaylight-inventory:nodes/node/{}/table/0/flow/{}".format(ingress_switch,ip_id))
-
-        self.ctrl.http_delete_request(
-                   self.ctrl.get_config_url()+
-                   "/opendaylight-inventory:nodes/node/{}/table/0/flow/{}".format(ingress_switch,arp_id))
-
-        self.ctrl.http_delete_request(
-                   self.ctrl.get_config_url()+
-                   "/opendaylight-inventory:nodes/node/{}/table/0/flow/{}".format(egress_switch,ip_id))
-
-        self.ctrl.http_delete_request(
-                   self.ctrl.get_config_url()+
-                   "/opendaylight-inventory:nodes/node/{}/table/0/flow/{}".format(egress_switch,arp_id))
+        for switch, id in service_flow_ids(kwargs['service']):
+            self.remove_flow(switch, 0, id)
 
 
 
@@ -757,6 +1037,18 @@ class Client():
         LOG.info("Subscription to stream replaced, url: {}".format(streamUrl))
         return create_connection(streamUrl)
 
+    def get_topology_events(self, **kwargs):
+        """ Long-lived topology change subscription
+
+        @param keepalive: seconds of silence before the websocket is pinged
+        @param backoff: first reconnect delay in seconds, doubled per failure
+        @param backoff_max: longest reconnect delay in seconds
+        @return: TopologyStream iterator of change notifications
+
+        """
+
+        return TopologyStream(self.ctrl, **kwargs)
+
 
 
 def is_sr_flow(id):
@@ -764,6 +1056,493 @@ def is_sr_flow(id):
         return True
     return False
 
+def is_node_flow(id):
+    """ True for a node sid flow the SR daemon owns, by inventory id """
+
+    return id is not None and id.startswith(NODE_FLOW_PREFIX)
+
+def is_php(penultimate):
+    """ True if the penultimate keyword asks for the label to be popped """
+
+    return (penultimate is not None
+        and (
+            (type(penultimate) is bool and penultimate)
+            or (type(penultimate) is not bool and unicode(penultimate) != u'false')))
+
+def sr_flow_id(flow):
+    """ Inventory flow id of an SR flow dict (see Client.add_flow) """
+
+    if 'flow_id' in flow:
+        return "src-" + flow['flow_id']
+    return "sra-" + flow['switch_id'] + "-" + str(flow['port']) + "-" + str(flow['label'])
+
+def sr_flow_doc(id, label, port, php):
+    """ Inventory flow matching an SR label and sending it out of a port """
+
+    r = {
+        "id": id,
+        "table_id": SR_TABLE,
+        "hard-timeout": 0,
+        "priority": FLOW_SR_PRIORITY,
+        "idle-timeout": 0,
+        "instructions": {
+            "instruction": [
+                {
+                    "order": 0,
+                    "apply-actions": {
+                        "action": [
+                          {
+                            "order": 2,
+                            "output-action": {
+                              "output-node-connector": port
+                            }
+                          }
+                        ]
+                    }
+                }
+            ]
+        },
+        "match": {
+            "protocol-match-fields": {
+                "mpls-label": label
+            },
+            "ethernet-match": {
+                "ethernet-type": {
+                    "type": 34887
+                }
+            }
+        }
+    }
+
+    if php:
+        r['instructions']['instruction'][0]['apply-actions']['action'].append(
+                {
+                  "order": 0,
+                  "pop-mpls-action": {
+                    "ethernet-type": 34887
+                  }
+                }
+                )
+
+    return r
+
+def sr_group_flow_doc(id, label, group):
+    """ Inventory flow matching an SR label and handing it to a group """
+
+    r = sr_flow_doc(id, label, None, False)
+    r['instructions']['instruction'][0]['apply-actions']['action'] = [
+        {
+            "order": 0,
+            "group-action": {
+                "group-id": group
+            }
+        }
+    ]
+    return r
+
+def port_number(port):
+    """ OpenFlow port number of a node connector id, None if it has none """
+
+    number = port.rsplit(':', 1)[-1]
+    if number.isdigit():
+        return int(number)
+    return None
+
+def bucket_doc(id, port, php, push=None, weight=None, watch=False):
+    """ Group bucket sending a packet out of a port
+
+    The label is popped if php, and the label push is pushed on top if
+    given. With watch the bucket is only used while the port is up.
+
+    """
+
+    actions = []
+    if php:
+        actions.append({"order": len(actions), "pop-mpls-action": {"ethernet-type": 34887}})
+    if push is not None:
+        actions.append({"order": len(actions), "push-mpls-action": {"ethernet-type": 34887}})
+        actions.append({"order": len(actions), "set-field": {"protocol-match-fields": {"mpls-label": push}}})
+    actions.append({"order": len(actions), "output-action": {"output-node-connector": port}})
+
+    r = {"bucket-id": id, "action": actions}
+    if weight is not None:
+        r['weight'] = weight
+    if watch and port_number(port) is not None:
+        r['watch_port'] = port_number(port)
+    return r
+
+def group_doc(id, type, buckets):
+    """ Inventory group of a type with buckets of (port, php, push)
+
+    Select buckets share the load evenly, and select and fast failover
+    buckets watch their port.
+
+    """
+
+    weight = None
+    if type == GROUP_SELECT:
+        weight = 1
+    watch = type in (GROUP_SELECT, GROUP_FAST_FAILOVER)
+
+    return {
+        "group-id": id,
+        "group-name": "sr-{}".format(id),
+        "group-type": type,
+        "barrier": False,
+        "buckets": {
+            "bucket": [bucket_doc(i, port, php, push, weight, watch)
+                       for i, (port, php, push) in enumerate(buckets)]
+        }
+    }
+
+def render_group(id, type, buckets):
+    """ JSON text of a group body, see group_doc """
+
+    return dumps({"flow-node-inventory:group": [group_doc(id, type, buckets)]})
+
+def group_key(group):
+    """ What a raw group does, as the key a GroupTable knows it by
+
+    @return: tuple of the group type and a tuple of (port, php, push)
+             per bucket in bucket id order, see group_doc; None if the
+             group is not one of ours
+
+    """
+
+    if not unicode(group.get('group-name', '')).startswith('sr-'):
+        return None
+
+    buckets = []
+    for bucket in sorted(group.get('buckets', {}).get('bucket', []),
+                         key=lambda b: b.get('bucket-id')):
+        port = push = None
+        php = False
+        for action in bucket.get('action', []):
+            if 'pop-mpls-action' in action:
+                php = True
+            elif 'set-field' in action:
+                push = '{}'.format(action['set-field']['protocol-match-fields']['mpls-label'])
+            elif 'output-action' in action:
+                port = action['output-action']['output-node-connector']
+        buckets.append((port, php, push))
+
+    return (group.get('group-type'), tuple(buckets))
+
+def goto_sr_flow_doc(id):
+    """ Table 0 flow sending MPLS packets on to the SR table """
+
+    return {
+        "id": id,
+        "table_id": 0,
+        "hard-timeout": 0,
+        "priority": FLOW_GO_TO_SR_PRIORITY,
+        "idle-timeout": 0,
+        "instructions": {
+            "instruction": [
+                {
+                    "order":0,
+                    "go-to-table":{
+                        "table_id":1
+                    }
+                }
+            ]
+        },
+        "match": {
+            "ethernet-match": {
+                "ethernet-type": {
+                    "type": 34887
+                }
+            }
+        }
+    }
+
+def service_ingress_doc(id, ethertype, instructions):
+    """ Table 0 flow pushing a service's label stack on its ingress switch """
+
+    return {
+        "id": id,
+        "table_id": 0,
+        "hard-timeout": 0,
+        "priority": FLOW_SERVICE_PRIORITY,
+        "idle-timeout": 0,
+        "instructions": {
+            "instruction": instructions
+        },
+        "match": {
+            "in-port": "1",
+            "ethernet-match": {
+                "ethernet-type": {
+                    "type": ethertype
+                }
+            }
+        }
+    }
+
+def service_egress_doc(id, ethertype, label, port):
+    """ Table 0 flow popping a service label on its egress switch """
+
+    return {
+        "id": id,
+        "table_id": 0,
+        "hard-timeout": 0,
+        "priority": FLOW_SERVICE_PRIORITY,
+        "idle-timeout": 0,
+        "instructions": {
+            "instruction": [
+                {
+                    "order": 0,
+                    "apply-actions": {
+                        "action": [
+                          {
+                            "order": 0,
+                            "pop-mpls-action": {
+                              "ethernet-type": ethertype
+                            }
+                          },
+                          {
+                              "order": 1,
+                              "output-action": {
+                                  "output-node-connector": port
+                              }
+                          }
+                        ]
+                    }
+                }
+            ]
+        },
+        "match": {
+            "protocol-match-fields": {
+                "mpls-label": label
+            },
+            "ethernet-match": {
+                "ethernet-type": {
+                    "type": 34887
+                }
+            }
+        }
+    }
+
+# Compiled once, see templates
+FLOW_BODY = Template({"flow-node-inventory:flow": [hole('flow')]})
+TABLE_BODY = Template({"flow-node-inventory:table": [{"id": hole('table'), "flow": hole('flows')}]})
+SR_FLOW = Template(sr_flow_doc(hole('id'), hole('label'), hole('port'), False))
+SR_FLOW_PHP = Template(sr_flow_doc(hole('id'), hole('label'), hole('port'), True))
+SR_FLOW_GROUP = Template(sr_group_flow_doc(hole('id'), hole('label'), hole('group')))
+GOTO_SR_FLOW = Template(goto_sr_flow_doc(hole('id')))
+SERVICE_INGRESS = Template(service_ingress_doc(hole('id'), hole('ethertype'), hole('instructions')))
+SERVICE_EGRESS = Template(service_egress_doc(hole('id'), hole('ethertype'), hole('label'), hole('port')))
+APPLY_ACTIONS = Template({"order": 0, "apply-actions": {"action": hole('actions')}})
+GO_TO_TABLE = Template({"order": 1, "go-to-table": {"table_id": hole('table')}})
+PUSH_MPLS = Template({"order": hole('order'), "push-mpls-action": {"ethernet-type": 34887}})
+SET_MPLS = Template({"order": hole('order'), "set-field": {"protocol-match-fields": {"mpls-label": hole('label')}}})
+OUTPUT = Template({"order": hole('order'), "output-action": {"output-node-connector": hole('port')}})
+
+def render_flow_sr(flow):
+    """ JSON text of the inventory flow for an SR flow dict
+
+    Same flow as sr_flow_doc or sr_group_flow_doc builds, without
+    building the document.
+
+    @return: tuple of flow id and JSON text
+
+    """
+
+    id = sr_flow_id(flow)
+    if flow.get('group') is not None:
+        return id, SR_FLOW_GROUP.render(id=id, label=flow['label'], group=flow['group'])
+    if is_php(flow['penultimate']):
+        template = SR_FLOW_PHP
+    else:
+        template = SR_FLOW
+    return id, template.render(id=id, label=flow['label'], port=flow['port'])
+
+def written_flow_sr(flow):
+    """ An SR flow dict as get_flows would return it once written
+
+    Same as transfor_flow_sr of the render_flow_sr flow.
+
+    """
+
+    id = sr_flow_id(flow)
+    r = {
+        'id': id.replace("src-","",1) if id.startswith("src-") else id,
+        'name': flow['switch_id'],
+        'label': flow['label']
+    }
+    if flow.get('group') is not None:
+        r['group'] = flow['group']
+        return r
+    r['port'] = flow['port']
+    if is_php(flow['penultimate']):
+        r['penultimate'] = True
+    return r
+
+def sr_flow_of(flow):
+    """ The SR flow dict that writes a flow as written_flow_sr returns it """
+
+    r = {
+        'switch_id': flow['name'],
+        'label': flow['label'],
+        'port': flow.get('port'),
+        'penultimate': flow.get('penultimate', False)
+    }
+    # sra- ids are made from the switch, port and label again
+    if not flow['id'].startswith("sra-"):
+        r['flow_id'] = flow['id']
+    if flow.get('group') is not None:
+        r['group'] = flow['group']
+    return r
+
+def render_service_ingress(id, ethertype, labels, port=None):
+    """ JSON text of a service's ingress flow
+
+    @param labels: label stack, pushed in order so the last one is on top
+    @param port: output port, only used when there is no SR table to go to
+
+    """
+
+    actions = []
+    for label in labels:
+        actions.append(PUSH_MPLS.render(order=len(actions)))
+        actions.append(SET_MPLS.render(order=len(actions), label=label))
+
+    if SR_TABLE == 0 and port is not None:
+        actions.append(OUTPUT.render(order=len(actions), port=port))
+
+    instructions = [APPLY_ACTIONS.render(actions=raw_list(actions))]
+    if SR_TABLE > 0:
+        instructions.append(GO_TO_TABLE.render(table=1))
+
+    return FLOW_BODY.render(flow=Raw(SERVICE_INGRESS.render(
+        id=id, ethertype=ethertype, instructions=raw_list(instructions))))
+
+def render_service_egress(id, ethertype, label, port):
+    """ JSON text of a service's egress flow """
+
+    return FLOW_BODY.render(flow=Raw(SERVICE_EGRESS.render(
+        id=id, ethertype=ethertype, label=label, port=port)))
+
+def service_endpoints(service):
+    """ Switches, ports and flow id prefix of one direction of a service
+
+    @return: tuple of ingress switch, ingress port, egress switch, egress
+             port and the id its flow ids start with
+
+    """
+
+    ingress_switch = service['ingress_switch']
+    if not ingress_switch.startswith("openflow:"):
+        ingress_switch="openflow:"+ingress_switch
+
+    ingress_port = service['ingress_port']
+    if ingress_port.startswith(ingress_switch):
+        ingress_port=ingress_port.replace(ingress_switch,"")
+    #if not ingress_port.startswith("openflow:"):
+    #    ingress_port=ingress_switch+":"ingress_port
+
+    egress_switch = service['egress_switch']
+    if not egress_switch.startswith("openflow:"):
+        egress_switch="openflow:"+egress_switch
+
+    egress_port = service['egress_port']
+    if not egress_port.startswith("openflow:"):
+        egress_port=egress_switch+":"+egress_port
+
+    id = "service-" + ingress_switch + ":" + ingress_port + "-" + egress_port
+    return ingress_switch, ingress_port, egress_switch, egress_port, id
+
+def service_flow_ids(service):
+    """ (switch name, flow id) of the four flows of one direction of a service """
+
+    ingress_switch, ingress_port, egress_switch, egress_port, id = service_endpoints(service)
+    return [(ingress_switch, id + "-ip"), (ingress_switch, id + "-arp"),
+            (egress_switch, id + "-ip"), (egress_switch, id + "-arp")]
+
+def reverse_service(service):
+    """ The other direction of a service, as add_service programs it """
+
+    r = dict(service)
+    r['ingress_switch'] = service['egress_switch']
+    r['ingress_port'] = service['egress_port']
+    r['egress_switch'] = service['ingress_switch']
+    r['egress_port'] = service['ingress_port']
+    if 'waypoints' in service:
+        r['waypoints'] = list(reversed(service['waypoints']))
+    return r
+
+def service_result(service):
+    """ Result of a bulk service call for one service
+
+    'service' is the service as given, 'flows' a list of {'switch', 'id',
+    'status'} for both directions, status being the HTTP status code,
+    SERVICE_UNCHANGED if nothing had to be sent, or the error if the
+    controller could not be reached. 'error' says why the service could
+    not be rendered, and 'ok' whether every flow went through.
+
+    """
+
+    return {'service': service, 'flows': [], 'error': None, 'ok': False}
+
+def finish_service_results(results, good):
+    """ Set 'ok' of service results, good being the statuses that count as done """
+
+    for result in results:
+        result['ok'] = (result['error'] is None
+                        and all([flow['status'] in good for flow in result['flows']]))
+    return results
+
+def sr_inventory_id(id):
+    """ Inventory id of an SR flow id as given by the user or get_flows
+
+    get_flows strips the src- of ids given by the user, sra- and other
+    sr ids are returned as they are.
+
+    """
+
+    if not is_sr_flow(id):
+        id = "src-" + id
+    return id
+
+def is_sr_flow_object(flow):
+    return is_sr_flow(flow.get('id'))
+
+def index_inventory(nodes):
+    """ Index SR flows by switch, table and id (see get_inventory_snapshot)
+
+    @param nodes: dict of switch name to table id to list of raw flows,
+                  as returned by jsonstream.inventory_flows
+    @return: dict of switch name to table id to flow id to flow, and to
+             GROUPS to group id to group
+
+    """
+
+    r = {}
+    for name, tables in nodes.items():
+        r[name] = {}
+        for table, flows in tables.items():
+            if table == jsonstream.GROUP:
+                r[name][GROUPS] = dict([(int(g['group-id']), g) for g in flows])
+                continue
+            r[name][table] = {}
+            for flow in flows:
+                if is_sr_flow(flow.get('id')):
+                    f = transfor_flow_sr(name, flow)
+                    r[name][table][f['id']] = f
+
+    return r
+
+def flows_equal(f1, f2):
+    """ Compare two flows as returned by transfor_flow_sr (None is absent) """
+
+    if f1 is None or f2 is None:
+        return f1 is None and f2 is None
+
+    for key in ['label', 'port', 'group']:
+        if unicode(f1.get(key)) != unicode(f2.get(key)):
+            return False
+
+    return f1.get('penultimate', False) == f2.get('penultimate', False)
+
 def transfor_flow_sr(name,flow):
     r = {
         'id':flow['id'],
@@ -793,5 +1572,7 @@ def transfor_flow_sr(name,flow):
                 r['penultimate']=True
             if 'output-action' in action and 'output-node-connector' in action['output-action']:
                 r['port']=action['output-action']['output-node-connector']
+            if 'group-action' in action and 'group-id' in action['group-action']:
+                r['group']=action['group-action']['group-id']
 
     return r
@@ -1,16 +1,143 @@
 import os
+import time
 import json
 import logging
+import threading
 import argparse
 import requests
 import xmltodict
 
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from requests.exceptions import ConnectionError, Timeout
+from collections import deque
 
 
 LOG = logging.getLogger(__name__)
 
+#-------------------------------------------------------------------------------
+# Class 'ConcurrencyLimit'
+#-------------------------------------------------------------------------------
+class ConcurrencyLimit():
+    """ Bounds the requests in flight to the controller and adapts the bound.
+
+    The limit grows by one for every limit requests that come back fine
+    and quickly (additive increase), and is cut by the backoff factor when
+    a request fails, times out or takes longer than the latency target
+    (multiplicative decrease). Only requests started after the last cut
+    can cut it again, so one slow burst counts once. Bulk requests, whole
+    tables and inventories, are slow because they are big, so only their
+    failures cut the limit.
+
+    Latency and errors are kept per verb over the last window requests.
+
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=32, latency=1.0,
+                 backoff=0.5, window=100):
+        """Initializes this object properties."""
+
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.limit = min(max(float(initial), self.minimum), self.maximum)
+        self.latency = float(latency)
+        self.backoff = float(backoff)
+        self.window = int(window)
+
+        self.in_flight = 0
+        self.last_cut = 0
+        self.cond = threading.Condition()
+
+        # verb -> deque of (latency, error)
+        self.samples = {}
+
+    def acquire(self):
+        """ Wait for a free slot.
+
+        :return: the start time to hand back to release()
+
+        """
+
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+        return time.time()
+
+    def release(self, verb, start, error=False, bulk=False):
+        """ Record a finished request and adjust the limit.
+
+        :param string verb: HTTP verb of the request
+        :param float start: time returned by acquire()
+        :param bool error: the request failed in a way that points at an
+                           overloaded controller (5xx, timeout, no connection)
+        :param bool bulk: the request carried a whole table or more, so its
+                          latency says little about the controller's load
+
+        """
+
+        now = time.time()
+        latency = now - start
+
+        with self.cond:
+            self.in_flight -= 1
+
+            if verb not in self.samples:
+                self.samples[verb] = deque(maxlen=self.window)
+            self.samples[verb].append((latency, error))
+
+            if error or (latency > self.latency and not bulk):
+                if start > self.last_cut:
+                    self.limit = max(self.limit * self.backoff, self.minimum)
+                    self.last_cut = now
+                    LOG.debug("{} took {:.3f}s{}, limit down to {}".format(
+                        verb, latency, " and failed" if error else "",
+                        int(self.limit)))
+            else:
+                self.limit = min(self.limit + 1.0 / self.limit, self.maximum)
+
+            self.cond.notify_all()
+
+    def current(self):
+        """ Requests allowed in flight right now. """
+        return int(self.limit)
+
+    def stats(self):
+        """ Rolling statistics per verb.
+
+        :return: dict of verb -> dict with count, p50 and p99 latency in
+                 seconds, and error rate
+        :rtype: dict
+
+        """
+
+        with self.cond:
+            samples = dict([(v, list(s)) for v, s in self.samples.items()])
+
+        r = {}
+        for verb, s in samples.items():
+            latencies = sorted([l for l, e in s])
+            errors = len([e for l, e in s if e])
+            r[verb] = { 'count': len(s),
+                        'p50': percentile(latencies, 0.50),
+                        'p99': percentile(latencies, 0.99),
+                        'errors': float(errors) / len(s) }
+        return r
+
+    def __str__(self):
+        verbs = ["{} p50 {:.3f}s p99 {:.3f}s errors {:.0%}".format(
+                     v, s['p50'], s['p99'], s['errors'])
+                 for v, s in sorted(self.stats().items())]
+        return "limit {}, {} in flight; {}".format(
+            self.current(), self.in_flight, ", ".join(verbs) or "no requests")
+
+def percentile(values, q):
+    """ q-th quantile of an already sorted list. """
+
+    if not values:
+        return 0.0
+    return values[int(round(q * (len(values) - 1)))]
+
 #-------------------------------------------------------------------------------
 # Class 'Controller'
 #-------------------------------------------------------------------------------
@@ -29,13 +156,33 @@ class Controller():
         self.default_headers = {
             'content-type': 'application/json', 'accept': 'application/json'}
 
+        # Long-lived session shared by every request to this controller
+        self.session = self.create_session()
+
+        # Requests that failed to connect or timed out, see Client.shadow
+        self.connection_losses = 0
+
+        # Adaptive bound on the requests in flight, see ConcurrencyLimit
+        self.limiter = ConcurrencyLimit(initial=self.config['limit_initial'],
+                                        minimum=self.config['limit_min'],
+                                        maximum=self.config['limit_max'],
+                                        latency=self.config['limit_latency'],
+                                        backoff=self.config['limit_backoff'],
+                                        window=self.config['limit_window'])
+
     def check_config(self, cfg):
         """Check properties and supply defaults."""
 
         req_props = ['ip', 'port', 'username', 'password']
 
         # defaults
-        props = { 'protocol': 'http', 'timeout': 30 }
+        props = { 'protocol': 'http', 'timeout': 30,
+                  'pool_connections': 10, 'pool_maxsize': 32,
+                  'pool_block': False, 'stream_keepalive': 30,
+                  'stream_backoff': 1, 'stream_backoff_max': 60,
+                  'limit_initial': None, 'limit_min': 1, 'limit_max': None,
+                  'limit_latency': 1.0, 'limit_backoff': 0.5,
+                  'limit_window': 100 }
 
         for prop in req_props:
             if prop not in cfg:
@@ -44,8 +191,85 @@ class Controller():
         # Update defaults with given props
         props.update(cfg)
 
+        # Pool sizes may come from the environment as strings
+        props['pool_connections'] = int(props['pool_connections'])
+        props['pool_maxsize'] = int(props['pool_maxsize'])
+        if type(props['pool_block']) is not bool:
+            props['pool_block'] = unicode(props['pool_block']).lower() == u'true'
+
+        # No point having more in flight than pooled connections, and
+        # the limit starts at the bottom and probes up from there
+        if props['limit_max'] is None:
+            props['limit_max'] = props['pool_maxsize']
+        if props['limit_initial'] is None:
+            props['limit_initial'] = props['limit_min']
+        props['limit_initial'] = float(props['limit_initial'])
+
         return props
 
+    def create_session(self):
+        """Build a keep-alive session with a pooled adapter per scheme.
+
+        :param int pool_connections: number of per-host pools to cache
+        :param int pool_maxsize: connections kept open to each host
+        :param bool pool_block: wait for a free connection instead of
+                                opening an extra one when the pool is full
+        :return: The session used for every request to the controller.
+        :rtype: `requests.Session`
+
+        """
+
+        session = requests.Session()
+        session.auth = HTTPBasicAuth(self.config['username'],
+                                     self.config['password'])
+        session.headers.update({'connection': 'keep-alive'})
+
+        adapter = HTTPAdapter(pool_connections=self.config['pool_connections'],
+                              pool_maxsize=self.config['pool_maxsize'],
+                              pool_block=self.config['pool_block'])
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        return session
+
+    def close(self):
+        """Release every pooled connection held by the session."""
+        self.session.close()
+
+    def request(self, verb, url, bulk=False, **kwargs):
+        """ Send a request on the session within the concurrency limit.
+
+        :param string verb: HTTP verb, GET, POST, PUT or DELETE
+        :param string url: The complete url including protocol
+        :param bool bulk: a whole table or more, see ConcurrencyLimit.release
+        :return: The response from the http request.
+        :rtype: `requests.response`
+
+        """
+
+        start = self.limiter.acquire()
+        error = True
+        try:
+            resp = self.session.request(verb, url, **kwargs)
+            error = resp.status_code >= 500
+            return resp
+        except (ConnectionError, Timeout):
+            # the controller may have restarted and lost what we wrote
+            self.connection_losses += 1
+            raise
+        finally:
+            self.limiter.release(verb, start, error, bulk)
+
+    def get_limit(self):
+        """ Number of requests currently allowed in flight. """
+        return self.limiter.current()
+
+    def get_stats(self):
+        """ Rolling p50/p99 latency and error rate per verb,
+            see ConcurrencyLimit.stats.
+        """
+        return self.limiter.stats()
+
     def __str__(self):
         """ Returns string representation of this object. """
         return str(vars(self))
@@ -69,7 +293,7 @@ class Controller():
         return json.dumps(d, default=lambda o: o.__dict__, sort_keys=True,
                           indent=4)
 
-    def http_get_request(self, url, headers=None, timeout=None):
+    def http_get_request(self, url, headers=None, timeout=None, stream=False, bulk=False):
         """ Sends HTTP GET request to a remote server
             and returns the response.
 
@@ -79,6 +303,9 @@ class Controller():
                             Typically set to None.
         :param dict headers: The headers to include in the request.
         :param string timeout: Pass a timeout for longlived queries
+        :param bool stream: Leave the body unread, to be consumed from
+                            resp.raw; the caller must close the response
+        :param bool bulk: Reads a whole table or more, see request
         :return: The response from the http request.
         :rtype: None or `requests.response`
             <http://docs.python-requests.org/en/latest/api/#requests.Response>
@@ -92,11 +319,9 @@ class Controller():
         if timeout is None:
             timeout = self.config['timeout']
 
-        resp = requests.get(url,
-                                auth=HTTPBasicAuth(self.config['username'],
-                                                   self.config['password']),
+        resp = self.request('GET', url,
                                 data=None, headers=headers,
-                                timeout=timeout)
+                                timeout=timeout, stream=stream, bulk=bulk)
         if resp is not None:
             if resp.status_code == 200:
                 LOG.debug("found {}".format(url))
@@ -128,9 +353,7 @@ class Controller():
 
         resp = None
 
-        resp = requests.post(url,
-                                 auth=HTTPBasicAuth(self.config['username'],
-                                                    self.config['password']),
+        resp = self.request('POST', url,
                                  data=data, headers=headers,
                                  timeout=self.config['timeout'])
 
@@ -142,7 +365,7 @@ class Controller():
 
         return (resp)
 
-    def http_put_request(self, url, data, headers=None):
+    def http_put_request(self, url, data, headers=None, bulk=False):
         """ Sends HTTP PUT request to a remote server
             and returns the response.
 
@@ -151,6 +374,7 @@ class Controller():
         :param string data: The data to include in the body of the request.
                             Typically set to None.
         :param dict headers: The headers to include in the request.
+        :param bool bulk: Writes a whole table, see request
         :return: The response from the http request.
         :rtype: None or `requests.response`
             <http://docs.python-requests.org/en/latest/api/#requests.Response>
@@ -162,11 +386,9 @@ class Controller():
 
         resp = None
 
-        resp = requests.put(url,
-                                auth=HTTPBasicAuth(self.config['username'],
-                                                   self.config['password']),
+        resp = self.request('PUT', url,
                                 data=data, headers=headers,
-                                timeout=self.config['timeout'])
+                                timeout=self.config['timeout'], bulk=bulk)
 
         if resp is not None:
             if resp.status_code == 200:
@@ -196,9 +418,7 @@ class Controller():
 
         resp = None
 
-        resp = requests.delete(url,
-                                   auth=HTTPBasicAuth(self.config['username'],
-                                                      self.config['password']),
+        resp = self.request('DELETE', url,
                                    data=data, headers=headers,
                                    timeout=self.config['timeout'])
 
@@ -238,7 +458,8 @@ class Controller():
                         <scope xmlns="urn:sal:restconf:event:subscription">SUBTREE</scope> \
                     </input>'
 
-        r = requests.post(url, data=payload, headers=headers, auth=HTTPBasicAuth(self.config['username'], self.config['password']))
+        r = self.request('POST', url, data=payload, headers=headers,
+                              timeout=self.config['timeout'])
 
         streamName = r.text
         #print streamName
@@ -264,6 +485,7 @@ class Controller():
         #print url
         headers = {'content-type': 'application/json',
                     'accept': 'application/json'}
-        r = requests.get(url, headers=headers, auth=HTTPBasicAuth(self.config['username'], self.config['password']))
+        r = self.request('GET', url, headers=headers,
+                             timeout=self.config['timeout'])
         streamListenUrl = r.headers['location']
         return streamListenUrl
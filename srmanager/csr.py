@@ -0,0 +1,333 @@
+#
+# Compact topology graph
+#
+# Node and port ids are interned to integers and the adjacency is kept in
+# CSR form: the neighbours of node i are indices[indptr[i]:indptr[i+1]],
+# sorted, and ports holds the port each of those edges leaves by. NumPy
+# arrays are used when it is installed, the array module otherwise.
+#
+
+import bisect
+from array import array
+from collections import deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+UNREACHED = -1
+
+def int_array(values):
+    '''compact array of ints'''
+
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.int32)
+    return array('i', values)
+
+class Neighbours():
+    '''read only view of the neighbours of a node
+
+    Behaves like a networkx adjacency dict, so graph[snode][nnode]['source-tp']
+    reads the same on either kind of graph.
+    '''
+
+    def __init__(self, csr, i):
+        self.csr = csr
+        self.i = i
+
+    def __getitem__(self, name):
+        k = self.csr.edge(self.i, self.csr.index.get(name))
+        if k is None:
+            raise KeyError(name)
+        return {'source-tp': self.csr.port_names[self.csr.ports[k]]}
+
+    def __iter__(self):
+        names = self.csr.names
+        for j in self.csr.neighbours(self.i):
+            yield names[j]
+
+    def __contains__(self, name):
+        return self.csr.edge(self.i, self.csr.index.get(name)) is not None
+
+    def __len__(self):
+        return int(self.csr.indptr[self.i+1] - self.csr.indptr[self.i])
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+class CSRGraph():
+    '''directed topology graph held in integer arrays
+
+    Read only: a new topology is a new graph. It answers the parts of the
+    networkx DiGraph API the SR engine uses, and finds shortest paths
+    over the arrays themselves.
+    '''
+
+    def __init__(self, nodes, edges, graph=None):
+        '''graph of nodes and (source, target, port) edges
+
+        Nodes are numbered in sorted order, so walking neighbours by
+        number visits them in the same order as sorting their names.
+        '''
+
+        # graph attributes, as DiGraph.graph
+        self.graph = dict(graph or {})
+
+        edges = list(edges)
+        names = set(nodes)
+        for u, v, port in edges:
+            names.add(u)
+            names.add(v)
+
+        self.names = sorted(names)
+        self.index = dict([(name, i) for i, name in enumerate(self.names)])
+
+        self.port_names = []
+        self.port_index = {}
+
+        # one edge per pair, the last one given wins as with add_edge
+        rows = [{} for name in self.names]
+        for u, v, port in edges:
+            rows[self.index[u]][self.index[v]] = self.intern_port(port)
+
+        indptr = [0]
+        indices = []
+        ports = []
+        for row in rows:
+            for j in sorted(row):
+                indices.append(j)
+                ports.append(row[j])
+            indptr.append(len(indices))
+
+        self.indptr = int_array(indptr)
+        self.indices = int_array(indices)
+        self.ports = int_array(ports)
+
+        # predecessors, built on first use
+        self.reverse = None
+
+    @classmethod
+    def from_graph(cls, g):
+        '''compact copy of a networkx graph with 'source-tp' edges'''
+
+        return cls(g.nodes(),
+                   [(u, v, d['source-tp']) for u, v, d in g.edges(data=True)],
+                   g.graph)
+
+    @classmethod
+    def from_arrays(cls, names, indptr, indices):
+        '''graph over already numbered nodes and CSR arrays, without ports'''
+
+        g = cls([], [])
+        g.names = list(names)
+        g.index = dict([(name, i) for i, name in enumerate(g.names)])
+        g.indptr = int_array(indptr)
+        g.indices = int_array(indices)
+        g.ports = int_array([UNREACHED] * len(indices))
+        return g
+
+    def to_networkx(self):
+        '''networkx DiGraph with the same nodes, edges and ports'''
+
+        import networkx as nx
+
+        g = nx.DiGraph()
+        g.graph.update(self.graph)
+        g.add_nodes_from(self.names)
+        for u, v, d in self.edges(data=True):
+            g.add_edge(u, v, **d)
+        return g
+
+    def intern_port(self, port):
+        '''number of a port id'''
+
+        p = self.port_index.get(port)
+        if p is None:
+            p = self.port_index[port] = len(self.port_names)
+            self.port_names.append(port)
+        return p
+
+    def neighbours(self, i):
+        '''numbers of the neighbours of node number i'''
+
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def edge(self, i, j):
+        '''position of the edge i -> j in indices, None if there is none'''
+
+        if i is None or j is None:
+            return None
+        lo = self.indptr[i]
+        hi = self.indptr[i+1]
+        k = bisect.bisect_left(self.indices, j, lo, hi)
+        if k < hi and self.indices[k] == j:
+            return k
+        return None
+
+    #
+    # DiGraph API
+    #
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        return Neighbours(self, self.index[name])
+
+    def nodes(self):
+        return list(self.names)
+
+    def number_of_nodes(self):
+        return len(self.names)
+
+    def number_of_edges(self):
+        return len(self.indices)
+
+    def has_node(self, name):
+        return name in self.index
+
+    def has_edge(self, u, v):
+        return self.edge(self.index.get(u), self.index.get(v)) is not None
+
+    def edges(self, data=False):
+        '''list of (source, target), with a 'source-tp' dict if data'''
+
+        r = []
+        for i, u in enumerate(self.names):
+            for k in xrange(self.indptr[i], self.indptr[i+1]):
+                v = self.names[self.indices[k]]
+                if data:
+                    r.append((u, v, {'source-tp': self.port_names[self.ports[k]]}))
+                else:
+                    r.append((u, v))
+        return r
+
+    def successors(self, name):
+        return list(self[name])
+
+    def predecessors(self, name):
+        if self.reverse is None:
+            self.reverse = [[] for n in self.names]
+            for i in xrange(len(self.names)):
+                for j in self.neighbours(i):
+                    self.reverse[j].append(i)
+        return [self.names[i] for i in self.reverse[self.index[name]]]
+
+    def copy(self):
+        '''the graph itself, it is never modified'''
+
+        return self
+
+    #
+    # Searches
+    #
+
+    def bfs(self, src):
+        '''hop counts and first hops from node number src
+
+        Nodes are reached in the order a queue visiting neighbours by
+        number reaches them, and inherit the first hop of the node they
+        were reached from.
+
+        @return: tuple of arrays indexed by node number, the hops from
+                 src and the number of the first hop, UNREACHED for
+                 nodes without a path
+        '''
+
+        if numpy is not None:
+            return self.bfs_levels(src)
+
+        n = len(self.names)
+        dist = [UNREACHED] * n
+        hop = [UNREACHED] * n
+        dist[src] = 0
+
+        queue = deque()
+        for j in self.neighbours(src):
+            if dist[j] == UNREACHED:
+                dist[j] = 1
+                hop[j] = j
+                queue.append(j)
+
+        indptr = self.indptr
+        indices = self.indices
+        while queue:
+            i = queue.popleft()
+            for k in xrange(indptr[i], indptr[i+1]):
+                j = indices[k]
+                if dist[j] == UNREACHED:
+                    dist[j] = dist[i] + 1
+                    hop[j] = hop[i]
+                    queue.append(j)
+
+        return (dist, hop)
+
+    def bfs_levels(self, src):
+        '''bfs one whole level at a time with NumPy'''
+
+        n = len(self.names)
+        dist = numpy.full(n, UNREACHED, dtype=numpy.int32)
+        hop = numpy.full(n, UNREACHED, dtype=numpy.int32)
+        dist[src] = 0
+
+        frontier = numpy.array([src], dtype=numpy.int32)
+        level = 0
+        while len(frontier) > 0:
+            level += 1
+
+            # every edge out of the frontier, in queue order
+            starts = self.indptr[frontier]
+            counts = self.indptr[frontier + 1] - starts
+            total = counts.sum()
+            if total == 0:
+                break
+            firsts = numpy.cumsum(counts) - counts
+            pos = numpy.repeat(starts - firsts, counts) + numpy.arange(total)
+            found = self.indices[pos]
+            parents = numpy.repeat(frontier, counts)
+
+            fresh = dist[found] == UNREACHED
+            found = found[fresh]
+            parents = parents[fresh]
+            if len(found) == 0:
+                break
+
+            # a node belongs to the first edge that reached it
+            found, first = numpy.unique(found, return_index=True)
+            order = numpy.argsort(first)
+            frontier = found[order]
+            first = first[order]
+
+            dist[frontier] = level
+            if level == 1:
+                hop[frontier] = frontier
+            else:
+                hop[frontier] = hop[parents[first]]
+
+        return (dist, hop)
+
+    def shortest_paths(self, src):
+        '''dicts of target name -> next hop name and -> hops, as NextHopTable.spf'''
+
+        s = self.index[src]
+        dist, hop = self.bfs(s)
+        if numpy is not None:
+            reached = numpy.nonzero(hop != UNREACHED)[0].tolist()
+            hop = hop.tolist()
+            dist = dist.tolist()
+        else:
+            reached = [j for j in xrange(len(hop)) if hop[j] != UNREACHED]
+
+        names = self.names
+        return (dict([(names[j], names[hop[j]]) for j in reached]),
+                dict([(names[j], dist[j]) for j in reached]))
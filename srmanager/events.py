@@ -0,0 +1,204 @@
+#
+# Topology data change events
+#
+
+import re
+import json
+import logging
+import xmltodict
+from xml.parsers.expat import ExpatError
+
+LOG = logging.getLogger(__name__)
+
+# /nt:network-topology/nt:topology[nt:topology-id='flow:1']/nt:link[nt:link-id='openflow:1:1']
+PATH_KEY = re.compile(r"(?:[\w.-]+:)?(node|link)\[(?:[\w.-]+:)?(?:node|link)-id='([^']*)'\](.*)$")
+
+class TopologyEventException(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return repr(self.msg)
+
+class TopologyDelta():
+    '''Node and link changes carried by one data change notification'''
+
+    def __init__(self):
+        '''empty delta'''
+
+        self.added_nodes = []
+        self.removed_nodes = []
+
+        # link id -> (source node, dest node, source tp, dest tp)
+        self.added_links = {}
+        self.removed_links = []
+
+    def merge(self, other):
+        '''fold a later delta into this one, keeping the net change
+
+        Removals are applied before additions, so something removed and
+        added again within the batch keeps both, while something added
+        and removed again is only removed.
+        '''
+
+        for n in other.removed_nodes:
+            if n in self.added_nodes:
+                self.added_nodes.remove(n)
+            if n not in self.removed_nodes:
+                self.removed_nodes.append(n)
+            for id, link in self.added_links.items():
+                if n in link[:2]:
+                    del self.added_links[id]
+
+        for id in other.removed_links:
+            self.added_links.pop(id, None)
+            if id not in self.removed_links:
+                self.removed_links.append(id)
+
+        for n in other.added_nodes:
+            if n not in self.added_nodes:
+                self.added_nodes.append(n)
+
+        self.added_links.update(other.added_links)
+
+        return self
+
+    def __len__(self):
+        return (len(self.added_nodes) + len(self.removed_nodes)
+                + len(self.added_links) + len(self.removed_links))
+
+    def __str__(self):
+        return "{} nodes added, {} removed, {} links added, {} removed".format(
+            len(self.added_nodes), len(self.removed_nodes),
+            len(self.added_links), len(self.removed_links))
+
+
+def strip_prefixes(obj):
+    '''drop module prefixes from keys (network-topology:link -> link)'''
+
+    if isinstance(obj, dict):
+        return dict([(k.split(':')[-1], strip_prefixes(v)) for k, v in obj.items()])
+    if isinstance(obj, list):
+        return [strip_prefixes(v) for v in obj]
+    return obj
+
+def as_list(obj):
+    '''single xml elements come back as a dict, repeated ones as a list'''
+
+    if obj is None:
+        return []
+    if isinstance(obj, list):
+        return obj
+    return [obj]
+
+def text(obj):
+    '''text of an element that may also carry attributes'''
+
+    if isinstance(obj, dict):
+        return obj.get('#text')
+    return obj
+
+def parse_events(payload):
+    '''list of data change events in an XML or JSON notification'''
+
+    payload = payload.strip()
+    if payload.startswith('{'):
+        doc = strip_prefixes(json.loads(payload))
+    else:
+        doc = strip_prefixes(xmltodict.parse(payload))
+
+    notification = doc.get('notification', doc)
+    changed = notification.get('data-changed-notification')
+    if changed is None:
+        raise TopologyEventException("no data-changed-notification in event")
+
+    return as_list(changed.get('data-change-event'))
+
+def parse_link(link):
+    '''(source node, dest node, source tp, dest tp) of a topology link'''
+
+    return (link['source']['source-node'], link['destination']['dest-node'],
+            link['source']['source-tp'], link['destination']['dest-tp'])
+
+def parse_topology_event(payload):
+    '''turn a data change notification into a TopologyDelta
+
+    Host nodes and links are left out, as in SR.get_topology. Changes
+    below a node or link that we cannot attribute to the whole node or
+    link make the delta unusable.
+
+    @param payload: notification text from the topology stream
+    @return: TopologyDelta, or None if the notification can't be used
+    '''
+
+    try:
+        events = parse_events(payload)
+
+        delta = TopologyDelta()
+        whole = set()
+        partial = []
+
+        for event in events:
+            path = text(event.get('path')) or ''
+            operation = text(event.get('operation'))
+
+            m = PATH_KEY.search(path)
+            if m is None:
+                # the topology itself or something outside nodes and links
+                LOG.debug("ignoring topology event on {}".format(path))
+                continue
+
+            kind, id, rest = m.groups()
+            if id.find('host') != -1:
+                continue
+
+            if rest.find('termination-point') != -1:
+                continue
+            if rest:
+                partial.append((kind, id))
+                continue
+
+            whole.add((kind, id))
+            if kind == 'node':
+                if operation == 'deleted':
+                    delta.removed_nodes.append(id)
+                else:
+                    delta.added_nodes.append(id)
+            else:
+                if operation == 'deleted':
+                    delta.removed_links.append(id)
+                else:
+                    data = event.get('data') or {}
+                    links = as_list(data.get('link'))
+                    if len(links) == 0:
+                        raise TopologyEventException("link {} without data".format(id))
+                    delta.added_links[id] = parse_link(links[0])
+
+        for key in partial:
+            if key not in whole:
+                raise TopologyEventException("partial change to {} {}".format(*key))
+
+    except (TopologyEventException, KeyError, TypeError, AttributeError, ValueError,
+            ExpatError), e:
+        LOG.error("can't use topology event: {}".format(e))
+        return None
+
+    return delta
+
+def parse_topology_events(payloads):
+    '''fold a batch of notifications into one net TopologyDelta
+
+    @param payloads: notifications in the order they arrived
+    @return: TopologyDelta, or None if any of them can't be used
+    '''
+
+    delta = TopologyDelta()
+    for payload in payloads:
+        if payload is None:
+            return None
+        d = parse_topology_event(payload)
+        if d is None:
+            return None
+        delta.merge(d)
+
+    return delta
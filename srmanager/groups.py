@@ -0,0 +1,207 @@
+#
+# OpenFlow group ids
+#
+
+GROUP_BASE = 1000
+
+# Group types, as the inventory names them
+GROUP_SELECT = 'group-select'
+GROUP_INDIRECT = 'group-indirect'
+GROUP_FAST_FAILOVER = 'group-ff'
+
+class GroupTable():
+    '''group ids of each switch, and the SR flows that point at them
+
+    A group is known by a key saying what it does: its type and its
+    buckets. Flows that forward the same way share the group with that
+    key. Ids are handed out per switch from GROUP_BASE up, lowest free
+    first, and are freed once no flow points at them any more. A freed
+    id stays taken until free says its group is being deleted, so an id
+    never changes meaning while installed flows may still point at it.
+    Ids of groups installed on a switch that are not ours are taken too,
+    see seed.
+
+    A group whose flows all move away can be repointed instead, so the
+    flows keep their group id and only the group needs writing. Two
+    groups may then have the same key; a flow stays on whichever of them
+    it points at, and new flows get one of them, until merge moves the
+    flows of one onto the other.
+
+    Keys are tuples of the group type and a tuple of buckets, each bucket
+    a tuple of output port, whether the label is popped and a label to
+    push (None for none).
+    '''
+
+    def __init__(self, base=GROUP_BASE):
+        '''no groups'''
+
+        self.base = base
+
+        # switch -> group id -> key, and key -> a group id with that key
+        self.keys = {}
+        self.ids = {}
+
+        # switch -> group id -> flow ids, and flow id -> group id
+        self.users = {}
+        self.flows = {}
+
+        # switch -> ids of groups still on the switch that are not to be
+        # handed out: freed ones not yet deleted, and ones not ours
+        self.taken = {}
+
+    def use(self, switch, flow_id, key, avoid=()):
+        '''point a flow at the group with a key, making it if needed
+
+        @param avoid: ids of groups not to join, a new group with the key
+                      is made instead and found by it from then on
+        @return: tuple of the group id and a list of group ids the flow
+                 was the last user of
+        '''
+
+        # already on a group that does the same
+        id = self.flows.get(switch, {}).get(flow_id)
+        if id is not None and self.keys[switch][id] == key:
+            return (id, [])
+
+        ids = self.ids.setdefault(switch, {})
+        id = ids.get(key)
+        if id is None or id in avoid:
+            keys = self.keys.setdefault(switch, {})
+            taken = self.taken.get(switch, ())
+            id = self.base
+            while id in keys or id in taken:
+                id += 1
+            keys[id] = key
+            ids[key] = id
+            self.users.setdefault(switch, {})[id] = set()
+
+        freed = self.release(switch, flow_id)
+        self.flows.setdefault(switch, {})[flow_id] = id
+        self.users[switch][id].add(flow_id)
+        return (id, freed)
+
+    def release(self, switch, flow_id):
+        '''the flow no longer points at a group
+
+        @return: list of group ids the flow was the last user of
+        '''
+
+        id = self.flows.get(switch, {}).pop(flow_id, None)
+        if id is None:
+            return []
+
+        users = self.users[switch][id]
+        users.discard(flow_id)
+        if users:
+            return []
+
+        del self.users[switch][id]
+        self.unkey(switch, id)
+        del self.keys[switch][id]
+        self.take(switch, [id])
+        return [id]
+
+    def unkey(self, switch, id):
+        '''stop finding a group by its key, finding another with it instead'''
+
+        key = self.keys[switch][id]
+        ids = self.ids[switch]
+        if ids.get(key) != id:
+            return
+        del ids[key]
+        for other, k in self.keys[switch].items():
+            if other != id and k == key:
+                ids[key] = other
+                break
+
+    def group_of(self, switch, flow_id):
+        '''id of the group a flow points at, None if it points at none'''
+
+        return self.flows.get(switch, {}).get(flow_id)
+
+    def users_of(self, switch, id):
+        '''flow ids pointing at a group'''
+
+        return set(self.users.get(switch, {}).get(id, ()))
+
+    def repoint(self, switch, id, key):
+        '''give a group a new key, keeping the flows that point at it'''
+
+        self.unkey(switch, id)
+        self.keys[switch][id] = key
+        self.ids[switch].setdefault(key, id)
+
+    def duplicates(self, switch):
+        '''lists of two or more group ids of a switch sharing a key, sorted'''
+
+        by_key = {}
+        for id, key in self.keys.get(switch, {}).items():
+            by_key.setdefault(key, []).append(id)
+        return sorted([sorted(ids) for ids in by_key.values() if len(ids) > 1])
+
+    def merge(self, switch, id, into):
+        '''point the flows of a group at another with the same key
+
+        The group is dropped and its id taken, as release does with a
+        group nobody uses.
+
+        @return: flow ids that now point at into
+        '''
+
+        moved = self.users[switch].pop(id)
+        self.unkey(switch, id)
+        del self.keys[switch][id]
+        self.take(switch, [id])
+        for flow_id in moved:
+            self.flows[switch][flow_id] = into
+        self.users[switch][into].update(moved)
+        return moved
+
+    def key(self, switch, id):
+        '''key of a group, None if the switch has no such group'''
+
+        return self.keys.get(switch, {}).get(id)
+
+    def groups(self, switch):
+        '''dict of group id -> key of a switch'''
+
+        return dict(self.keys.get(switch, {}))
+
+    def take(self, switch, ids):
+        '''keep ids from being handed out, their groups are on the switch'''
+
+        self.taken.setdefault(switch, set()).update(ids)
+
+    def free(self, switch, ids):
+        '''hand ids out again, their groups are deleted or queued to be'''
+
+        self.taken.get(switch, set()).difference_update(ids)
+
+    def seed(self, switch, keys, flows):
+        '''start a switch over from the groups and flows installed on it
+
+        @param keys: group id -> key of the groups that are ours
+        @param flows: flow id -> group id of the flows pointing at them
+        @return: ids of keys no flow points at
+        '''
+
+        self.forget(switch)
+
+        for flow_id, id in sorted(flows.items(), key=lambda f: (f[1], f[0])):
+            key = keys.get(id)
+            if key is None:
+                continue
+            self.keys.setdefault(switch, {})[id] = key
+            self.ids.setdefault(switch, {}).setdefault(key, id)
+            self.users.setdefault(switch, {}).setdefault(id, set()).add(flow_id)
+            self.flows.setdefault(switch, {})[flow_id] = id
+
+        unused = sorted([id for id in keys if id not in self.keys.get(switch, {})])
+        self.take(switch, unused)
+        return unused
+
+    def forget(self, switch):
+        '''drop every group of a switch'''
+
+        for d in (self.keys, self.ids, self.users, self.flows, self.taken):
+            d.pop(switch, None)
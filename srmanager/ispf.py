@@ -0,0 +1,395 @@
+#
+# Incremental shortest path first
+#
+
+import logging
+import heapq
+from collections import deque
+
+from srmanager.nexthop import NextHopTable
+from srmanager.csr import CSRGraph
+
+class IncrementalSPF(NextHopTable):
+    '''Next hop table kept up to date edge by edge
+
+    Keeps the hop distance from every node to every destination. When
+    an edge or node is added or removed only the destinations whose
+    shortest path tree used it are touched, and within those only the
+    nodes whose distance changes and their neighbours are re-evaluated.
+
+    The next hop from a source to a target is the smallest neighbour
+    one hop closer to the target, which is the same answer the full
+    NextHopTable gives for the same graph.
+
+    The graph is owned by the engine and modified in place. A CSRGraph
+    is read only and can't be used that way, so a compact graph is
+    turned into a networkx one first: the daemon's incremental engine
+    always holds a networkx graph, and BSC_GRAPH=csr only shrinks the
+    full table builds.
+    '''
+
+    def __init__(self, graph, ecmp=False):
+        '''build distances and next hops for a graph
+
+        @param ecmp: whether to keep every equal cost next hop too
+        '''
+
+        if isinstance(graph, CSRGraph):
+            graph = graph.to_networkx()
+
+        self.graph = graph
+        self.ecmp = ecmp
+
+        # target -> node -> hops to target
+        self.dist = {}
+
+        # source -> target -> next hop
+        self.table = {}
+
+        # source -> target -> tuple of equal cost next hops, with ecmp
+        self.sets = {}
+
+        # (source, target) -> (next hop, port) before the current change
+        self.before = {}
+
+        # same, for pairs whose source or target has been removed
+        self.dropped = {}
+
+        # nodes whose hops to or from some node, or whose own edges,
+        # changed: since the last collect, and up to the last collect
+        self.moving = set()
+        self.moved = set()
+
+        for t in graph:
+            self.dist[t] = self.reverse_bfs(t)
+
+        for s in graph:
+            self.table[s] = {}
+            self.sets[s] = {}
+            for t in graph:
+                nnode = self.best_hop(s, t)
+                if nnode is not None:
+                    self.table[s][t] = nnode
+                    if self.ecmp:
+                        self.sets[s][t] = self.best_hops(s, t)
+
+        logging.debug("Incremental SPF built for {} nodes".format(len(self.table)))
+
+    def reverse_bfs(self, t):
+        '''hop distance from every node that can reach t'''
+
+        dist = {t: 0}
+        queue = deque([t])
+        while queue:
+            node = queue.popleft()
+            for p in self.graph.predecessors(node):
+                if p not in dist:
+                    dist[p] = dist[node] + 1
+                    queue.append(p)
+        return dist
+
+    def best_hop(self, s, t):
+        '''smallest neighbour of s one hop closer to t'''
+
+        if s == t:
+            return None
+        dist = self.dist[t]
+        if s not in dist:
+            return None
+        want = dist[s] - 1
+        best = None
+        for nnode in self.graph[s]:
+            if dist.get(nnode) == want and (best is None or nnode < best):
+                best = nnode
+        return best
+
+    def best_hops(self, s, t):
+        '''every neighbour of s one hop closer to t, sorted'''
+
+        if s == t:
+            return ()
+        dist = self.dist[t]
+        if s not in dist:
+            return ()
+        want = dist[s] - 1
+        return tuple(sorted([n for n in self.graph[s] if dist.get(n) == want]))
+
+    def distance(self, s, t):
+        '''hops from s to t, None without a path'''
+
+        return self.dist.get(t, {}).get(s)
+
+    def ecmp_hops(self, s, t):
+        '''every neighbour of s on a shortest path to t, as last refreshed'''
+
+        if not self.ecmp:
+            return NextHopTable.ecmp_hops(self, s, t)
+        return list(self.sets.get(s, {}).get(t, ()))
+
+    def touch(self, s, t):
+        '''remember the forwarding of a pair before it changes'''
+
+        if (s, t) not in self.before:
+            self.before[(s, t)] = self.forwarding(s, t)
+
+    def touch_edge(self, u, v):
+        '''remember every pair forwarded over the edge u -> v'''
+
+        for t, nnode in self.table.get(u, {}).items():
+            if nnode == v:
+                self.touch(u, t)
+        for t, hops in self.sets.get(u, {}).items():
+            if v in hops:
+                self.touch(u, t)
+
+    def refresh(self, nodes, t):
+        '''re-evaluate the next hop of some nodes towards t'''
+
+        for s in nodes:
+            if s == t or s not in self.table:
+                continue
+            nnode = self.best_hop(s, t)
+            if nnode != self.table[s].get(t):
+                self.touch(s, t)
+                if nnode is None:
+                    del self.table[s][t]
+                else:
+                    self.table[s][t] = nnode
+
+            if self.ecmp:
+                hops = self.best_hops(s, t)
+                if hops != self.sets[s].get(t, ()):
+                    self.touch(s, t)
+                    if hops:
+                        self.sets[s][t] = hops
+                    else:
+                        self.sets[s].pop(t, None)
+
+    def changed(self, nodes):
+        '''nodes plus everything with an edge into them'''
+
+        r = set(nodes)
+        for node in nodes:
+            r.update(self.graph.predecessors(node))
+        return r
+
+    def collect(self):
+        '''pairs whose forwarding changed since the last collect
+
+        The nodes that moved along with them are left in moved, for
+        plan_changes.
+
+        @return: dict of (source, target) -> (old next hop, new next hop)
+        '''
+
+        r = {}
+        for (s, t), old in self.before.items():
+            new = self.forwarding(s, t)
+            if old != new:
+                r[(s, t)] = (old[0], new[0])
+        for (s, t), old in self.dropped.items():
+            r[(s, t)] = (old[0], None)
+        self.before = {}
+        self.dropped = {}
+        self.moved = self.moving
+        self.moving = set()
+        return r
+
+    def add_node(self, n, collect=True):
+        '''add an isolated node'''
+
+        if n not in self.table:
+            self.graph.add_node(n)
+            self.moving.add(n)
+            self.dist[n] = {n: 0}
+            self.table[n] = {}
+            self.sets[n] = {}
+
+            # back after a removal, compare against what it had before
+            for (s, t) in self.dropped.keys():
+                if s == n or t == n:
+                    self.before[(s, t)] = self.dropped.pop((s, t))
+
+        return self.collect() if collect else {}
+
+    def remove_node(self, n, collect=True):
+        '''remove a node and every edge touching it'''
+
+        if n not in self.table:
+            return self.collect() if collect else {}
+
+        for u in list(self.graph.predecessors(n)):
+            self.remove_edge(u, n, collect=False)
+        for v in list(self.graph.successors(n)):
+            self.remove_edge(n, v, collect=False)
+
+        # everything towards n and everything from n is gone
+        for s in self.table:
+            if n in self.table[s]:
+                self.touch(s, n)
+        for t in self.table[n]:
+            self.touch(n, t)
+
+        # keep the old forwarding once the node has disappeared
+        for (s, t) in self.before.keys():
+            if s == n or t == n:
+                old = self.before.pop((s, t))
+                if old[0] is not None:
+                    self.dropped[(s, t)] = old
+
+        self.graph.remove_node(n)
+        del self.table[n]
+        del self.dist[n]
+        self.sets.pop(n, None)
+        for s in self.table:
+            self.table[s].pop(n, None)
+            self.sets[s].pop(n, None)
+        for t in self.dist:
+            self.dist[t].pop(n, None)
+
+        return self.collect() if collect else {}
+
+    def add_edge(self, u, v, attrs, collect=True):
+        '''add an edge u -> v, or update its attributes'''
+
+        for n in (u, v):
+            if n not in self.table:
+                self.add_node(n, collect=False)
+
+        if self.graph.has_edge(u, v):
+            # same link, maybe a different port
+            if self.graph[u][v] != attrs:
+                self.touch_edge(u, v)
+                self.moving.add(u)
+                self.graph[u][v].clear()
+                self.graph[u][v].update(attrs)
+            return self.collect() if collect else {}
+
+        self.graph.add_edge(u, v, **attrs)
+        self.moving.add(u)
+
+        for t, dist in self.dist.items():
+            if v not in dist:
+                continue
+            du = dist.get(u)
+            dv = dist[v]
+
+            if du is not None and dv + 1 > du:
+                continue
+
+            if du is not None and dv + 1 == du:
+                # another equal cost way out of u
+                self.refresh([u], t)
+                continue
+
+            # u gets closer, and so does anything that reaches t via u
+            dist[u] = dv + 1
+            lowered = [u]
+            queue = deque([u])
+            while queue:
+                node = queue.popleft()
+                for p in self.graph.predecessors(node):
+                    if dist.get(p, dist[node] + 2) > dist[node] + 1:
+                        dist[p] = dist[node] + 1
+                        lowered.append(p)
+                        queue.append(p)
+
+            self.moving.update(lowered)
+            self.moving.add(t)
+            self.refresh(self.changed(lowered), t)
+
+        return self.collect() if collect else {}
+
+    def remove_edge(self, u, v, collect=True):
+        '''remove the edge u -> v'''
+
+        if not self.graph.has_edge(u, v):
+            return self.collect() if collect else {}
+
+        self.touch_edge(u, v)
+        self.graph.remove_edge(u, v)
+        self.moving.add(u)
+
+        for t, dist in self.dist.items():
+            du = dist.get(u)
+            dv = dist.get(v)
+
+            # edge was not on any shortest path towards t
+            if du is None or dv is None or du != dv + 1:
+                continue
+
+            # u still has an equal cost way out
+            if any(dist.get(w) == dv for w in self.graph[u]):
+                self.refresh([u], t)
+                continue
+
+            # nodes that only reached t through the removed edge
+            affected = set([u])
+            queue = deque([u])
+            while queue:
+                node = queue.popleft()
+                for p in self.graph.predecessors(node):
+                    if p in affected or dist.get(p) != dist[node] + 1:
+                        continue
+                    want = dist[p] - 1
+                    if not any(dist.get(w) == want and w not in affected
+                               for w in self.graph[p]):
+                        affected.add(p)
+                        queue.append(p)
+
+            for node in affected:
+                del dist[node]
+
+            # settle the affected nodes again from the unaffected border
+            heap = []
+            for node in affected:
+                best = None
+                for w in self.graph[node]:
+                    if w in dist and (best is None or dist[w] + 1 < best):
+                        best = dist[w] + 1
+                if best is not None:
+                    heapq.heappush(heap, (best, node))
+
+            while heap:
+                d, node = heapq.heappop(heap)
+                if node in dist:
+                    continue
+                dist[node] = d
+                for p in self.graph.predecessors(node):
+                    if p in affected and p not in dist:
+                        heapq.heappush(heap, (d + 1, p))
+
+            self.moving.update(affected)
+            self.moving.add(t)
+            self.refresh(self.changed(affected), t)
+
+        return self.collect() if collect else {}
+
+    def update(self, graph):
+        '''apply the differences between our graph and a new one
+
+        @param graph: new topology graph (left untouched)
+        @return: dict of (source, target) -> (old next hop, new next hop)
+        '''
+
+        gone = [n for n in self.graph if n not in graph]
+        for n in gone:
+            self.remove_node(n, collect=False)
+
+        for u, v in list(self.graph.edges()):
+            if not graph.has_edge(u, v):
+                self.remove_edge(u, v, collect=False)
+
+        for n in graph:
+            if n not in self.table:
+                self.add_node(n, collect=False)
+
+        for u, v, attrs in graph.edges(data=True):
+            self.add_edge(u, v, dict(attrs), collect=False)
+
+        self.graph.graph.update(graph.graph)
+
+        r = self.collect()
+
+        logging.debug("Incremental SPF update: {} removed nodes, {} changed pairs".format(len(gone), len(r)))
+        return r
@@ -0,0 +1,262 @@
+#
+# Incremental parsing of RESTCONF replies
+#
+# Inventory and topology replies carry port and flow statistics we never
+# look at. With ijson and one of its C backends installed the reply is
+# read as a stream of parse events and only the fields we need are kept,
+# so memory follows what we keep rather than the size of the reply.
+# Otherwise the reply is parsed whole and the same fields are picked out;
+# ijson's pure Python backend is slower than that.
+#
+
+import json
+import logging
+import importlib
+from decimal import Decimal
+from requests.packages.urllib3.exceptions import HTTPError
+
+# ijson backends worth streaming with, fastest first
+BACKENDS = ['yajl2_c', 'yajl2_cffi']
+
+ijson = None
+for backend in BACKENDS:
+    try:
+        ijson = importlib.import_module('ijson.backends.' + backend)
+        from ijson.common import ObjectBuilder, JSONError
+        break
+    except (ImportError, OSError):
+        ijson = None
+
+# What a bad or cut short reply raises while it is parsed
+PARSE_ERRORS = (ValueError, HTTPError)
+if ijson is not None:
+    PARSE_ERRORS += (JSONError,)
+
+LOG = logging.getLogger(__name__)
+
+TOPOLOGY = 'topology'
+TABLE = 'flow-node-inventory:table'
+GROUP = 'flow-node-inventory:group'
+NODES = 'opendaylight-inventory:nodes'
+
+def streaming():
+    '''True when replies can be parsed as they are read'''
+
+    return ijson is not None
+
+def plain(obj):
+    '''turn the Decimals ijson reads numbers as into ints and floats'''
+
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == int(obj) else float(obj)
+    if isinstance(obj, dict):
+        return dict([(k, plain(v)) for k, v in obj.items()])
+    if isinstance(obj, list):
+        return [plain(v) for v in obj]
+    return obj
+
+def is_host(id):
+    return id is not None and id.find('host') != -1
+
+def reply_events(resp):
+    '''parse events of a streamed response body'''
+
+    resp.raw.decode_content = True
+    return ijson.parse(resp.raw)
+
+def parse_topology(resp):
+    '''switch nodes and links of a network-topology reply
+
+    @param resp: response to a GET of one topology, streamed if streaming()
+    @return: dict with 'node', a list of {'node-id'}, and 'link', a list
+             of {'link-id', 'source', 'destination'} holding only the
+             node ids and termination points; hosts are left out
+    '''
+
+    if ijson is None:
+        topologies = json.loads(resp.content)
+        if len(topologies.get(TOPOLOGY, [])) == 0:
+            return None
+        return pick_topology(topologies[TOPOLOGY][0])
+
+    nodes = []
+    links = []
+    link = None
+    found = False
+
+    base = TOPOLOGY + '.item'
+    for prefix, event, value in reply_events(resp):
+        if prefix == base and event == 'start_map':
+            found = True
+        elif prefix == base + '.node.item.node-id':
+            if not is_host(value):
+                nodes.append({'node-id': value})
+        elif prefix == base + '.link.item':
+            if event == 'start_map':
+                link = {'source': {}, 'destination': {}}
+            elif event == 'end_map':
+                if not is_host(link.get('link-id')):
+                    links.append(link)
+                link = None
+        elif link is not None:
+            if prefix == base + '.link.item.link-id':
+                link['link-id'] = value
+            elif prefix in (base + '.link.item.source.source-node',
+                            base + '.link.item.source.source-tp'):
+                link['source'][prefix.split('.')[-1]] = value
+            elif prefix in (base + '.link.item.destination.dest-node',
+                            base + '.link.item.destination.dest-tp'):
+                link['destination'][prefix.split('.')[-1]] = value
+        elif prefix == base and event == 'end_map':
+            # only the first topology, as asked for by id
+            break
+
+    if not found:
+        return None
+    return {'node': nodes, 'link': links}
+
+def pick_topology(topology):
+    '''the fields parse_topology keeps, from an already parsed topology'''
+
+    nodes = [{'node-id': n['node-id']} for n in topology.get('node', [])
+             if not is_host(n['node-id'])]
+
+    links = []
+    for l in topology.get('link', []):
+        if is_host(l['link-id']):
+            continue
+        links.append({
+            'link-id': l['link-id'],
+            'source': {'source-node': l['source']['source-node'],
+                       'source-tp': l['source']['source-tp']},
+            'destination': {'dest-node': l['destination']['dest-node'],
+                            'dest-tp': l['destination']['dest-tp']}})
+
+    return {'node': nodes, 'link': links}
+
+def build_objects(events, prefix, keep):
+    '''objects found at prefix, built one at a time
+
+    @param events: ijson parse events
+    @param prefix: ijson prefix of the objects
+    @param keep: function telling whether a built object is wanted
+    @return: iterator of the wanted objects
+    '''
+
+    builder = None
+    depth = 0
+
+    for p, event, value in events:
+        if builder is not None:
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+                if depth == 0:
+                    obj = builder.value
+                    builder = None
+                    if keep(obj):
+                        yield plain(obj)
+            continue
+
+        if p == prefix and event in ('start_map', 'start_array'):
+            builder = ObjectBuilder()
+            builder.event(event, value)
+            depth = 1
+
+def table_flows(resp, keep):
+    '''flows of a single table reply (GET of node/{}/table/{})
+
+    @param resp: the response, streamed if streaming()
+    @param keep: function of a raw flow telling whether it is wanted
+    @return: list of raw flows
+    '''
+
+    if ijson is None:
+        tables = json.loads(resp.content)
+        if len(tables.get(TABLE, [])) == 0:
+            return []
+        return [f for f in tables[TABLE][0].get('flow', []) if keep(f)]
+
+    return list(build_objects(reply_events(resp), TABLE + '.item.flow.item', keep))
+
+def inventory_flows(resp, keep, groups=False):
+    '''flows of every table of every node in an inventory reply
+
+    Nodes, tables and flows are read in order but their ids may come
+    after their contents, so wanted flows are held until the table and
+    node they belong to are done.
+
+    @param resp: response to a GET of opendaylight-inventory:nodes,
+                 streamed if streaming()
+    @param keep: function of a raw flow telling whether it is wanted
+    @param groups: whether to keep the groups of each node too, listed
+                   under GROUP in place of a table id
+    @return: dict of node id to table id to list of raw flows; every
+             node and table is listed, even without wanted flows
+    '''
+
+    r = {}
+
+    if ijson is None:
+        for node in json.loads(resp.content).get(NODES, {}).get('node', []):
+            tables = r[node['id']] = {}
+            for table in node.get(TABLE, []):
+                tables[int(table['id'])] = [f for f in table.get('flow', []) if keep(f)]
+            if groups:
+                tables[GROUP] = node.get(GROUP, [])
+        return r
+
+    node_prefix = NODES + '.node.item'
+    table_prefix = node_prefix + '.' + TABLE + '.item'
+    flow_prefix = table_prefix + '.flow.item'
+    group_prefix = node_prefix + '.' + GROUP + '.item'
+
+    node_id = table_id = None
+    node_tables = []
+    node_groups = []
+    table = []
+    builder = None
+    depth = 0
+
+    for p, event, value in reply_events(resp):
+        if builder is not None:
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+                if depth == 0:
+                    if into is node_groups or keep(builder.value):
+                        into.append(plain(builder.value))
+                    builder = None
+            continue
+
+        if p == flow_prefix and event == 'start_map':
+            builder = ObjectBuilder()
+            builder.event(event, value)
+            depth = 1
+            into = table
+        elif groups and p == group_prefix and event == 'start_map':
+            builder = ObjectBuilder()
+            builder.event(event, value)
+            depth = 1
+            into = node_groups
+        elif p == node_prefix + '.id':
+            node_id = value
+        elif p == table_prefix + '.id':
+            table_id = int(value)
+        elif p == table_prefix and event == 'end_map':
+            node_tables.append((table_id, table))
+            table_id = None
+            table = []
+        elif p == node_prefix and event == 'end_map':
+            r[node_id] = dict(node_tables)
+            if groups:
+                r[node_id][GROUP] = node_groups
+            node_id = None
+            node_tables = []
+            node_groups = []
+
+    return r
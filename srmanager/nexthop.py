@@ -0,0 +1,372 @@
+#
+# Next hop table
+#
+
+import ctypes
+import logging
+from array import array
+from collections import deque
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+from threading import Lock
+
+from srmanager import csr
+from srmanager.csr import CSRGraph, UNREACHED
+
+# Graph a worker process searches, the build it belongs to and the
+# array builds are shared in
+WORKER_GRAPH = None
+WORKER_BUILD = None
+WORKER_SHARED = None
+
+# Ints the shared graph array starts with
+SHARED_SIZE = 1 << 18
+
+# Batches of sources handed to each worker
+BATCHES_PER_WORKER = 4
+
+class NextHopTable():
+    '''All-pairs shortest path next hops for a topology graph
+
+    Built with one breadth first search per source, so the whole table
+    costs O(N * (N + E)) instead of a search per (source, target) pair.
+    Neighbours are visited in sorted order so equal cost ties always
+    resolve the same way for the same graph.
+
+    With ecmp the hop counts between every pair are kept too, so every
+    equal cost next hop can be told, not just the one picked.
+
+    Rows searched by worker processes stay packed, see PackedRow.
+    '''
+
+    def __init__(self, graph, workers=None, ecmp=False, depths=False, pool=None):
+        '''build the table for a graph
+
+        @param workers: processes to spread the searches over, None or 1
+                        to run them all here
+        @param ecmp: whether to keep what ecmp_hops needs
+        @param depths: whether to keep hop counts for distance, as with ecmp
+        @param pool: SearchPool to run the searches on, instead of
+                     starting one for this table only
+        '''
+
+        self.graph = graph
+        self.ecmp = ecmp
+        self.depths = ecmp or depths
+
+        # source -> target -> next hop
+        self.table = {}
+
+        # source -> target -> hops, with ecmp or depths
+        self.depth = {}
+
+        if pool is not None and len(graph) > 1:
+            self.parallel_spf(pool)
+        elif workers is not None and workers > 1 and len(graph) > 1:
+            pool = SearchPool(workers)
+            try:
+                self.parallel_spf(pool)
+            finally:
+                pool.close()
+        else:
+            for src in graph:
+                hops, depth = self.spf(src)
+                self.table[src] = hops
+                if self.depths:
+                    self.depth[src] = depth
+
+        logging.debug("Next hop table built for {} nodes".format(len(self.table)))
+
+    def parallel_spf(self, pool):
+        '''fill the table with rows searched on a SearchPool
+
+        Rows come back as arrays of node numbers and are kept that way,
+        so no per-target work is done here.
+        '''
+
+        g = self.graph
+        if not isinstance(g, CSRGraph):
+            g = CSRGraph.from_graph(g)
+
+        for rows in pool.search(g, self.depths):
+            for s, hop_row, dist_row in rows:
+                hop = unpacked(hop_row)
+                self.table[g.names[s]] = PackedRow(g, hop)
+                if self.depths:
+                    self.depth[g.names[s]] = PackedRow(g, hop, unpacked(dist_row))
+
+    def spf(self, src):
+        '''next hop from src to every reachable node
+
+        @return: tuple of dicts of target -> next hop and target -> hops
+        '''
+
+        # a compact graph searches its own arrays
+        if isinstance(self.graph, CSRGraph):
+            return self.graph.shortest_paths(src)
+
+        hops = {}
+        depth = {}
+        seen = set([src])
+        queue = deque()
+
+        # first hops are the neighbours themselves
+        for nnode in sorted(self.graph[src]):
+            seen.add(nnode)
+            hops[nnode] = nnode
+            depth[nnode] = 1
+            queue.append(nnode)
+
+        # everything further away inherits its parent's first hop
+        while queue:
+            node = queue.popleft()
+            for nnode in sorted(self.graph[node]):
+                if nnode not in seen:
+                    seen.add(nnode)
+                    hops[nnode] = hops[node]
+                    depth[nnode] = depth[node] + 1
+                    queue.append(nnode)
+
+        return (hops, depth)
+
+    def next_hop(self, src, dst):
+        '''next hop from src towards dst, None if there is no path'''
+
+        if src in self.table:
+            return self.table[src].get(dst)
+        return None
+
+    def next_hops(self, src):
+        '''dict of target -> next hop for a source'''
+
+        return self.table.get(src, {})
+
+    def port(self, src, dst):
+        '''output port on src towards dst, None if there is no path'''
+
+        nnode = self.next_hop(src, dst)
+        if nnode is None:
+            return None
+        return self.graph[src][nnode]['source-tp']
+
+    def distance(self, src, dst):
+        '''hops from src to dst, None without a path (needs ecmp or depths)'''
+
+        if src == dst:
+            return 0
+        return self.depth.get(src, {}).get(dst)
+
+    def ecmp_hops(self, src, dst):
+        '''every neighbour of src on a shortest path to dst, sorted
+
+        Without ecmp this is just the next hop.
+        '''
+
+        if not self.ecmp:
+            nnode = self.next_hop(src, dst)
+            return [] if nnode is None else [nnode]
+
+        d = self.distance(src, dst)
+        if not d:
+            return []
+        return sorted([n for n in self.graph[src] if self.distance(n, dst) == d - 1])
+
+    def forwarding(self, src, dst):
+        '''what src programs towards dst, to tell whether it changed
+
+        @return: tuple of next hop and port, (None, None) without a path,
+                 and with ecmp the ports of every equal cost next hop
+        '''
+
+        nnode = self.next_hop(src, dst)
+        if nnode is None:
+            r = (None, None)
+        else:
+            r = (nnode, self.graph[src][nnode]['source-tp'])
+
+        if self.ecmp:
+            r += (tuple([self.graph[src][n]['source-tp'] for n in self.ecmp_hops(src, dst)]),)
+        return r
+
+    def __contains__(self, node):
+        return node in self.table
+
+    def __iter__(self):
+        return iter(self.table)
+
+class PackedRow():
+    '''read only view of one searched row, target name -> next hop name
+
+    Given the hop counts too it maps targets to those instead. Lookups
+    go through the graph's name index, so the row stays one array of
+    node numbers rather than a dict per source.
+    '''
+
+    def __init__(self, graph, hop, values=None):
+        self.graph = graph
+        self.hop = hop
+        self.values = values
+
+    def get(self, name, default=None):
+        j = self.graph.index.get(name)
+        if j is None or self.hop[j] == UNREACHED:
+            return default
+        if self.values is None:
+            return self.graph.names[self.hop[j]]
+        return self.values[j]
+
+    def __getitem__(self, name):
+        r = self.get(name)
+        if r is None:
+            raise KeyError(name)
+        return r
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __iter__(self):
+        names = self.graph.names
+        for j, h in enumerate(self.hop):
+            if h != UNREACHED:
+                yield names[j]
+
+    def __len__(self):
+        return len(self.hop) - self.hop.count(UNREACHED)
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+class SearchPool():
+    '''worker processes searching the next hop tables of one SR
+
+    Started once, before any thread, and reused by every table built
+    after. The graph of each build is copied once into an array the
+    workers share, as node count, indptr and indices, and a batch of
+    sources only carries the build number. A worker unpacks the graph
+    again when the build changes. A graph that does not fit restarts
+    the workers around an array twice the size.
+    '''
+
+    def __init__(self, workers, size=SHARED_SIZE):
+        self.workers = workers
+        self.builds = 0
+        self.lock = Lock()
+        self.start(size)
+
+    def start(self, size):
+        '''fork the workers around a shared array of size ints'''
+
+        self.shared = RawArray('i', size)
+        self.pool = Pool(self.workers, share_graph, (self.shared,))
+
+    def search(self, g, depths=False):
+        '''rows of every source of a CSRGraph, as spf_rows gives them
+
+        Builds take turns, since they share the one array.
+
+        @return: list of lists of (source, hop row, hop count row)
+        '''
+
+        n = len(g.names)
+        indptr = packed(g.indptr)
+        indices = packed(g.indices)
+        need = 2 + n + len(indices) // 4
+
+        with self.lock:
+            if need > len(self.shared):
+                logging.info("Restarting {} SPF workers for a graph of {} ints".format(
+                    self.workers, need))
+                self.close()
+                self.start(max(need, 2 * len(self.shared)))
+
+            self.builds += 1
+            self.shared[0] = n
+            put_ints(self.shared, 1, indptr)
+            put_ints(self.shared, 2 + n, indices)
+
+            size = max(1, -(-n // (self.workers * BATCHES_PER_WORKER)))
+            tasks = [(self.builds, range(i, min(i + size, n)), depths)
+                     for i in xrange(0, n, size)]
+            return self.pool.map(spf_rows, tasks)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+def parents_avoiding(graph, src, nnode):
+    '''shortest paths from src once its link to nnode has failed
+
+    @return: dict of node -> the node before it on the path from src,
+             src itself left out
+    '''
+
+    parents = {}
+    seen = set([src])
+    queue = deque([src])
+    while queue:
+        node = queue.popleft()
+        for n in sorted(graph[node]):
+            if n in seen or (node == src and n == nnode):
+                continue
+            seen.add(n)
+            parents[n] = node
+            queue.append(n)
+    return parents
+
+def packed(values):
+    '''32 bit ints of an array as a string'''
+
+    if csr.numpy is not None and isinstance(values, csr.numpy.ndarray):
+        return values.astype(csr.numpy.int32).tostring()
+    return array('i', values).tostring()
+
+def unpacked(text):
+    a = array('i')
+    a.fromstring(text)
+    return a
+
+def put_ints(shared, start, text):
+    '''copy packed ints into a shared array from index start on'''
+
+    ctypes.memmove(ctypes.addressof(shared) + start * 4, text, len(text))
+
+def get_ints(shared, start, count):
+    '''count ints of a shared array from index start on, unpacked'''
+
+    return unpacked(ctypes.string_at(ctypes.addressof(shared) + start * 4, count * 4))
+
+def share_graph(shared):
+    '''keep the array the graph of each build comes in, in a new worker'''
+
+    global WORKER_SHARED
+    WORKER_SHARED = shared
+
+def worker_graph(build):
+    '''the graph of a build, made once per build in each worker process'''
+
+    global WORKER_GRAPH, WORKER_BUILD
+    if WORKER_BUILD != build:
+        n = WORKER_SHARED[0]
+        indptr = get_ints(WORKER_SHARED, 1, n + 1)
+        WORKER_GRAPH = CSRGraph.from_arrays(range(n), indptr,
+                                            get_ints(WORKER_SHARED, 2 + n, indptr[-1]))
+        WORKER_BUILD = build
+    return WORKER_GRAPH
+
+def spf_rows(task):
+    '''(source, packed first hop row, packed hop count row) for a batch of sources
+
+    The hop count row is None unless asked for.
+    '''
+
+    build, sources, depths = task
+    graph = worker_graph(build)
+
+    r = []
+    for s in sources:
+        dist, hop = graph.bfs(s)
+        r.append((s, packed(hop), packed(dist) if depths else None))
+    return r
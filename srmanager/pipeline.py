@@ -0,0 +1,272 @@
+#
+# Background flow programming
+#
+
+import time
+import logging
+import threading
+from collections import deque
+
+LOG = logging.getLogger(__name__)
+
+#-------------------------------------------------------------------------------
+# Class 'FlowPass'
+#-------------------------------------------------------------------------------
+class FlowPass():
+    """ One programming pass: a set of flow operations and their outcome. """
+
+    def __init__(self, name, on_done=None):
+        """Initializes this object properties."""
+
+        self.name = name
+        self.on_done = on_done
+        self.submitted = 0
+        self.completed = 0
+        self.errors = []
+        self.closed = False
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+
+    def close(self):
+        """ No more operations will be added to this pass. """
+
+        with self.lock:
+            self.closed = True
+            finished = self.completed == self.submitted
+        if finished:
+            self.finish()
+
+    def finish(self):
+        if self.on_done is not None:
+            try:
+                self.on_done()
+            except Exception, e:
+                LOG.error("pass {} completion failed: {}".format(self.name, e))
+        LOG.info("pass {} done, {} operations, {} errors".format(
+            self.name, self.completed, len(self.errors)))
+        self.event.set()
+
+    def done(self):
+        """ True once every operation of a closed pass has run. """
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        """ Block until the pass is done, True if it is. """
+
+        # a plain wait() can't be interrupted with ctrl-c in python 2
+        while timeout is None and not self.event.is_set():
+            self.event.wait(1)
+        return self.event.wait(timeout)
+
+    def job_done(self, error=None):
+        with self.lock:
+            self.completed += 1
+            if error is not None:
+                self.errors.append(error)
+            finished = self.closed and self.completed == self.submitted
+        if finished:
+            self.finish()
+
+#-------------------------------------------------------------------------------
+# Class 'FlowPipeline'
+#-------------------------------------------------------------------------------
+class FlowPipeline():
+    """ Runs flow operations in the background.
+
+    At most workers operations run at once across all switches, and the
+    operations for one switch run one at a time in the order they were
+    submitted, even across passes.
+
+    """
+
+    def __init__(self, workers=8):
+        """Initializes this object properties."""
+
+        self.cond = threading.Condition()
+
+        # switch -> deque of (pass, function, args, kwargs)
+        self.queues = {}
+
+        # switches with queued work that no worker is running
+        self.ready = deque()
+        self.active = set()
+        self.stopped = False
+
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self.run, name="flow-pipeline-{}".format(i))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def new_pass(self, name, on_done=None):
+        """ Start a pass, close() it once all its operations are submitted. """
+        return FlowPass(name, on_done)
+
+    def submit(self, flow_pass, switch, fn, *args, **kwargs):
+        """ Queue fn(*args, **kwargs) behind earlier operations on switch. """
+
+        with flow_pass.lock:
+            flow_pass.submitted += 1
+
+        with self.cond:
+            if switch not in self.queues:
+                self.queues[switch] = deque()
+                if switch not in self.active:
+                    self.ready.append(switch)
+            self.queues[switch].append((flow_pass, fn, args, kwargs))
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.ready and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                switch = self.ready.popleft()
+                self.active.add(switch)
+                flow_pass, fn, args, kwargs = self.queues[switch].popleft()
+
+            error = None
+            try:
+                fn(*args, **kwargs)
+            except Exception, e:
+                LOG.error("flow operation on {} failed: {}".format(switch, e))
+                error = (switch, e)
+
+            with self.cond:
+                self.active.discard(switch)
+                if self.queues[switch]:
+                    self.ready.append(switch)
+                    self.cond.notify()
+                else:
+                    del self.queues[switch]
+
+            flow_pass.job_done(error)
+
+    def pending(self):
+        """ Number of queued operations not yet started. """
+
+        with self.cond:
+            return sum([len(q) for q in self.queues.values()])
+
+    def stop(self):
+        """ Stop the workers once their current operation finishes. """
+
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+#-------------------------------------------------------------------------------
+# Class 'FlowWriter'
+#-------------------------------------------------------------------------------
+class FlowWriter():
+    """ Queues a Client's flow writes per switch and drains them in parallel.
+
+    add_flow, delete_flow and friends take the same arguments as on Client
+    but return at once; the write lands later, after every earlier write on
+    the same switch. mark() ends the current pass and barrier() waits until
+    everything queued so far has landed.
+
+    The writes run on a FlowPipeline, which other passes may share.
+
+    """
+
+    def __init__(self, client, pipeline):
+        """Initializes this object properties."""
+
+        self.client = client
+        self.pipeline = pipeline
+        self.current = self.pipeline.new_pass("writes")
+
+        # marked passes not yet seen done, and errors of those that are
+        self.passes = []
+        self.errors = []
+
+    def submit(self, switch, fn, *args, **kwargs):
+        """ Queue any write for a switch, see FlowPipeline.submit. """
+        self.pipeline.submit(self.current, switch, fn, *args, **kwargs)
+
+    def checked(self, switch, fn, *args, **kwargs):
+        """ Queue a Client call whose None result means it failed. """
+
+        def call():
+            if fn(*args, **kwargs) is None:
+                raise Exception("{} failed".format(fn.__name__))
+
+        self.submit(switch, call)
+
+    def add_flow(self, **kwargs):
+        self.checked(kwargs['flow']['switch_id'], self.client.add_flow, **kwargs)
+
+    def delete_flow(self, name, id):
+        self.submit(name, self.client.delete_flow, name, id)
+
+    def put_sr_table(self, name, flows, replace=True, remove=None):
+        self.checked(name, self.client.put_sr_table, name, flows, replace, remove)
+
+    def add_goto_sr_flow(self, name):
+        self.checked(name, self.client.add_goto_sr_flow, name)
+
+    def delete_goto_sr_flow(self, name):
+        self.submit(name, self.client.delete_goto_sr_flow, name)
+
+    def clear_sr_table(self, name):
+        self.checked(name, self.client.clear_sr_table, name)
+
+    def mark(self, name=None):
+        """ End the current pass and start a new one.
+
+        :return: the FlowPass holding every write queued since the last mark
+
+        """
+
+        flow_pass = self.current
+        if name is not None:
+            flow_pass.name = name
+        self.current = self.pipeline.new_pass("writes")
+
+        flow_pass.close()
+
+        # don't hold on to passes nobody waits for
+        for p in [p for p in self.passes if p.done()]:
+            self.errors += p.errors
+            self.passes.remove(p)
+        self.passes.append(flow_pass)
+        return flow_pass
+
+    def barrier(self, timeout=None):
+        """ Wait until every write queued so far has landed.
+
+        :param float timeout: seconds to wait, None waits for ever
+        :return: list of (switch, error) for the writes that failed since
+                 the last barrier, None if the timeout expired first
+
+        """
+
+        self.mark()
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while self.passes:
+            flow_pass = self.passes[0]
+            wait = None
+            if deadline is not None:
+                wait = max(deadline - time.time(), 0)
+            if not flow_pass.wait(wait):
+                return None
+            self.errors += flow_pass.errors
+            self.passes.pop(0)
+
+        errors, self.errors = self.errors, []
+        return errors
+
+    def pending(self):
+        """ Number of queued writes not yet started. """
+        return self.pipeline.pending()
+
+    def stop(self):
+        self.pipeline.stop()
@@ -0,0 +1,142 @@
+#
+# Flow delta planner
+#
+
+import logging
+
+class FlowPlan():
+    '''SR flow operations needed to move from one routing state to another
+
+    Every operation is keyed by switch and names the target node whose
+    flow:<sid> entry has to be added, rewritten or removed. Switches
+    that joined need their whole table; switches that left need nothing.
+    '''
+
+    def __init__(self):
+        '''empty plan'''
+
+        # switch -> list of target nodes
+        self.add = {}
+        self.modify = {}
+        self.delete = {}
+
+        # switches new to or gone from the topology
+        self.joined = []
+        self.left = []
+
+        # switches whose hops to or from some switch, or whose own links,
+        # changed; their backups are rebuilt with BSC_FRR
+        self.moved = set()
+
+    def switches(self):
+        '''switches with at least one flow operation'''
+
+        r = set(self.add)
+        r.update(self.modify)
+        r.update(self.delete)
+        return r
+
+    def ops(self, switch):
+        '''number of flow operations for a switch'''
+
+        return (len(self.add.get(switch, []))
+                + len(self.modify.get(switch, []))
+                + len(self.delete.get(switch, [])))
+
+    def __len__(self):
+        return sum([self.ops(s) for s in self.switches()])
+
+    def __str__(self):
+        return "{} adds, {} modifies, {} deletes, {} joined, {} left".format(
+            sum([len(t) for t in self.add.values()]),
+            sum([len(t) for t in self.modify.values()]),
+            sum([len(t) for t in self.delete.values()]),
+            len(self.joined), len(self.left))
+
+
+def diff_tables(old, new, distances=False):
+    '''plan the flow changes between two next hop tables
+
+    @param old: next hop table the switches are programmed with
+    @param new: next hop table to program
+    @param distances: whether to fill in FlowPlan.moved too, both tables
+                      need their hop counts
+    @return: FlowPlan
+    '''
+
+    plan = FlowPlan()
+
+    for s in new:
+        nhops = new.next_hops(s)
+
+        # a new switch needs everything
+        if s not in old:
+            plan.joined.append(s)
+            plan.add[s] = list(nhops)
+            continue
+
+        ohops = old.next_hops(s)
+        for t in nhops:
+            if t not in ohops:
+                plan.add.setdefault(s, []).append(t)
+            elif old.forwarding(s, t) != new.forwarding(s, t):
+                plan.modify.setdefault(s, []).append(t)
+
+        for t in ohops:
+            if t not in nhops:
+                plan.delete.setdefault(s, []).append(t)
+
+        if distances:
+            if ports(old.graph, s) != ports(new.graph, s):
+                plan.moved.add(s)
+            for t in set(nhops) | set(ohops):
+                if old.distance(s, t) != new.distance(s, t):
+                    plan.moved.update([s, t])
+
+    for s in old:
+        if s not in new:
+            plan.left.append(s)
+
+    logging.debug("Flow plan: {}".format(plan))
+    return plan
+
+def ports(graph, s):
+    '''neighbour and port of each link out of a switch, sorted'''
+
+    return sorted([(n, attrs['source-tp']) for n, attrs in graph[s].items()])
+
+def plan_changes(changes, table, joined, left, moved=()):
+    '''plan the flow changes from an incremental SPF change report
+
+    @param changes: dict of (source, target) -> (old next hop, new next hop)
+    @param table: next hop table after the changes
+    @param joined: switches that are new to the topology
+    @param left: switches that are gone from the topology
+    @param moved: switches for FlowPlan.moved, see IncrementalSPF.moved
+    @return: FlowPlan
+    '''
+
+    plan = FlowPlan()
+    plan.joined = list(joined)
+    plan.left = list(left)
+    plan.moved = set(moved)
+
+    for s in plan.joined:
+        plan.add[s] = list(table.next_hops(s))
+
+    # their own flows are covered above or not needed
+    skip = set(plan.joined + plan.left)
+
+    for (s, t), (old_hop, new_hop) in changes.items():
+        if s in skip:
+            continue
+
+        if old_hop is None:
+            plan.add.setdefault(s, []).append(t)
+        elif new_hop is None:
+            plan.delete.setdefault(s, []).append(t)
+        else:
+            plan.modify.setdefault(s, []).append(t)
+
+    logging.debug("Flow plan: {}".format(plan))
+    return plan
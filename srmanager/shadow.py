@@ -0,0 +1,115 @@
+#
+# Shadow of the flows we have written
+#
+
+import hashlib
+import threading
+
+class Shadow():
+    '''content hashes of the flows last written, by switch, table and flow id
+
+    A write whose payload hashes the same as the last one that succeeded
+    for that flow can be skipped. A table is complete once we have
+    written or cleared all of it, so a flow missing from it is known to
+    be absent from the switch too.
+
+    Anything we are not sure of is forgotten: a failed or mismatched
+    write, a lost connection to the controller.
+    '''
+
+    def __init__(self, enabled=True):
+        '''empty shadow'''
+
+        self.enabled = enabled
+        self.lock = threading.Lock()
+
+        # (switch, table) -> flow id -> digest
+        self.tables = {}
+        self.complete = set()
+
+        self.sent = 0
+        self.skipped = 0
+
+    @staticmethod
+    def digest(payload):
+        '''content hash of a payload'''
+
+        return hashlib.sha1(payload).digest()
+
+    def unchanged(self, switch, table, id, digest):
+        '''True if the flow was last written with the same payload'''
+
+        if not self.enabled:
+            return False
+        return self.tables.get((switch, table), {}).get(id) == digest
+
+    def absent(self, switch, table, id):
+        '''True if the flow is known not to be on the switch'''
+
+        if not self.enabled:
+            return False
+        return (switch, table) in self.complete and id not in self.tables[(switch, table)]
+
+    def table_unchanged(self, switch, table, digests):
+        '''True if the whole table was last written with the same flows'''
+
+        if not self.enabled:
+            return False
+        return (switch, table) in self.complete and self.tables[(switch, table)] == digests
+
+    def known(self, switch, table):
+        '''flow id -> digest of a complete table, None if not complete'''
+
+        if not self.enabled or (switch, table) not in self.complete:
+            return None
+        return self.tables[(switch, table)]
+
+    def wrote(self, switch, table, id, digest):
+        '''record a flow write, digest None for a delete'''
+
+        with self.lock:
+            flows = self.tables.setdefault((switch, table), {})
+            if digest is None:
+                flows.pop(id, None)
+            else:
+                flows[id] = digest
+
+    def wrote_table(self, switch, table, digests):
+        '''record a write of the whole table'''
+
+        with self.lock:
+            self.tables[(switch, table)] = dict(digests)
+            self.complete.add((switch, table))
+
+    def forget(self, switch, table=None, id=None):
+        '''drop what we know of a flow, a table or a whole switch'''
+
+        with self.lock:
+            for key in self.tables.keys():
+                if key[0] != switch or (table is not None and key[1] != table):
+                    continue
+                if id is None:
+                    del self.tables[key]
+                else:
+                    self.tables[key].pop(id, None)
+                self.complete.discard(key)
+
+    def clear(self):
+        '''forget everything'''
+
+        with self.lock:
+            self.tables = {}
+            self.complete = set()
+
+    def count(self, sent=0, skipped=0):
+        with self.lock:
+            self.sent += sent
+            self.skipped += skipped
+
+    def counts(self):
+        '''dict of writes sent and writes skipped as unchanged'''
+
+        return {'sent': self.sent, 'skipped': self.skipped}
+
+    def __str__(self):
+        return "{} writes sent, {} skipped as unchanged".format(self.sent, self.skipped)
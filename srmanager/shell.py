@@ -10,6 +10,7 @@ from functools import wraps
 
 from srmanager.client import Client
 from srmanager.client import SrManagerClientException
+from srmanager.client import SR_TABLE, DATASTORE_CONFIG, DATASTORE_OPERATIONAL
 
 #-------------------------------------------------------------------------------
 # Class 'Shell'
@@ -108,6 +109,16 @@ class Shell(object):
         config['password']=get_property(props,'BSC_PASSWORD','admin')
         config['protocol']=get_property(props,'BSC_PROTOCOL','http')
         config['timeout']=get_property(props,'BSC_TIMEOUT', 5)
+        config['pool_connections']=get_property(props,'BSC_POOL_CONNECTIONS', 10)
+        config['pool_maxsize']=get_property(props,'BSC_POOL_MAXSIZE', 32)
+        config['pool_block']=get_property(props,'BSC_POOL_BLOCK', False)
+        config['verify']=get_property(props,'BSC_VERIFY', 'sync')
+        config['limit_initial']=get_property(props,'BSC_LIMIT_INITIAL', None)
+        config['limit_min']=float(get_property(props,'BSC_LIMIT_MIN', 1))
+        config['limit_max']=get_property(props,'BSC_LIMIT_MAX', None)
+        config['limit_latency']=float(get_property(props,'BSC_LIMIT_LATENCY', 1.0))
+        config['limit_backoff']=float(get_property(props,'BSC_LIMIT_BACKOFF', 0.5))
+        config['sid_overrides']=get_property(props,'BSC_SID_OVERRIDES', None)
 
         return config
 
@@ -123,10 +134,12 @@ class Shell(object):
             prog=self.prog,
             usage="%(prog)s get-flow\n\n"
                   "Options:\n"
-                  "  -n, --name          switch name\n"
-                  "  -i, --id            flow id\n")
-        parser.add_argument('-n', '--name', metavar = "<NAME>", required=True)
+                  "  -n, --name          switch name (all switches if not given)\n"
+                  "  -i, --id            flow id\n"
+                  "  -o, --operational   flows on the switches rather than configured\n")
+        parser.add_argument('-n', '--name', metavar = "<NAME>", required=False)
         parser.add_argument('-i', '--id', metavar = "<ID>", required=False)
+        parser.add_argument('-o', '--operational', action="store_true", required=False)
         parser.add_argument('-U', action="store_true", dest="usage", help=argparse.SUPPRESS)
 
         args = parser.parse_args(arguments)
@@ -134,7 +147,23 @@ class Shell(object):
             parser.print_usage()
             print "\n".strip()
 
-        if args.id:
+        if args.name is None or args.operational:
+            # one request for every switch
+            datastore = DATASTORE_OPERATIONAL if args.operational else DATASTORE_CONFIG
+            snapshot = self.sr.get_inventory_snapshot(datastore)
+            result = None
+            if snapshot is not None:
+                result = []
+                for name in sorted(snapshot):
+                    if args.name is not None and name != args.name:
+                        continue
+                    flows = snapshot[name].get(SR_TABLE, {})
+                    if args.id:
+                        id = args.id.replace("src-", "", 1)
+                        result += [flows[id]] if id in flows else []
+                    else:
+                        result += [flows[id] for id in sorted(flows)]
+        elif args.id:
             result = self.sr.get_flow(args.name,args.id)
         else:
             result = self.sr.get_flows(args.name)
@@ -247,10 +276,10 @@ class Shell(object):
             print "\n".strip()
 
 
-        result = self.sr.delete_flows(args.name)
+        result = self.sr.clear_sr_table(args.name)
 
-        if result is None:
-            print "flows removed from {}".format(args.name)
+        if result is not None:
+            print "{} flows removed from {}".format(result,args.name)
         else:
             print "flows not removed from {}".format(args.name)
 
@@ -0,0 +1,95 @@
+#
+# Node segment ids
+#
+
+import threading
+
+SRGB_BASE = 16000
+
+class SidCollision(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+def dpid(node):
+    '''datapath id of an openflow node name'''
+
+    return int(node[node.index(':')+1:])
+
+def parse_overrides(overrides):
+    '''node -> sid from a dict, or text like "openflow:1=17001,openflow:2=17002"'''
+
+    if not overrides:
+        return {}
+    if isinstance(overrides, dict):
+        return dict([(node, int(sid)) for node, sid in overrides.items()])
+
+    r = {}
+    for item in str(overrides).split(','):
+        if not item.strip():
+            continue
+        node, sid = item.split('=')
+        r[node.strip()] = int(sid)
+    return r
+
+class SidRegistry():
+    '''node segment ids, looked up either way
+
+    A node's sid is the SRGB base plus its dpid unless it has been given
+    one explicitly. Sids are handed out on first use and kept, so every
+    later lookup is a dict access. Two nodes are never given the same sid.
+    '''
+
+    def __init__(self, base=SRGB_BASE, overrides=None):
+        '''registry with the explicit sids of overrides'''
+
+        self.base = int(base)
+        self.lock = threading.Lock()
+
+        # node -> sid and sid -> node
+        self.sids = {}
+        self.nodes = {}
+
+        for node, sid in parse_overrides(overrides).items():
+            self.assign(node, sid)
+
+    def sid(self, node):
+        '''sid of a node'''
+
+        sid = self.sids.get(node)
+        if sid is None:
+            sid = self.assign(node, self.base + dpid(node), replace=False)
+        return sid
+
+    def node(self, sid):
+        '''node holding a sid, None if it is not in use'''
+
+        return self.nodes.get(int(sid))
+
+    def assign(self, node, sid, replace=True):
+        '''give a node a sid, raising SidCollision if another node has it
+
+        @param replace: whether a sid the node already has is replaced
+        @return: the node's sid
+        '''
+
+        sid = int(sid)
+        with self.lock:
+            old = self.sids.get(node)
+            if old is not None and not replace:
+                return old
+
+            owner = self.nodes.get(sid)
+            if owner is not None and owner != node:
+                raise SidCollision("sid {} of {} is already used by {}".format(sid, node, owner))
+
+            if old is not None:
+                del self.nodes[old]
+            self.sids[node] = sid
+            self.nodes[sid] = node
+            return sid
+
+    def __len__(self):
+        return len(self.sids)
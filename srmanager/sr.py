@@ -5,6 +5,20 @@ import os
 import tm
 import logging
 import client
+import events
+import stream
+from srmanager.controller import Controller
+from srmanager.nexthop import NextHopTable, SearchPool, parents_avoiding
+from srmanager.ispf import IncrementalSPF
+from srmanager.planner import diff_tables, plan_changes
+from srmanager.pipeline import FlowPipeline, FlowWriter
+from srmanager.sid import SidRegistry, SidCollision
+from srmanager.csr import CSRGraph
+from srmanager.groups import GroupTable, GROUP_SELECT, GROUP_INDIRECT, GROUP_FAST_FAILOVER
+
+# Topology graph backends
+GRAPH_NETWORKX='networkx'
+GRAPH_CSR='csr'
 
 # Setup logging
 #logging.basicConfig(filename='sr.log',level=logging.DEBUG)
@@ -23,15 +37,44 @@ class SR():
         # Get controller config
         self.config = self.get_config("ctrl.yml")
 
+        # SPF worker processes, forked before any thread starts and kept
+        # for every next hop table
+        self.spf_pool = None
+        if self.config['spf_workers'] > 1:
+            self.spf_pool = SearchPool(self.config['spf_workers'])
+
+        # One controller, so TM and SRManager share a connection pool
+        self.ctrl = Controller(config=self.config)
+
         # Grab TM
-        self.tm = tm.TopologyManager(config=self.config)
+        self.tm = tm.TopologyManager(ctrl=self.ctrl)
+
+        # Node sids, shared with SRManager for service labels
+        self.sids = SidRegistry(self.srgb_start, self.config['sid_overrides'])
 
         # Grab SRManager
-        self.srm = client.Client(config=self.config)
+        self.srm = client.Client(ctrl=self.ctrl, sids=self.sids)
 
         # init networkx
         self.graph = nx.DiGraph()
 
+        # group ids of each switch, and ids to delete once nothing uses them
+        self.groups = GroupTable()
+        self.freed_groups = {}
+
+        # switch -> target -> repair node its backup pushes, with BSC_FRR
+        self.repair_nodes = {}
+
+        # topology change subscription, opened on first use
+        self.stream = None
+
+        # background flow writes, see start_pipeline
+        self.pipeline = None
+        self.writer = None
+        self.flow_pass = None
+        self.pass_name = None
+        self.pass_nodes = set()
+
     def get_property(self, dic, name, default):
         ''''get property'''
 
@@ -59,6 +102,29 @@ class SR():
         config['password']=self.get_property(props,'BSC_PASSWORD','admin')
         config['protocol']=self.get_property(props,'BSC_PROTOCOL','http')
         config['timeout']=self.get_property(props,'BSC_TIMEOUT', 5)
+        config['pool_connections']=self.get_property(props,'BSC_POOL_CONNECTIONS', 10)
+        config['pool_maxsize']=self.get_property(props,'BSC_POOL_MAXSIZE', 32)
+        config['pool_block']=self.get_property(props,'BSC_POOL_BLOCK', False)
+        config['verify']=self.get_property(props,'BSC_VERIFY', 'sync')
+        config['stream_keepalive']=self.get_property(props,'BSC_STREAM_KEEPALIVE', 30)
+        config['stream_backoff']=self.get_property(props,'BSC_STREAM_BACKOFF', 1)
+        config['stream_backoff_max']=self.get_property(props,'BSC_STREAM_BACKOFF_MAX', 60)
+        config['debounce_window']=float(self.get_property(props,'BSC_DEBOUNCE_WINDOW', 0.2))
+        config['debounce_max']=float(self.get_property(props,'BSC_DEBOUNCE_MAX', 2))
+        config['pipeline_workers']=self.get_property(props,'BSC_PIPELINE_WORKERS', 8)
+        config['reconcile']=unicode(self.get_property(props,'BSC_RECONCILE', True)).lower() == u'true'
+        config['shadow']=unicode(self.get_property(props,'BSC_SHADOW', True)).lower() == u'true'
+        config['sid_overrides']=self.get_property(props,'BSC_SID_OVERRIDES', None)
+        config['graph']=self.get_property(props,'BSC_GRAPH', GRAPH_NETWORKX)
+        config['spf_workers']=int(self.get_property(props,'BSC_SPF_WORKERS', 1))
+        config['ecmp']=unicode(self.get_property(props,'BSC_ECMP', False)).lower() == u'true'
+        config['indirect']=unicode(self.get_property(props,'BSC_INDIRECT', False)).lower() == u'true'
+        config['frr']=unicode(self.get_property(props,'BSC_FRR', False)).lower() == u'true'
+        config['limit_initial']=self.get_property(props,'BSC_LIMIT_INITIAL', None)
+        config['limit_min']=float(self.get_property(props,'BSC_LIMIT_MIN', 1))
+        config['limit_max']=self.get_property(props,'BSC_LIMIT_MAX', None)
+        config['limit_latency']=float(self.get_property(props,'BSC_LIMIT_LATENCY', 1.0))
+        config['limit_backoff']=float(self.get_property(props,'BSC_LIMIT_BACKOFF', 0.5))
 
         return config
 
@@ -68,8 +134,12 @@ class SR():
 
         logging.debug("Get topology")
 
-        # Allocate new graph
-        g = nx.DiGraph()
+        # Nodes, (source, dest, source tp) edges and an index of
+        # link id -> link ends, turned into a graph at the end
+        nodes = []
+        edges = []
+        known = set()
+        links = {}
 
         # Grab the toplogy from the controller
         topology = self.tm.get_topology()
@@ -83,7 +153,7 @@ class SR():
               nid = node['node-id']
               # only add switches
               if nid.find('host') == -1:
-                g.add_node(nid)
+                nodes.append(nid)
         else:
             logging.info("No nodes found in topology")
 
@@ -94,77 +164,654 @@ class SR():
             tlinks = topology['link']
             for link in tlinks:
                 if link['link-id'].find('host') == -1:
+                    links[link['link-id']] = events.parse_link(link)
+
                     edge = (link['source']['source-node'],
-                            link['destination']['dest-node'])
-                    srctp = link['source']['source-tp']
-                    edge += ({ 'source-tp': srctp },)
+                            link['destination']['dest-node'],
+                            link['source']['source-tp'])
                     logging.debug('edge added to graph: {}'.format(edge))
-                    g.add_edge(*edge)
+                    edges.append(edge)
+                    known.add(edge[:2])
 
+                    # the reverse direction, unless a link gave it already
                     edge = (link['destination']['dest-node'],
-                            link['source']['source-node'])
-                    srctp = link['destination']['dest-tp']
-                    edge += ({ 'source-tp': srctp },)
-                    logging.debug('edge added to graph: {}'.format(edge))
-                    if not g.has_edge(link['destination']['dest-node'],link['source']['source-node']):
-                        g.add_edge(*edge)
+                            link['source']['source-node'],
+                            link['destination']['dest-tp'])
+                    if edge[:2] not in known:
+                        logging.debug('edge added to graph: {}'.format(edge))
+                        edges.append(edge)
+                        known.add(edge[:2])
         else:
             logging.info("No links found in topology")
 
+        # interned and packed into arrays, for large topologies
+        if self.config['graph'] == GRAPH_CSR:
+            return CSRGraph(nodes, edges, {'links': links})
+
+        # Allocate new graph
+        g = nx.DiGraph()
+        g.graph['links'] = links
+        g.add_nodes_from(nodes)
+        for u, v, srctp in edges:
+            g.add_edge(u, v, { 'source-tp': srctp })
+
         # return the new graph
         return g
 
-    def add_sr_flow(self, graph, snode, tnode, nnode):
-        '''Add an SR Flow to a node'''
+    def next_hop_table(self, graph):
+        '''shortest path next hops of a graph, over BSC_SPF_WORKERS processes'''
 
-        logging.debug("Add SR Flow {}:{}:{}".format(snode, tnode, nnode))
+        return NextHopTable(graph, ecmp=self.config['ecmp'], depths=self.config['frr'],
+                            pool=self.spf_pool)
+
+    def incremental_spf(self, graph):
+        '''incremental SPF of a graph, see IncrementalSPF
+
+        A compact graph is turned into networkx, as the engine edits it.
+        '''
+
+        return IncrementalSPF(graph, self.config['ecmp'])
+
+    def sr_flow(self, graph, snode, tnode, nnode):
+        '''Build the SR flow on a node towards a target via a next hop'''
 
-        tsid = self.get_sid(tnode)
         srctp = graph[snode][nnode]['source-tp']
         if nnode == tnode:
             php = True
         else:
             php = False
+        return self.port_flow(snode, tnode, srctp, php)
+
+    def port_flow(self, snode, tnode, port, php):
+        '''Build the SR flow on a node towards a target out of a port'''
+
+        tsid = self.get_sid(tnode)
         flow = {
             'flow_id': 'flow:{}'.format(tsid),
             'switch_id': snode,
             'label': '{}'.format(tsid),
-            'port': srctp,
+            'port': port,
             'penultimate': php
         }
+        return flow
+
+    def forwarding_key(self, graph, nht, snode, tnode, repairs=None):
+        '''what a node does with packets for a target, None without a path
+
+        @param repairs: paths around each failed link, see backup_bucket
+        @return: tuple of the group type and a tuple of buckets, each the
+                 output port, whether the label is popped and a label to
+                 push; the type is None when the flow outputs to the port
+                 itself
+        '''
+
+        hops = nht.ecmp_hops(snode, tnode)
+        if not hops:
+            return None
+
+        buckets = tuple(sorted([(graph[snode][n]['source-tp'], n == tnode, None) for n in hops]))
+        if len(buckets) > 1:
+            return (GROUP_SELECT, buckets)
+        if self.config['frr']:
+            backup = self.backup_bucket(graph, nht, snode, tnode, hops[0], repairs)
+            if backup is not None:
+                return (GROUP_FAST_FAILOVER, buckets + (backup,))
+        if self.config['indirect']:
+            return (GROUP_INDIRECT, buckets)
+        return (None, buckets)
+
+    def backup_bucket(self, graph, nht, snode, tnode, nnode, repairs=None):
+        '''bucket taking packets for a target around a failed next hop link
+
+        A loop free alternate is a neighbour whose shortest path to the
+        target does not come back through this node. Without one, the
+        packet is sent along the path the network will use once the link
+        is gone, with the sid of a repair node on it pushed: the furthest
+        node on that path that the first hop reaches, and that reaches
+        the target, without coming back through this node.
+
+        @param nnode: the next hop whose link fails
+        @param repairs: dict to keep the paths around each failed link in,
+                        for the other targets of the node
+        @return: bucket as in forwarding_key, None if there is no backup
+        '''
+
+        d = nht.distance
+        dt = d(snode, tnode)
+
+        repaired = self.repair_nodes.setdefault(snode, {})
+        repaired.pop(tnode, None)
+
+        alternates = []
+        for n in graph[snode]:
+            if n == nnode:
+                continue
+            dnt = d(n, tnode)
+            dns = d(n, snode)
+            if dnt is not None and dns is not None and dnt < dns + dt:
+                alternates.append((dnt, graph[snode][n]['source-tp'], n))
+        if alternates:
+            dnt, port, n = min(alternates)
+            return (port, n == tnode, None)
+
+        if repairs is None:
+            repairs = {}
+        parents = repairs.get(nnode)
+        if parents is None:
+            parents = repairs[nnode] = parents_avoiding(graph, snode, nnode)
+        if tnode not in parents:
+            return None
+
+        path = [tnode]
+        while path[-1] != snode:
+            path.append(parents[path[-1]])
+        path.reverse()
+
+        first = path[1]
+        for r in reversed(path[2:-1]):
+            dfr = d(first, r)
+            dfs = d(first, snode)
+            drt = d(r, tnode)
+            drs = d(r, snode)
+            if None in (dfr, dfs, drt, drs):
+                continue
+            if dfr < dfs + d(snode, r) and drt < drs + dt and self.sid_or_none(r) is not None:
+                repaired[tnode] = r
+                return (graph[snode][first]['source-tp'], False, '{}'.format(self.get_sid(r)))
+        return None
+
+    def sr_flows_via(self, graph, nht, snode, tnodes, kept=None):
+        '''Build the SR flows on a node towards some targets
+
+        With BSC_ECMP a target with more than one equal cost next hop is
+        reached through a select group with a bucket per next hop. With
+        BSC_FRR a target with a backup is reached through a fast failover
+        group, and with BSC_INDIRECT every other target through an indirect
+        group per port.
+
+        @param kept: dict to add the flows left on a repointed group to,
+                     see repoint_groups
+        @return: list of flows, targets without a path are left out
+        '''
+
+        keys = {}
+        repairs = {}
+        for tnode in tnodes:
+            if self.sid_or_none(tnode) is None:
+                continue
+            key = self.forwarding_key(graph, nht, snode, tnode, repairs)
+            if key is None:
+                logging.error("no path for {} to {}".format(snode, tnode))
+                continue
+            keys[tnode] = key
+
+        repointed = self.repoint_groups(snode, keys)
+        if kept is not None:
+            kept.update(repointed)
+
+        # a repointed group is written after the flows leaving it, so none
+        # may join it in the same pass
+        avoid = set(repointed.values())
+
+        flows = []
+        for tnode in tnodes:
+            key = keys.get(tnode)
+            if key is None:
+                continue
+            if key[0] is not None:
+                flows.append(self.group_flow(snode, tnode, key, avoid))
+                continue
+            self.release_group(snode, 'flow:{}'.format(self.get_sid(tnode)))
+            port, php, push = key[1][0]
+            flows.append(self.port_flow(snode, tnode, port, php))
+
+        return flows
+
+    def repoint_groups(self, snode, keys):
+        '''repoint groups whose flows are all moving to other groups
+
+        When every flow using a group is about to move, the group is given
+        the new key most of them move to, even if another group has it, so
+        they keep pointing at it and a link failure rewrites one group
+        rather than a flow per target.
+
+        @param keys: target -> new forwarding key
+        @return: dict of flow id -> group id of the flows left pointing at
+                 a repointed group, whose flows need no rewrite
+        '''
+
+        moving = {}
+        for tnode, key in keys.items():
+            flow_id = 'flow:{}'.format(self.get_sid(tnode))
+            id = self.groups.group_of(snode, flow_id)
+            if id is None or self.groups.key(snode, id) == key:
+                continue
+            moving.setdefault(id, {}).setdefault(key, []).append(flow_id)
+
+        kept = {}
+        for id in sorted(moving):
+            by_key = moving[id]
+            if sum([len(f) for f in by_key.values()]) != len(self.groups.users_of(snode, id)):
+                continue
+            grouped = [k for k in by_key if k[0] is not None]
+            if not grouped:
+                continue
+            key = max(grouped, key=lambda k: (len(by_key[k]), k))
+            logging.debug("repointing group {} of {} to {}".format(id, snode, key))
+            self.groups.repoint(snode, id, key)
+            for flow_id in by_key[key]:
+                kept[flow_id] = id
+
+        return kept
+
+    def group_state(self, snode):
+        '''group id -> (key, flow ids) of every group of a node'''
+
+        return dict([(id, (key, self.groups.users_of(snode, id)))
+                     for id, key in self.groups.groups(snode).items()])
+
+    def merge_groups(self, snode, before):
+        '''move the flows of groups that repeat another's key onto it
+
+        Repointing can leave groups with the same key. Once none of them
+        has changed its key or its flows since before, the flows of all
+        but the most used one are pointed at it and the others freed.
+        Groups still moving are left alone, as a link coming back would
+        repoint them again.
+
+        @param before: group state of the node before this pass, see
+                       group_state
+        @return: list of the flows to rewrite
+        '''
+
+        now = self.group_state(snode)
+        flows = []
+        for ids in self.groups.duplicates(snode):
+            if [id for id in ids if before.get(id) != now[id]]:
+                continue
+            into = max(ids, key=lambda id: (len(now[id][1]), -id))
+            for id in ids:
+                if id == into:
+                    continue
+                logging.debug("merging group {} of {} into {}".format(id, snode, into))
+                for flow_id in sorted(self.groups.merge(snode, id, into)):
+                    flows.append(self.group_flow_doc(snode, flow_id, into))
+                self.freed_groups.setdefault(snode, set()).add(id)
+        return flows
+
+    def group_flow(self, snode, tnode, key, avoid=()):
+        '''Build the SR flow on a node towards a target via the group with a key
+
+        @param avoid: ids of groups not to join, see GroupTable.use
+        '''
+
+        tsid = self.get_sid(tnode)
+        flow_id = 'flow:{}'.format(tsid)
+        id, freed = self.groups.use(snode, flow_id, key, avoid)
+        self.freed_groups.setdefault(snode, set()).update(freed)
+        return self.group_flow_doc(snode, flow_id, id)
+
+    def group_flow_doc(self, snode, flow_id, id):
+        '''the SR flow flow:<sid> of a node pointing at a group'''
+
+        return {
+            'flow_id': flow_id,
+            'switch_id': snode,
+            'label': flow_id.split(':', 1)[1],
+            'group': id
+        }
+
+    def release_group(self, snode, flow_id):
+        '''a flow of a node no longer points at a group'''
+
+        freed = self.groups.release(snode, flow_id)
+        if freed:
+            self.freed_groups.setdefault(snode, set()).update(freed)
+
+    def node_groups(self, snode, flows, ids=()):
+        '''groups a node's flows point at, and groups nothing points at now
+
+        @param ids: more group ids to write, such as repointed groups
+                    whose flows are left out
+        @return: tuple of a list of (id, type, buckets) to write before the
+                 flows and a list of group ids to delete after them
+        '''
+
+        groups = []
+        for id in sorted(set([f['group'] for f in flows if f.get('group') is not None]) | set(ids)):
+            type, buckets = self.groups.key(snode, id)
+            groups.append((id, type, list(buckets)))
+
+        # freed ids are taken until their deletes are queued
+        freed = sorted(self.freed_groups.pop(snode, ()))
+        self.groups.free(snode, freed)
+        return (groups, freed)
+
+    def write_groups(self, snode, groups):
+        '''write groups of a node, see node_groups'''
+
+        for id, type, buckets in groups:
+            if self.srm.put_group(snode, id, type, buckets) is None:
+                logging.error("failed to write group {} for {}".format(id, snode))
+
+    def delete_groups(self, snode, freed):
+        '''delete groups of a node nothing points at'''
+
+        for id in freed:
+            if self.srm.delete_group(snode, id) is None:
+                logging.error("failed to delete group {} for {}".format(id, snode))
+
+    def add_sr_flow(self, graph, snode, tnode, nnode):
+        '''Add an SR Flow to a node'''
+
+        logging.debug("Add SR Flow {}:{}:{}".format(snode, tnode, nnode))
+
+        flow = self.sr_flow(graph, snode, tnode, nnode)
         logging.debug("add_flow: {}".format(flow))
         self.srm.add_flow(flow=flow)
 
-    def add_sr_flows_for_node(self, graph, snode):
-        '''add sr flows for a node'''
+    def sr_flows_for_node(self, graph, snode, nht, kept=None):
+        '''build the sr flows of a node towards every other node, see sr_flows_via'''
 
-        logging.debug("Adding SR flows for " + snode)
+        # add rule for every other node (i.e. not us)
+        return self.sr_flows_via(graph, nht, snode,
+                                 [tnode for tnode in graph if tnode != snode], kept)
+
+    def write_sr_table(self, snode, flows, groups=(), freed=()):
+        '''write the goto flow and the whole SR table of a node
+
+        Groups the flows point at are written first, and groups nothing
+        points at any more deleted last, see node_groups.
+        '''
 
         # Add low priority goto to SR flow
         self.srm.add_goto_sr_flow(snode)
 
-        for tnode in graph:
-                # add rule for every other node (i.e. not us)
-                if snode == tnode:
-                    continue
+        self.write_groups(snode, groups)
+
+        # Write the whole SR table for this node in one request
+        if self.srm.put_sr_table(snode, flows) is None:
+            logging.error("failed to write SR table for {}".format(snode))
+
+        self.delete_groups(snode, freed)
+
+    def write_sr_changes(self, snode, flows, remove, groups=(), freed=(), repointed=()):
+        '''write changed flows and remove flow ids on a node, groups as write_sr_table
+
+        A repointed group is written after the flows, so flows moving off
+        it never forward the new way; no flow moves onto it in the same
+        pass, see sr_flows_via.
+
+        @param repointed: ids among groups that forward another way now
+        '''
+
+        repointed = set(repointed)
+        self.write_groups(snode, [g for g in groups if g[0] not in repointed])
+        self.write_flows(snode, flows, remove)
+        self.write_groups(snode, [g for g in groups if g[0] in repointed])
+        self.delete_groups(snode, freed)
+
+    def write_flows(self, snode, flows, remove):
+        '''write some flows and remove some flow ids of a node'''
+
+        # a lone change is cheaper as a single flow write
+        if len(flows) == 1 and len(remove) == 0:
+            self.srm.add_flow(flow=flows[0])
+        elif len(flows) == 0 and len(remove) == 1:
+            self.srm.delete_flow(snode, remove[0])
+        elif (flows or remove) and self.srm.put_sr_table(snode, flows, replace=False, remove=remove) is None:
+            logging.error("failed to update SR table for {}".format(snode))
+
+    def start_pipeline(self, workers=None):
+        '''program flows in the background from now on
+
+        Passes are queued through a FlowWriter on the pipeline, so
+        wait_flows can wait for them.
+        '''
+
+        if workers is None:
+            workers = int(self.config['pipeline_workers'])
+        self.pipeline = FlowPipeline(workers)
+        self.writer = FlowWriter(self.srm, self.pipeline)
+        return self.pipeline
+
+    def controller_load(self):
+        '''in-flight limit and rolling latency per verb towards the controller'''
 
-                # Add flow for this target node
-                try:
-                    sp = nx.shortest_path(graph, snode, tnode)
-                    self.add_sr_flow(graph, snode, tnode, sp[1])
+        return str(self.ctrl.limiter)
 
-                except nx.NetworkXNoPath:
-                    logging.error("no path for {} to {}".format(snode, tnode))
+    def wait_flows(self, timeout=None):
+        '''wait until every queued flow write has landed, see FlowWriter.barrier'''
 
-    def add_sr_flows(self, graph):
+        if self.writer is None:
+            return []
+        return self.writer.barrier(timeout)
+
+    def begin_pass(self, name):
+        '''start a programming pass'''
+
+        self.pass_name = name
+        self.pass_nodes = set()
+
+    def run(self, snode, fn, *args):
+        '''run a write for a node now, or queue it behind the node's others'''
+
+        if self.writer is None:
+            fn(*args)
+        else:
+            self.pass_nodes.add(snode)
+            self.writer.submit(snode, fn, *args)
+
+    def end_pass(self):
+        '''finish a programming pass
+
+        @return: the FlowPass when writes run in the background, else None
+        '''
+
+        if self.writer is None:
+            # Check deferred writes, one table read per node
+            self.srm.verify_flows()
+            return None
+
+        # Check deferred writes of each node right behind them
+        if self.srm.verify == client.VERIFY_DEFERRED:
+            for snode in self.pass_nodes:
+                self.writer.submit(snode, self.srm.verify_flows, [snode])
+
+        self.flow_pass = self.writer.mark(self.pass_name)
+        return self.flow_pass
+
+    def add_sr_flows_for_node(self, graph, snode, nht=None):
+        '''add sr flows for a node'''
+
+        logging.debug("Adding SR flows for " + snode)
+
+        if nht is None:
+            nht = self.next_hop_table(graph)
+
+        flows = self.sr_flows_for_node(graph, snode, nht)
+        groups, freed = self.node_groups(snode, flows)
+        self.run(snode, self.write_sr_table, snode, flows, groups, freed)
+
+    def add_sr_flows(self, graph, nht=None):
         '''add sr flows'''
 
         logging.debug("Add SR Flows")
 
+        # Shortest paths for every pair, computed once
+        if nht is None:
+            nht = self.next_hop_table(graph)
+
+        self.begin_pass("add sr flows")
+
         # Spin thru each node and set the flows
         logging.debug("Adding flows for each node")
         for snode in graph:
-            self.add_sr_flows_for_node(graph, snode)
+            self.add_sr_flows_for_node(graph, snode, nht)
+
+        flow_pass = self.end_pass()
+        logging.info("Controller load: {}".format(self.controller_load()))
+        logging.info("Flow writes: {}".format(self.srm.shadow))
+        return flow_pass
+
+    def ensure_goto_sr_flow(self, snode):
+        '''add the goto SR table flow unless it is installed already'''
+
+        if not self.srm.get_goto_sr_flow(snode):
+            self.srm.add_goto_sr_flow(snode)
+
+    def seed_groups(self, snode, installed, groups):
+        '''start the group table of a node from what is installed on it
+
+        Installed flows keep the group they point at, so a restart on a
+        stable network writes no group. Ids of groups that are not ours
+        are never handed out, and unused groups of ours and groups that
+        could not be read are deleted once no flow points at them.
+
+        @param installed: flows as returned by Client.get_flows
+        @param groups: group id -> raw group installed on the node, None
+                       if they could not be read
+        @return: group id -> key of the installed groups of ours
+        '''
+
+        keys = {}
+        foreign = set()
+        for id, group in (groups or {}).items():
+            key = client.group_key(group)
+            if key is None:
+                foreign.add(id)
+            else:
+                keys[id] = key
+
+        flows = {}
+        for f in installed:
+            if not client.is_node_flow(client.sr_inventory_id(f['id'])):
+                continue
+            # an id that is not a number is not one we handed out
+            try:
+                flows[f['id']] = int(f.get('group'))
+            except (TypeError, ValueError):
+                continue
+
+        freed = set(self.groups.seed(snode, keys, flows))
+
+        # ids flows point at whose group we don't know, they move off
+        # them onto fresh ids first
+        freed.update([id for id in flows.values() if id not in keys and id not in foreign])
+        self.groups.take(snode, freed | foreign)
+        self.freed_groups.setdefault(snode, set()).update(freed)
+
+        return keys
+
+    def reconcile_sr_flows_for_node(self, graph, snode, nht, installed, goto=None, groups=None):
+        '''write only what differs between a node's installed and desired flows
+
+        Groups are diffed the same way, see seed_groups.
+
+        @param installed: flows as returned by Client.get_flows, None if
+                          they could not be read (the table is rewritten)
+        @param goto: whether the goto SR table flow is installed, None to
+                     look it up
+        @param groups: group id -> raw group installed on the node, None
+                       if they could not be read
+        @return: tuple of flows written and flow ids removed
+        '''
+
+        keys = {}
+        if installed is not None:
+            keys = self.seed_groups(snode, installed, groups)
+
+        kept = {}
+        desired = self.sr_flows_for_node(graph, snode, nht, kept)
+
+        # what is written is diffed against what is installed, not the
+        # shadow, which may be out of date after a reconnect
+        self.srm.shadow.forget(snode, client.GROUPS)
+
+        if installed is None:
+            logging.info("Can't read SR flows of {}, rewriting them".format(snode))
+            groups, freed = self.node_groups(snode, desired)
+            self.run(snode, self.write_sr_table, snode, desired, groups, freed)
+            return (len(desired), 0)
+
+        current = dict([(flow['id'], flow) for flow in installed])
+
+        flows = [f for f in desired
+                 if not client.flows_equal(f, current.get(f['flow_id']))]
+        wanted = set([f['flow_id'] for f in desired])
+        # only node flows are ours, sra- and other user flows are left be
+        remove = [id for id in current if id not in wanted
+                  and client.is_node_flow(client.sr_inventory_id(id))]
+        for id in remove:
+            self.release_group(snode, id)
+
+        # groups the desired flows use that are not installed as they are
+        # wanted, and groups of ours nothing points at any more
+        groups, freed = self.node_groups(snode, desired, kept.values())
+        groups = [g for g in groups if keys.get(g[0]) != (g[1], tuple(g[2]))]
+
+        # a switch that has lost its goto flow would not use the table
+        if goto is None:
+            self.run(snode, self.ensure_goto_sr_flow, snode)
+        elif not goto:
+            self.run(snode, self.srm.add_goto_sr_flow, snode)
+
+        if flows or remove or groups or freed:
+            logging.debug("Reconciling {}: {} flows to write, {} to remove".format(
+                snode, len(flows), len(remove)))
+            self.run(snode, self.write_sr_changes, snode, flows, remove, groups, freed,
+                     kept.values())
+
+        return (len(flows), len(remove))
+
+    def reconcile_sr_flows(self, graph, nht=None):
+        '''bring the installed SR flows in line with the topology
+
+        Used instead of del_all_flows and add_sr_flows on start, so a
+        restart on a stable network writes no flows or groups and traffic
+        keeps flowing while the daemon comes up.
+        '''
+
+        logging.debug("Reconcile SR Flows")
+
+        if nht is None:
+            nht = self.next_hop_table(graph)
+
+        # one read for every node, or one per node if that fails
+        snapshot = self.srm.get_inventory_snapshot()
+        if snapshot is None:
+            tables = self.srm.get_sr_flows(graph.nodes())
+
+        self.begin_pass("reconcile sr flows")
+
+        written = removed = 0
+        for snode in graph:
+            if snapshot is not None:
+                node = snapshot.get(snode, {})
+                installed = node.get(client.SR_TABLE, {}).values()
+                goto = client.GOTO_SR_FLOW_ID in node.get(0, {})
+                groups = node.get(client.GROUPS, {})
+            else:
+                installed = tables.get(snode)
+                goto = groups = None
+
+            w, r = self.reconcile_sr_flows_for_node(graph, snode, nht, installed, goto, groups)
+            written += w
+            removed += r
+
+        logging.info("Reconciled {} nodes: {} flows to write, {} to remove".format(
+            len(graph), written, removed))
+
+        return self.end_pass()
+
+    def start_sr_flows(self, graph, nht=None):
+        '''program a freshly read topology, reconciling or starting clean'''
+
+        if self.config['reconcile']:
+            return self.reconcile_sr_flows(graph, nht)
+
+        self.del_all_flows(graph)
+        return self.add_sr_flows(graph, nht)
 
     def del_sr_flow(self, node, tnode):
         '''delete sr flow'''
@@ -208,15 +855,50 @@ class SR():
 
         logging.debug("Delete All flows")
 
-        for node in graph:
-            self.srm.delete_flows(node)
-            self.srm.delete_goto_sr_flow(node)
+        # One write per node, all nodes at once
+        counts = self.srm.clear_sr_tables(graph.nodes())
+
+        removed = 0
+        for node in counts:
+            if counts[node] is None:
+                logging.error("failed to delete SR flows for {}".format(node))
+            else:
+                removed += counts[node]
+
+        logging.info("Deleted {} SR flows from {} nodes".format(removed, len(counts)))
+        return removed
+
+    def topology_events(self):
+        '''iterator of topology change notifications, kept open across calls'''
+
+        if self.stream is None:
+            self.stream = self.srm.get_topology_events()
+        return self.stream
+
+    def open_topology_events(self):
+        '''subscribe to topology changes before reading the topology
+
+        Changes made while the topology is read and programmed then
+        wait on the subscription, and if it could not be opened yet the
+        first batch brings RESYNC instead.
+        '''
+
+        if not self.topology_events().open():
+            logging.error("Topology stream not open yet, resyncing once it is")
+
+    def topology_batches(self):
+        '''iterator of topology notification batches, see TopologyStream.batches'''
+
+        return self.topology_events().batches(self.config['debounce_window'],
+                                              self.config['debounce_max'])
 
     def listen_to_topology(self):
-        ws = self.srm.get_topology_stream()
+        '''wait for the next topology change notification'''
+
         logging.info("Listening on stream for topology change... (ctrl-c to exit)")
-        result =  ws.recv()
+        result = next(self.topology_events())
         logging.info("Change detected, new topology: ")
+        return result
 
     def topology_equal(self, g1, g2):
         '''test if two graphs are the same'''
@@ -234,6 +916,90 @@ class SR():
 
         return True
 
+    def apply_flow_plan(self, graph, nht, plan):
+        '''write the flow changes of a plan, one request per switch'''
+
+        logging.info("Applying flow plan: {}".format(plan))
+
+        self.begin_pass("flow plan")
+
+        for n in plan.left:
+            logging.debug("old node {} gone away".format(n))
+            self.groups.forget(n)
+            self.freed_groups.pop(n, None)
+            self.repair_nodes.pop(n, None)
+
+        # new switches get their whole table
+        for n in plan.joined:
+            self.add_sr_flows_for_node(graph, n, nht)
+
+        switches = set(plan.switches())
+        backups = {}
+        if self.config['frr']:
+            backups = self.moved_backups(graph, nht, plan)
+            switches.update(backups)
+
+        # and switches whose groups sharing a key may have settled
+        switches.update([n for n in graph if self.groups.duplicates(n)])
+
+        joined = set(plan.joined)
+        for n in sorted(switches):
+            if n in joined:
+                continue
+
+            tnodes = plan.add.get(n, []) + plan.modify.get(n, [])
+            planned = set(tnodes)
+            tnodes += [t for t in backups.get(n, []) if t not in planned]
+            before = self.group_state(n)
+            kept = {}
+            flows = self.sr_flows_via(graph, nht, n, tnodes, kept)
+            remove = ['flow:{}'.format(self.sid_or_none(t)) for t in plan.delete.get(n, [])
+                      if self.sid_or_none(t) is not None]
+            for id in remove:
+                self.release_group(n, id)
+
+            # flows left on a repointed group are unchanged, only the
+            # group is written; settled groups sharing a key are merged
+            merged = self.merge_groups(n, before)
+            moved = set([f['flow_id'] for f in merged])
+            flows = [f for f in flows if f['flow_id'] not in kept and f['flow_id'] not in moved]
+            flows += merged
+
+            groups, freed = self.node_groups(n, flows, kept.values())
+            if flows or remove or groups or freed:
+                self.run(n, self.write_sr_changes, n, flows, remove, groups, freed,
+                         kept.values())
+
+        return self.end_pass()
+
+    def moved_backups(self, graph, nht, plan):
+        '''targets whose backup may have moved, per switch
+
+        A backup is chosen from the hops to and from the switch, its
+        neighbours and its repair node, and from the ports of the switch.
+        Switches on which or next to which something moved rebuild every
+        backup, the others only those through a repair node that moved.
+
+        @return: dict of switch -> list of targets
+        '''
+
+        moved = set([n for n in plan.moved if n in graph])
+        near = set(moved)
+        for n in moved:
+            near.update(graph.predecessors(n))
+
+        r = {}
+        for n in near:
+            r[n] = [t for t in graph if t != n and nht.distance(n, t) is not None]
+        for n, repaired in self.repair_nodes.items():
+            if n in near or n not in graph:
+                continue
+            targets = [t for t, rnode in repaired.items()
+                       if rnode in moved and nht.distance(n, t) is not None]
+            if targets:
+                r[n] = targets
+        return r
+
     def update_sr_flows(self, old):
         '''update flows with new graph'''
 
@@ -242,49 +1008,126 @@ class SR():
         # grab new flows
         new = self.get_topology()
 
-        # Spin through nodes in the old topology
-        for n in old:
-
-            # Does the node exist in the new topology
-            if n in new:
-
-                # Spin through new targets
-                for tnode in new:
-
-                    # don't do ourselves
-                    if n == tnode:
-                        continue
-
-                    # Check if spf of old is same as spf of the new topology
-                    try:
-                        old_nexthop = nx.shortest_path(old, n, tnode)[1]
-                    except nx.NetworkXNoPath:
-                        self.del_sr_flow(n, tnode)
-                        continue
-                    try:
-                        new_nexthop = nx.shortest_path(new, n, tnode)[1]
-                        if old_nexthop != new_nexthop:
-                            self.add_sr_flow(new, n, tnode, new_nexthop)
-                        else:
-                            logging.debug("path from {} to {} already exists".format(n, tnode))
-
-                    except nx.NetworkXNoPath:
-                        self.add_sr_flow(new, n, tnode, new_nexthop)
-                        logging.error("no path for {} to {}".format(snode, tnode))
-            # node doesn't exist in the new topology
-            else:
-                logging.debug("old node {} gone away".format(n))
+        # Shortest paths for every pair, once per topology
+        new_nht = self.next_hop_table(new)
+        plan = diff_tables(self.next_hop_table(old), new_nht, self.config['frr'])
 
-        # need to check for new nodes
-        for n in new:
-            if n not in old:
-                self.add_sr_flows_for_node(graph, n)
+        self.apply_flow_plan(new, new_nht, plan)
 
         # return new topology
         return new
 
+    def update_sr_flows_incremental(self, spf):
+        '''update flows by applying the new topology to an incremental SPF'''
+
+        logging.debug("Updating SR flows incrementally")
+
+        # grab new topology
+        new = self.get_topology()
+
+        joined = [n for n in new if n not in spf]
+        left = [n for n in spf if n not in new]
+
+        # only the pairs whose next hop or port moved
+        changes = spf.update(new)
+        plan = plan_changes(changes, spf, joined, left, spf.moved)
+
+        self.apply_flow_plan(spf.graph, spf, plan)
+
+        return spf
+
+    def apply_topology_delta(self, spf, delta):
+        '''apply parsed node and link changes to an incremental SPF
+
+        Links are added and removed the way get_topology builds the graph:
+        each link gives its forward edge, and the reverse edge too when the
+        other direction has no link of its own.
+        '''
+
+        links = spf.graph.graph.setdefault('links', {})
+
+        for id in delta.removed_links:
+            if id not in links:
+                continue
+            snode, dnode, srctp, dsttp = links.pop(id)
+            if spf.graph.has_edge(snode, dnode) and spf.graph[snode][dnode]['source-tp'] == srctp:
+                spf.remove_edge(snode, dnode, collect=False)
+            if (spf.graph.has_edge(dnode, snode) and spf.graph[dnode][snode]['source-tp'] == dsttp
+                    and dsttp not in links):
+                spf.remove_edge(dnode, snode, collect=False)
+
+        for n in delta.removed_nodes:
+            spf.remove_node(n, collect=False)
+            for id, link in links.items():
+                if n in link[:2]:
+                    del links[id]
+
+        for n in delta.added_nodes:
+            spf.add_node(n, collect=False)
+
+        for id, link in delta.added_links.items():
+            snode, dnode, srctp, dsttp = link
+            links[id] = link
+            spf.add_edge(snode, dnode, {'source-tp': srctp}, collect=False)
+            if not spf.graph.has_edge(dnode, snode):
+                spf.add_edge(dnode, snode, {'source-tp': dsttp}, collect=False)
+
+        return spf.collect()
+
+    def update_sr_flows_event(self, spf, event):
+        '''update flows from one topology notification'''
+
+        return self.update_sr_flows_events(spf, [event])
+
+    def update_sr_flows_events(self, spf, batch):
+        '''update flows from a batch of topology notifications
+
+        The batch is folded into one net change and applied straight to
+        the SPF graph, so it costs a single recompute and programming
+        pass. When any notification can't be used the full topology is
+        fetched instead, and after the stream reconnected it is reconciled
+        against what is installed (see reconcile_sr_flows).
+        '''
+
+        # The controller may have restarted while the stream was down, so
+        # what we wrote before can't be trusted to still be there: read
+        # back what is installed and write what differs
+        if stream.RESYNC in batch:
+            self.srm.shadow.clear()
+            if self.config['reconcile']:
+                logging.info("Stream reconnected, reconciling the full topology")
+                spf.update(self.get_topology())
+                self.reconcile_sr_flows(spf.graph, spf)
+                return spf
+
+        delta = events.parse_topology_events(batch)
+
+        if delta is None:
+            logging.info("Fetching full topology for {} events".format(len(batch)))
+            return self.update_sr_flows_incremental(spf)
+
+        logging.info("Folded {} topology events: {}".format(len(batch), delta))
+
+        before = set(spf)
+        changes = self.apply_topology_delta(spf, delta)
+        joined = [n for n in spf if n not in before]
+        left = [n for n in before if n not in spf]
+
+        plan = plan_changes(changes, spf, joined, left, spf.moved)
+        self.apply_flow_plan(spf.graph, spf, plan)
+
+        return spf
+
     def get_sid(self, ofid):
         '''get the sid from the openflow id'''
 
-        id = int(ofid[ofid.index(':')+1:])
-        return self.srgb_start + id
+        return self.sids.sid(ofid)
+
+    def sid_or_none(self, ofid):
+        '''the sid of a node, None (and logged) if it collides with another's'''
+
+        try:
+            return self.get_sid(ofid)
+        except SidCollision, e:
+            logging.error("no sid for {}: {}".format(ofid, e))
+            return None
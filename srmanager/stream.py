@@ -0,0 +1,235 @@
+#
+# Topology change subscription
+#
+
+import time
+import socket
+import logging
+
+from requests.exceptions import ConnectionError, Timeout
+from websocket import create_connection, ABNF
+from websocket import WebSocketException, WebSocketTimeoutException
+
+LOG = logging.getLogger(__name__)
+
+# Yielded after a reconnect: changes may have been missed
+RESYNC = None
+
+# Returned by a timed read that saw no notification
+IDLE = object()
+
+#-------------------------------------------------------------------------------
+# Class 'TopologyStream'
+#-------------------------------------------------------------------------------
+class TopologyStream():
+    """ Long-lived subscription to topology data change events.
+
+    The data change stream is created once and its websocket kept open.
+    Idle connections are pinged every keepalive seconds and dropped if the
+    pong does not come back within the next interval; a connection that
+    fails is reopened with exponential backoff. Iterating the object yields
+    each notification as it arrives, and RESYNC after every reconnect.
+    open() subscribes up front, so changes made while the caller reads
+    the topology are not lost.
+
+    """
+
+    def __init__(self, ctrl, keepalive=None, backoff=None, backoff_max=None):
+        """Initializes this object properties."""
+
+        self.ctrl = ctrl
+
+        self.keepalive = keepalive or float(ctrl.config['stream_keepalive'])
+        self.backoff = backoff or float(ctrl.config['stream_backoff'])
+        self.backoff_max = backoff_max or float(ctrl.config['stream_backoff_max'])
+
+        self.stream_name = None
+        self.ws = None
+        self.ping_sent = False
+        self.seen = 0
+        self.delay = self.backoff
+        self.connects = 0
+        self.closed = False
+
+        # changes may have come and gone while we were not connected
+        self.missed = False
+
+    def __iter__(self):
+        return self
+
+    def connect(self):
+        """ Subscribe (creating the stream the first time) and open the
+            websocket.
+
+        :return: True once connected, False if it should be retried.
+
+        """
+
+        try:
+            if self.stream_name is None:
+                self.stream_name = self.ctrl.create_topology_stream()
+                if self.stream_name is None:
+                    return False
+                LOG.info("Stream created, name: {}".format(self.stream_name))
+
+            url = self.ctrl.subcribe_stream(self.stream_name)
+            LOG.info("Subscription to stream complete, url: {}".format(url))
+
+            url = url.replace("https:", "wss:", 1).replace("http:", "ws:", 1)
+            self.ws = create_connection(url, timeout=self.keepalive)
+
+        except KeyError:
+            # no location, the controller no longer knows our stream
+            LOG.error("Subscription to stream {} failed".format(self.stream_name))
+            self.stream_name = None
+            return False
+        except (ConnectionError, Timeout, WebSocketException, socket.error), e:
+            LOG.error("Connecting to topology stream failed: {}".format(e))
+            return False
+
+        self.connects += 1
+        self.ping_sent = False
+        self.delay = self.backoff
+        return True
+
+    def open(self):
+        """ Subscribe now rather than on the first read.
+
+        :return: True once connected; if not, the read that connects
+                 yields RESYNC first
+
+        """
+
+        if self.ws is None and not self.connect():
+            self.missed = True
+        return self.ws is not None
+
+    def drop(self):
+        """ Close the websocket, the next read reconnects. """
+
+        self.missed = True
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except (WebSocketException, socket.error):
+                pass
+        self.ws = None
+
+    def close(self):
+        """ Stop the subscription, iteration ends. """
+
+        self.closed = True
+        self.drop()
+
+    def next(self):
+        """ Wait for the next topology change notification.
+
+        :return: the notification payload, or RESYNC after a reconnect
+        :raises StopIteration: once the stream has been closed
+
+        """
+
+        return self.recv()
+
+    def recv(self, timeout=None):
+        """ Wait for the next topology change notification.
+
+        :param float timeout: seconds to wait, None waits until one arrives
+        :return: the notification payload, RESYNC after a reconnect, or
+                 IDLE if nothing arrived within the timeout
+        :raises StopIteration: once the stream has been closed
+
+        """
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while not self.closed:
+            if self.ws is None:
+                # don't hold up a timed read on reconnect backoff
+                if deadline is not None:
+                    return IDLE
+                if not self.connect():
+                    LOG.info("Reconnecting to topology stream in {}s".format(self.delay))
+                    time.sleep(self.delay)
+                    self.delay = min(self.delay * 2, self.backoff_max)
+                    continue
+                self.seen = time.time()
+                if self.missed:
+                    self.missed = False
+                    return RESYNC
+
+            wait = self.seen + self.keepalive - time.time()
+            if deadline is not None:
+                if deadline <= time.time():
+                    return IDLE
+                wait = min(wait, deadline - time.time())
+
+            try:
+                self.ws.settimeout(max(wait, 0.001))
+                opcode, data = self.ws.recv_data(control_frame=True)
+                self.seen = time.time()
+                self.ping_sent = False
+                if opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+                    return data
+                if opcode == ABNF.OPCODE_CLOSE:
+                    LOG.error("Topology stream closed by controller")
+                    self.drop()
+            except WebSocketTimeoutException:
+                # only the caller's timeout, the keepalive isn't due yet
+                if time.time() < self.seen + self.keepalive:
+                    continue
+
+                # idle, make sure the other end is still there
+                if self.ping_sent:
+                    LOG.error("Topology stream keepalive timed out")
+                    self.drop()
+                    continue
+                try:
+                    self.ws.ping()
+                    self.ping_sent = True
+                    self.seen = time.time()
+                except (WebSocketException, socket.error), e:
+                    LOG.error("Topology stream keepalive failed: {}".format(e))
+                    self.drop()
+            except (WebSocketException, socket.error), e:
+                LOG.error("Topology stream lost: {}".format(e))
+                self.drop()
+
+        raise StopIteration
+
+    def batches(self, window, max_delay):
+        """ Group notifications that arrive close together.
+
+        A batch starts with the next notification and grows while more
+        arrive less than window seconds apart, but is cut once max_delay
+        seconds have passed since its first notification.
+
+        :param float window: quiet time that ends a batch
+        :param float max_delay: longest time a notification is held back
+        :return: iterator of lists of notifications (RESYNC included)
+
+        """
+
+        while not self.closed:
+            try:
+                batch = [self.recv()]
+            except StopIteration:
+                return
+
+            start = last = time.time()
+            while True:
+                wait = min(last + window, start + max_delay) - time.time()
+                if wait <= 0:
+                    break
+                try:
+                    event = self.recv(wait)
+                except StopIteration:
+                    break
+                if event is IDLE:
+                    break
+                batch.append(event)
+                last = time.time()
+
+            yield batch
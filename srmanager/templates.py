@@ -0,0 +1,94 @@
+#
+# Precompiled JSON payload templates
+#
+# A flow body is described once as an ordinary document with holes in it
+# and serialized up front. Rendering a flow only serializes the values
+# that go into the holes and joins them with the fixed text, instead of
+# building and serializing the whole nested document every time.
+#
+
+import re
+import json
+from json.encoder import encode_basestring_ascii
+
+# Optional, faster JSON codec
+try:
+    import ujson as codec
+except ImportError:
+    codec = json
+
+HOLE = re.compile(r'"@@(\w+)@@"')
+
+def dumps(obj):
+    '''serialize with the fastest codec installed'''
+
+    return codec.dumps(obj)
+
+def value_text(value):
+    '''JSON text of a value going into a hole
+
+    Strings and numbers, which is what holes mostly get, skip the codec.
+    '''
+
+    t = type(value)
+    if t is str or t is unicode:
+        return encode_basestring_ascii(value)
+    if t is int or t is long:
+        return str(value)
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if value is None:
+        return 'null'
+    if isinstance(value, Raw):
+        return value.text
+    return dumps(value)
+
+def hole(name):
+    '''placeholder for a value given to Template.render'''
+
+    return '@@{}@@'.format(name)
+
+class Raw():
+    '''text that is already JSON, put into a hole as is'''
+
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+def raw_list(texts):
+    '''JSON list of items that are already JSON'''
+
+    return Raw('[' + ','.join(texts) + ']')
+
+class Template():
+    '''JSON text with holes, compiled from a document with hole() values'''
+
+    def __init__(self, doc):
+        '''serialize doc once and split it around its holes'''
+
+        # the standard module keeps the layout of doc, whatever codec is used
+        text = json.dumps(doc)
+
+        self.parts = []
+        pos = 0
+        for m in HOLE.finditer(text):
+            self.parts.append((text[pos:m.start()], m.group(1)))
+            pos = m.end()
+        self.tail = text[pos:]
+
+    def render(self, **values):
+        '''JSON text of the document with its holes filled
+
+        Values are serialized, except Raw ones which are used as they are.
+        '''
+
+        r = []
+        for text, name in self.parts:
+            r.append(text)
+            r.append(value_text(values[name]))
+        r.append(self.tail)
+        return ''.join(r)
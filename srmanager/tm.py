@@ -2,11 +2,11 @@
 # Topology Manager stuff
 #
 
-import json
 import os
 import sys
 import yaml
 from srmanager.controller import Controller 
+from srmanager import jsonstream
 
 class TopologyManager():
     '''Topology Manager Class'''
@@ -14,25 +14,36 @@ class TopologyManager():
     def __init__(self, **kwargs):
         '''init the controller'''
 
-        self.ctrl = Controller(**kwargs)
+        # Reuse a controller (and its connection pool) when one is given
+        if kwargs.get('ctrl') is not None:
+            self.ctrl = kwargs['ctrl']
+        else:
+            self.ctrl = Controller(**kwargs)
 
     def get_topology(self, tpid='flow:1'):
         '''grab the given topology
+
+        Only switch node ids and link ends are kept, see
+        jsonstream.parse_topology.
         '''
 
         resp = self.ctrl.http_get_request(
                 self.ctrl.get_operational_url() 
-                + '/network-topology:network-topology/topology/{}'.format(tpid))
+                + '/network-topology:network-topology/topology/{}'.format(tpid),
+                stream=jsonstream.streaming(), bulk=True)
 
         # Check response code
         if resp is not None:
-            if resp.status_code == 200:
-                topologies = json.loads(resp.content)
-
-                #did we get anything
-                if len(topologies) == 0:
-                    raise(Exception("no toplogies found"))
-                return topologies['topology'][0]
+            try:
+                if resp.status_code == 200:
+                    topology = jsonstream.parse_topology(resp)
+
+                    #did we get anything
+                    if topology is None:
+                        raise(Exception("no toplogies found"))
+                    return topology
+            finally:
+                resp.close()
 
         raise(Exception("get topology call failed: {}".format(resp.status_code)))
 
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import time
+
+from srmanager.controller import ConcurrencyLimit, Controller
+
+
+def limit(initial=4, **kwargs):
+    return ConcurrencyLimit(initial=initial, minimum=1, maximum=8, latency=1.0, **kwargs)
+
+
+class TestConcurrencyLimit:
+    def test_increase(self):
+        """ A round of about limit fast replies raises the limit by one """
+
+        l = limit()
+        for i in range(5):
+            l.release('GET', l.acquire())
+
+        assert l.current() == 5
+        assert l.in_flight == 0
+
+    def test_maximum(self):
+        """ Never past the maximum """
+
+        l = limit(initial=8)
+        for i in range(20):
+            l.release('GET', l.acquire())
+
+        assert l.limit == 8
+
+    def test_decrease(self):
+        """ A slow reply or a failure cuts the limit by the backoff factor """
+
+        l = limit()
+        l.acquire()
+        l.release('PUT', time.time() - 2)
+        assert l.limit == 2
+
+        l.acquire()
+        l.release('PUT', time.time(), error=True)
+        assert l.limit == 1
+
+        l.acquire()
+        l.release('PUT', time.time(), error=True)
+        assert l.limit == 1
+
+    def test_cut_once(self):
+        """ Requests started before the last cut do not cut it again """
+
+        l = limit(initial=8)
+        start = time.time() - 2
+        l.release('GET', start)
+        l.release('GET', start)
+
+        assert l.limit == 4
+
+    def test_bulk(self):
+        """ A slow bulk reply leaves the limit be, a failed one still cuts it """
+
+        l = limit()
+        l.release('PUT', time.time() - 2, bulk=True)
+        assert l.limit > 4
+
+        l.release('PUT', time.time(), error=True, bulk=True)
+        assert l.limit < 4
+
+    def test_stats(self):
+        """ Samples are kept per verb """
+
+        l = limit(window=2)
+        now = time.time()
+        l.release('GET', now)
+        l.release('GET', now, error=True)
+        l.release('GET', now, error=True)
+        l.release('PUT', now)
+
+        s = l.stats()
+        assert s['GET']['count'] == 2 and s['GET']['errors'] == 1.0
+        assert s['PUT']['count'] == 1 and s['PUT']['errors'] == 0.0
+
+
+class TestLimitConfig:
+    def config(self, **kwargs):
+        cfg = {'ip': '127.0.0.1', 'port': 8181, 'username': 'admin', 'password': 'admin'}
+        cfg.update(kwargs)
+        return Controller(config=cfg).limiter
+
+    def test_defaults(self):
+        """ The limit starts at the minimum and goes up to the pool size """
+
+        l = self.config(pool_maxsize=16, limit_min=2)
+
+        assert (l.current(), l.minimum, l.maximum) == (2, 2, 16)
+
+    def test_initial(self):
+        """ Unless told where to start """
+
+        assert self.config(limit_initial='6').current() == 6
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import json
+
+from srmanager.events import parse_topology_event, parse_topology_events
+
+TOPOLOGY = "/network-topology:network-topology/network-topology:topology[network-topology:topology-id='flow:1']"
+
+
+def event(kind, id, operation, rest='', data=None):
+    e = {'path': "{}/network-topology:{}[network-topology:{}-id='{}']{}".format(
+             TOPOLOGY, kind, kind, id, rest),
+         'operation': operation}
+    if data is not None:
+        e['data'] = data
+    return e
+
+def link_data(id, src, src_tp, dst, dst_tp):
+    return {'network-topology:link': [{
+        'link-id': id,
+        'source': {'source-node': src, 'source-tp': src_tp},
+        'destination': {'dest-node': dst, 'dest-tp': dst_tp}}]}
+
+def notification(*events):
+    return json.dumps({'notification': {'data-changed-notification': {
+        'data-change-event': list(events)}}})
+
+
+class TestParseTopologyEvent:
+    def test_links(self):
+        """ Created links carry their ends, deleted ones only their id """
+
+        delta = parse_topology_event(notification(
+            event('link', 'openflow:1:2', 'created',
+                  data=link_data('openflow:1:2', 'openflow:1', 'openflow:1:2',
+                                 'openflow:2', 'openflow:2:1')),
+            event('link', 'openflow:3:1', 'deleted')))
+
+        assert delta.added_links == {'openflow:1:2': ('openflow:1', 'openflow:2',
+                                                      'openflow:1:2', 'openflow:2:1')}
+        assert delta.removed_links == ['openflow:3:1']
+        assert len(delta) == 2
+
+    def test_nodes(self):
+        """ Switches are kept, hosts and termination points left out """
+
+        delta = parse_topology_event(notification(
+            event('node', 'openflow:4', 'created'),
+            event('node', 'openflow:4', 'created',
+                  rest="/network-topology:termination-point[network-topology:tp-id='openflow:4:1']"),
+            event('node', 'host:00:00:00:00:00:01', 'created'),
+            event('node', 'openflow:5', 'deleted')))
+
+        assert delta.added_nodes == ['openflow:4']
+        assert delta.removed_nodes == ['openflow:5']
+
+    def test_xml(self):
+        """ XML notifications give the same delta """
+
+        xml = ("<notification><data-changed-notification><data-change-event>"
+               "<path>{}/network-topology:link[network-topology:link-id='openflow:1:2']</path>"
+               "<operation>deleted</operation>"
+               "</data-change-event></data-changed-notification></notification>").format(TOPOLOGY)
+
+        assert parse_topology_event(xml).removed_links == ['openflow:1:2']
+
+    def test_unusable(self):
+        """ Garbage and changes inside a link give no delta """
+
+        assert parse_topology_event('garbage<') is None
+        assert parse_topology_event('{"notification": {}}') is None
+        assert parse_topology_event(notification(
+            event('link', 'openflow:1:2', 'updated', rest='/network-topology:source'))) is None
+        assert parse_topology_event(notification(
+            event('link', 'openflow:1:2', 'created'))) is None
+
+    def test_outside(self):
+        """ Changes to the topology itself are ignored """
+
+        delta = parse_topology_event(notification(
+            {'path': TOPOLOGY, 'operation': 'updated'}))
+
+        assert len(delta) == 0
+
+    def test_batch(self):
+        """ A batch keeps the net change """
+
+        added = event('link', 'openflow:1:2', 'created',
+                      data=link_data('openflow:1:2', 'openflow:1', 'openflow:1:2',
+                                     'openflow:2', 'openflow:2:1'))
+        delta = parse_topology_events([
+            notification(added, event('node', 'openflow:3', 'created')),
+            notification(event('link', 'openflow:1:2', 'deleted'),
+                         event('node', 'openflow:3', 'deleted'))])
+
+        assert delta.added_links == {}
+        assert delta.removed_links == ['openflow:1:2']
+        assert delta.added_nodes == []
+        assert delta.removed_nodes == ['openflow:3']
+
+        assert parse_topology_events([notification(added), None]) is None
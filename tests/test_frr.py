@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import networkx as nx
+
+from srmanager import client
+from srmanager.groups import GROUP_BASE, GROUP_FAST_FAILOVER
+from srmanager.nexthop import NextHopTable
+from srmanager.planner import FlowPlan
+from srmanager.sr import SR
+
+
+def ring(n):
+    g = nx.DiGraph()
+    names = ['openflow:{}'.format(i) for i in range(1, n + 1)]
+    for i in range(n):
+        u, v = names[i], names[(i + 1) % n]
+        g.add_edge(u, v, **{'source-tp': u + ':' + v})
+        g.add_edge(v, u, **{'source-tp': v + ':' + u})
+    return g
+
+
+def frr():
+    sr = SR()
+    sr.config['frr'] = True
+    return sr
+
+
+class TestBackupBucket:
+    def test_loop_free_alternate(self):
+        """ The other neighbour is a loop free alternate for the far side """
+
+        g = ring(6)
+        sr = frr()
+
+        bucket = sr.backup_bucket(g, NextHopTable(g, depths=True),
+                                  'openflow:1', 'openflow:4', 'openflow:2')
+
+        assert bucket == ('openflow:1:openflow:6', False, None)
+        assert 'openflow:4' not in sr.repair_nodes['openflow:1']
+
+    def test_repair_node(self):
+        """ Without an alternate the sid of the furthest repair node is pushed """
+
+        g = ring(6)
+        sr = frr()
+        nht = NextHopTable(g, depths=True)
+
+        for tnode in ('openflow:2', 'openflow:3'):
+            bucket = sr.backup_bucket(g, nht, 'openflow:1', tnode, 'openflow:2')
+
+            assert bucket == ('openflow:1:openflow:6', False, '16004')
+            assert sr.repair_nodes['openflow:1'][tnode] == 'openflow:4'
+
+    def test_none(self):
+        """ There is no way around the only link """
+
+        g = ring(6)
+        g.remove_edge('openflow:6', 'openflow:1')
+        g.remove_edge('openflow:1', 'openflow:6')
+        sr = frr()
+
+        assert sr.backup_bucket(g, NextHopTable(g, depths=True),
+                                'openflow:1', 'openflow:2', 'openflow:2') is None
+
+    def test_forwarding_key(self):
+        """ A single next hop with a backup becomes a fast failover group """
+
+        g = ring(6)
+        sr = frr()
+
+        key = sr.forwarding_key(g, NextHopTable(g, depths=True), 'openflow:1', 'openflow:2')
+
+        assert key == (GROUP_FAST_FAILOVER, (('openflow:1:openflow:2', True, None),
+                                             ('openflow:1:openflow:6', False, '16004')))
+
+
+class TestMovedBackups:
+    def test_near(self):
+        """ Switches that moved and their neighbours rebuild every backup """
+
+        g = ring(6)
+        sr = frr()
+        plan = FlowPlan()
+        plan.moved = set(['openflow:1', 'gone'])
+
+        backups = sr.moved_backups(g, NextHopTable(g, depths=True), plan)
+
+        assert sorted(backups) == ['openflow:1', 'openflow:2', 'openflow:6']
+        assert len(backups['openflow:2']) == 5
+
+    def test_repair_node(self):
+        """ Elsewhere only the backups through a repair node that moved """
+
+        g = ring(6)
+        sr = frr()
+        nht = NextHopTable(g, depths=True)
+        sr.backup_bucket(g, nht, 'openflow:1', 'openflow:2', 'openflow:2')
+        sr.backup_bucket(g, nht, 'openflow:1', 'openflow:4', 'openflow:2')
+        plan = FlowPlan()
+        plan.moved = set(['openflow:4'])
+
+        backups = sr.moved_backups(g, nht, plan)
+
+        assert backups['openflow:1'] == ['openflow:2']
+        assert sorted(backups) == ['openflow:1', 'openflow:3', 'openflow:4', 'openflow:5']
+
+
+class TestRestart:
+    def test_group_key(self):
+        """ A fast failover group read back is known by the key it was written for """
+
+        buckets = [('openflow:1:openflow:2', True, None), ('openflow:1:openflow:6', False, '16004')]
+        doc = client.group_doc(GROUP_BASE, GROUP_FAST_FAILOVER, buckets)
+        doc['buckets']['bucket'][1]['action'][1]['set-field']['protocol-match-fields']['mpls-label'] = 16004
+        doc['buckets']['bucket'].reverse()
+
+        assert client.group_key(doc) == (GROUP_FAST_FAILOVER, tuple(buckets))
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from srmanager.groups import GroupTable, GROUP_BASE, GROUP_SELECT, GROUP_INDIRECT
+
+SW = 'openflow:1'
+ECMP = (GROUP_SELECT, (('1', False, None), ('2', False, None)))
+VIA_3 = (GROUP_INDIRECT, (('3', False, None),))
+
+
+class TestGroupTable:
+    def test_share(self):
+        """ Flows that forward the same way share one group """
+
+        groups = GroupTable()
+
+        assert groups.use(SW, 'a', ECMP) == (GROUP_BASE, [])
+        assert groups.use(SW, 'b', ECMP) == (GROUP_BASE, [])
+        assert groups.use(SW, 'c', VIA_3) == (GROUP_BASE + 1, [])
+        assert groups.users_of(SW, GROUP_BASE) == set(['a', 'b'])
+        assert groups.group_of(SW, 'c') == GROUP_BASE + 1
+        assert groups.groups(SW) == {GROUP_BASE: ECMP, GROUP_BASE + 1: VIA_3}
+
+    def test_switches_apart(self):
+        """ Each switch hands out its own ids """
+
+        groups = GroupTable()
+
+        groups.use(SW, 'a', ECMP)
+        assert groups.use('openflow:2', 'a', VIA_3) == (GROUP_BASE, [])
+        assert groups.key('openflow:2', GROUP_BASE) == VIA_3
+
+    def test_release(self):
+        """ The last flow off a group frees its id, reused once it is deleted """
+
+        groups = GroupTable()
+        groups.use(SW, 'a', ECMP)
+        groups.use(SW, 'b', ECMP)
+        groups.use(SW, 'c', VIA_3)
+
+        assert groups.release(SW, 'a') == []
+        assert groups.use(SW, 'b', VIA_3) == (GROUP_BASE + 1, [GROUP_BASE])
+        assert groups.key(SW, GROUP_BASE) is None
+        assert groups.use(SW, 'd', ECMP) == (GROUP_BASE + 2, [])
+
+        groups.free(SW, [GROUP_BASE])
+
+        assert groups.use(SW, 'e', (GROUP_INDIRECT, (('4', False, None),))) == (GROUP_BASE, [])
+        assert groups.release(SW, 'f') == []
+
+    def test_same_key(self):
+        """ A flow already on a group doing the same stays there """
+
+        groups = GroupTable()
+        groups.use(SW, 'a', ECMP)
+
+        assert groups.use(SW, 'a', ECMP) == (GROUP_BASE, [])
+        assert groups.users_of(SW, GROUP_BASE) == set(['a'])
+
+    def test_repoint(self):
+        """ A repointed group keeps its flows and is found by its new key """
+
+        groups = GroupTable()
+        groups.use(SW, 'a', ECMP)
+        groups.use(SW, 'b', ECMP)
+
+        groups.repoint(SW, GROUP_BASE, VIA_3)
+
+        assert groups.key(SW, GROUP_BASE) == VIA_3
+        assert groups.users_of(SW, GROUP_BASE) == set(['a', 'b'])
+        assert groups.use(SW, 'c', VIA_3) == (GROUP_BASE, [])
+        assert groups.use(SW, 'd', ECMP) == (GROUP_BASE + 1, [])
+
+    def test_forget(self):
+        """ Forgetting a switch drops its groups and flows """
+
+        groups = GroupTable()
+        groups.use(SW, 'a', ECMP)
+
+        groups.forget(SW)
+
+        assert groups.groups(SW) == {}
+        assert groups.group_of(SW, 'a') is None
+        assert groups.use(SW, 'a', VIA_3) == (GROUP_BASE, [])
+
+    def test_merge(self):
+        """ Groups left with the same key by a repoint can be merged """
+
+        groups = GroupTable()
+        groups.use(SW, 'a', ECMP)
+        groups.use(SW, 'b', VIA_3)
+        groups.use(SW, 'c', VIA_3)
+        groups.repoint(SW, GROUP_BASE, VIA_3)
+
+        assert groups.duplicates(SW) == [[GROUP_BASE, GROUP_BASE + 1]]
+
+        assert groups.merge(SW, GROUP_BASE, GROUP_BASE + 1) == set(['a'])
+        assert groups.duplicates(SW) == []
+        assert groups.group_of(SW, 'a') == GROUP_BASE + 1
+        assert groups.users_of(SW, GROUP_BASE + 1) == set(['a', 'b', 'c'])
+        assert groups.key(SW, GROUP_BASE) is None
+        assert groups.use(SW, 'd', VIA_3) == (GROUP_BASE + 1, [])
+        assert groups.use(SW, 'e', ECMP) == (GROUP_BASE + 2, [])
+
+        groups.free(SW, [GROUP_BASE])
+
+        assert groups.use(SW, 'f', (GROUP_SELECT, ())) == (GROUP_BASE, [])
+
+    def test_seed(self):
+        """ A switch starts over from what is installed on it """
+
+        groups = GroupTable()
+        groups.use(SW, 'x', ECMP)
+
+        unused = groups.seed(SW, {GROUP_BASE + 1: ECMP, GROUP_BASE + 2: VIA_3},
+                             {'a': GROUP_BASE + 1, 'b': GROUP_BASE + 1, 'c': GROUP_BASE + 5})
+
+        assert unused == [GROUP_BASE + 2]
+        assert groups.group_of(SW, 'x') is None
+        assert groups.users_of(SW, GROUP_BASE + 1) == set(['a', 'b'])
+        assert groups.group_of(SW, 'c') is None
+        assert groups.use(SW, 'd', ECMP) == (GROUP_BASE + 1, [])
+        assert groups.use(SW, 'e', VIA_3) == (GROUP_BASE, [])
+        assert groups.use(SW, 'f', (GROUP_SELECT, ())) == (GROUP_BASE + 3, [])
+
+        groups.free(SW, unused)
+
+        assert groups.use(SW, 'g', (GROUP_INDIRECT, ())) == (GROUP_BASE + 2, [])
+
+    def test_avoid(self):
+        """ A flow avoiding a group gets a new one with the key, as do later flows """
+
+        via_4 = (GROUP_INDIRECT, (('4', False, None),))
+        groups = GroupTable()
+        groups.use(SW, 'a', VIA_3)
+        groups.use(SW, 'b', ECMP)
+        groups.repoint(SW, GROUP_BASE, via_4)
+
+        assert groups.use(SW, 'c', via_4, [GROUP_BASE]) == (GROUP_BASE + 2, [])
+        assert groups.use(SW, 'd', via_4) == (GROUP_BASE + 2, [])
+        assert groups.duplicates(SW) == [[GROUP_BASE, GROUP_BASE + 2]]
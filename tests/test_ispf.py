@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import random
+
+import networkx as nx
+
+from srmanager.nexthop import NextHopTable
+from srmanager.ispf import IncrementalSPF
+from srmanager.planner import diff_tables
+
+NODES = ['openflow:{}'.format(i) for i in range(1, 9)]
+
+
+def link(graph, u, v):
+    graph.add_edge(u, v, **{'source-tp': '{}:{}'.format(u, v)})
+
+def random_graph(rnd):
+    graph = nx.DiGraph()
+    for n in NODES[:6]:
+        graph.add_node(n)
+    for u in NODES[:6]:
+        for v in NODES[:6]:
+            if u < v and rnd.random() < 0.4:
+                link(graph, u, v)
+                link(graph, v, u)
+    return graph
+
+def step(rnd, ispf, graph):
+    """ Apply one random change to both graphs, return the change report """
+
+    op = rnd.choice(['add_edge', 'add_edge', 'remove_edge', 'remove_edge',
+                     'add_node', 'remove_node', 'one_way'])
+    u, v = rnd.sample(NODES, 2)
+
+    if op == 'add_edge':
+        link(graph, u, v)
+        link(graph, v, u)
+        ispf.add_edge(u, v, dict(graph[u][v]), collect=False)
+        return ispf.add_edge(v, u, dict(graph[v][u]))
+    if op == 'one_way':
+        link(graph, u, v)
+        return ispf.add_edge(u, v, dict(graph[u][v]))
+    if op == 'remove_edge':
+        edges = sorted(graph.edges())
+        if not edges:
+            return ispf.collect()
+        u, v = rnd.choice(edges)
+        graph.remove_edge(u, v)
+        ispf.remove_edge(u, v, collect=False)
+        if graph.has_edge(v, u):
+            graph.remove_edge(v, u)
+            ispf.remove_edge(v, u, collect=False)
+        return ispf.collect()
+    if op == 'add_node':
+        graph.add_node(u)
+        return ispf.add_node(u)
+
+    if u in graph:
+        graph.remove_node(u)
+    return ispf.remove_node(u)
+
+def changed_pairs(old, new):
+    """ Pairs whose forwarding differs between two full tables """
+
+    nodes = set(old) | set(new)
+    return set([(s, t) for s in nodes for t in nodes
+                if s != t and old.forwarding(s, t) != new.forwarding(s, t)])
+
+
+class TestIncrementalSPF:
+    def check_sequence(self, seed, ecmp):
+        rnd = random.Random(seed)
+        graph = random_graph(rnd)
+        ispf = IncrementalSPF(graph.copy(), ecmp=ecmp)
+        old = NextHopTable(graph.copy(), ecmp=ecmp, depths=True)
+
+        for i in range(40):
+            changes = step(rnd, ispf, graph)
+            new = NextHopTable(graph.copy(), ecmp=ecmp, depths=True)
+
+            assert sorted(ispf.graph.edges()) == sorted(graph.edges())
+            for s in graph:
+                for t in graph:
+                    assert ispf.forwarding(s, t) == new.forwarding(s, t)
+                    assert ispf.distance(s, t) == new.distance(s, t)
+                    assert ispf.ecmp_hops(s, t) == new.ecmp_hops(s, t)
+
+            assert set(changes) == changed_pairs(old, new)
+            for (s, t), (old_hop, new_hop) in changes.items():
+                assert old_hop == old.next_hop(s, t)
+                assert new_hop == new.next_hop(s, t)
+            assert diff_tables(old, new, True).moved <= ispf.moved
+            old = new
+
+    def test_random_sequences(self):
+        """ Random edge and node changes match a table built from scratch """
+
+        for seed in range(20):
+            self.check_sequence(seed, ecmp=False)
+
+    def test_random_sequences_ecmp(self):
+        """ Same with every equal cost next hop kept """
+
+        for seed in range(20):
+            self.check_sequence(seed, ecmp=True)
+
+    def test_update(self):
+        """ update applies a whole new graph and leaves it untouched """
+
+        rnd = random.Random(1)
+        ispf = IncrementalSPF(random_graph(rnd))
+        graph = random_graph(rnd)
+        edges = sorted(graph.edges())
+
+        ispf.update(graph)
+        new = NextHopTable(graph)
+
+        assert sorted(graph.edges()) == edges
+        for s in graph:
+            assert ispf.next_hops(s) == new.next_hops(s)
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+import pytest
+
+from srmanager import client, jsonstream
+
+SW = 'openflow:1'
+
+INVENTORY = {'opendaylight-inventory:nodes': {'node': [
+    {'id': SW,
+     'flow-node-inventory:group': [
+         client.group_doc(1000, 'group-ff', [(SW + ':2', True, None), (SW + ':3', False, '16004')])],
+     'flow-node-inventory:table': [
+         {'flow': [client.sr_flow_doc('src-flow:16002', '16002', SW + ':2', True),
+                   {'id': 'other', 'priority': 5, 'cookie': 1.5},
+                   client.sr_flow_doc('src-flow:16003', '16003', SW + ':3', False)],
+          'opendaylight-flow-table-statistics:flow-table-statistics': {'active-flows': 3},
+          'id': 1},
+         {'id': 0, 'flow': [{'id': 'srgoto-table-1', 'instructions': {'instruction': []}}]}],
+     'flow-node-inventory:description': u'caf\xe9',
+     'node-connector': [{'id': SW + ':2', 'stats': [1, 2, {'bytes': 10 ** 12}]}]},
+    {'flow-node-inventory:table': [{'id': 1}], 'id': 'openflow:2'}]}}
+
+TOPOLOGY = {'topology': [{
+    'topology-id': 'flow:1',
+    'node': [{'node-id': SW, 'termination-point': [{'tp-id': SW + ':2'}]},
+             {'node-id': 'openflow:2'},
+             {'node-id': 'host:00:00:00:00:00:01'}],
+    'link': [{'link-id': SW + ':2',
+              'source': {'source-node': SW, 'source-tp': SW + ':2'},
+              'destination': {'dest-node': 'openflow:2', 'dest-tp': 'openflow:2:1'}},
+             {'link-id': 'host:00:00:00:00:00:01/' + SW,
+              'source': {'source-node': 'host:00:00:00:00:00:01', 'source-tp': 'h'},
+              'destination': {'dest-node': SW, 'dest-tp': SW + ':4'}}]}]}
+
+
+class Raw(io.BytesIO):
+    decode_content = False
+
+
+class Response:
+    def __init__(self, body):
+        self.content = json.dumps(body)
+        self.raw = Raw(self.content)
+
+
+@pytest.fixture(params=['stream', 'plain'])
+def parser(request, monkeypatch):
+    """ jsonstream with a C ijson backend, and with the fallback when there is none """
+
+    if request.param == 'stream' and not jsonstream.streaming():
+        pytest.skip('no C ijson backend')
+    if request.param == 'plain':
+        monkeypatch.setattr(jsonstream, 'ijson', None)
+    return jsonstream
+
+
+class TestInventory:
+    def test_flows(self, parser):
+        """ The wanted flows of every table of every node, as json.loads reads them """
+
+        nodes = json.loads(json.dumps(INVENTORY))['opendaylight-inventory:nodes']['node']
+        table = nodes[0]['flow-node-inventory:table'][0]['flow']
+
+        r = parser.inventory_flows(Response(INVENTORY), client.is_sr_flow_object)
+
+        assert r == {SW: {1: [table[0], table[2]], 0: [nodes[0]['flow-node-inventory:table'][1]['flow'][0]]},
+                     'openflow:2': {1: []}}
+
+    def test_groups(self, parser):
+        """ Groups are listed as json.loads reads them when asked for """
+
+        nodes = json.loads(json.dumps(INVENTORY))['opendaylight-inventory:nodes']['node']
+
+        r = parser.inventory_flows(Response(INVENTORY), lambda f: False, groups=True)
+
+        assert r[SW][parser.GROUP] == nodes[0]['flow-node-inventory:group']
+        assert r['openflow:2'][parser.GROUP] == []
+        assert client.group_key(r[SW][parser.GROUP][0])[1][1] == (SW + ':3', False, '16004')
+
+    def test_table(self, parser):
+        """ A single table reply """
+
+        body = {'flow-node-inventory:table': INVENTORY['opendaylight-inventory:nodes']['node'][0]
+                ['flow-node-inventory:table'][:1]}
+        flows = json.loads(json.dumps(body))['flow-node-inventory:table'][0]['flow']
+
+        assert parser.table_flows(Response(body), lambda f: True) == flows
+        assert parser.table_flows(Response({}), lambda f: True) == []
+
+
+class TestTopology:
+    def test_topology(self, parser):
+        """ Switch nodes and links, hosts left out """
+
+        r = parser.parse_topology(Response(TOPOLOGY))
+
+        assert r == {'node': [{'node-id': SW}, {'node-id': 'openflow:2'}],
+                     'link': [{'link-id': SW + ':2',
+                               'source': {'source-node': SW, 'source-tp': SW + ':2'},
+                               'destination': {'dest-node': 'openflow:2', 'dest-tp': 'openflow:2:1'}}]}
+        assert r == parser.pick_topology(json.loads(json.dumps(TOPOLOGY))['topology'][0])
+
+    def test_none(self, parser):
+        """ No topology in the reply """
+
+        assert parser.parse_topology(Response({'topology': []})) is None
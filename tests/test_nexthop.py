@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import networkx as nx
+
+from srmanager.csr import CSRGraph
+from srmanager.nexthop import NextHopTable, SearchPool
+
+
+def grid(n):
+    g = nx.DiGraph()
+    for (u, v) in nx.grid_2d_graph(n, n).edges():
+        u, v = 'openflow:{}{}'.format(*u), 'openflow:{}{}'.format(*v)
+        g.add_edge(u, v, **{'source-tp': u + ':' + v})
+        g.add_edge(v, u, **{'source-tp': v + ':' + u})
+    return g
+
+
+def ring(n):
+    g = nx.DiGraph()
+    names = ['openflow:{}'.format(i) for i in range(1, n + 1)]
+    for i in range(n):
+        u, v = names[i], names[(i + 1) % n]
+        g.add_edge(u, v, **{'source-tp': u + ':' + v})
+        g.add_edge(v, u, **{'source-tp': v + ':' + u})
+    return g
+
+
+def random(n, p, seed):
+    g = nx.DiGraph()
+    for (u, v) in nx.gnp_random_graph(n, p, seed=seed).edges():
+        u, v = 'openflow:{}'.format(u + 1), 'openflow:{}'.format(v + 1)
+        g.add_edge(u, v, **{'source-tp': u + ':' + v})
+        g.add_edge(v, u, **{'source-tp': v + ':' + u})
+    return g
+
+
+def rows(nht):
+    return dict((s, (dict(nht.table[s].items()), dict(nht.depth[s].items()))) for s in nht)
+
+
+class TestSearchPool:
+    def test_builds(self):
+        """ Tables searched by workers match the ones searched here, build after build """
+
+        pool = SearchPool(2, size=8)
+        try:
+            for n in (3, 5, 4):
+                g = CSRGraph.from_graph(grid(n))
+
+                assert rows(NextHopTable(g, depths=True, pool=pool)) == \
+                    rows(NextHopTable(g, depths=True))
+        finally:
+            pool.close()
+
+        assert pool.builds == 3
+        assert len(pool.shared) >= 2 + 25 + 80
+
+
+class TestBackends:
+    def check(self, g):
+        plain = NextHopTable(g, ecmp=True)
+        compact = NextHopTable(CSRGraph.from_graph(g), ecmp=True)
+
+        assert sorted(compact) == sorted(plain)
+        for s in g:
+            assert compact.next_hops(s) == plain.next_hops(s)
+            for t in g:
+                assert compact.distance(s, t) == plain.distance(s, t)
+                assert compact.ecmp_hops(s, t) == plain.ecmp_hops(s, t)
+                assert compact.forwarding(s, t) == plain.forwarding(s, t)
+
+    def test_ring(self):
+        """ The compact graph gives the same table as networkx on a ring """
+
+        self.check(ring(7))
+
+    def test_grid(self):
+        """ And on a grid, where every pair has several shortest paths """
+
+        self.check(grid(4))
+
+    def test_random(self):
+        """ And on random topologies, the first of them split """
+
+        for seed in range(3):
+            self.check(random(20, 0.08, seed))
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from srmanager.pipeline import FlowPipeline, FlowWriter
+
+
+class Calls:
+    """ Records the order operations ran in, and how many ran at once """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.order = []
+        self.running = 0
+        self.most = 0
+
+    def op(self, switch, n, delay=0.005):
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        time.sleep(delay)
+        with self.lock:
+            self.running -= 1
+            self.order.append((switch, n))
+
+    def of(self, switch):
+        return [n for s, n in self.order if s == switch]
+
+
+class Client:
+    """ Client whose writes take a while and are recorded in the order they land """
+
+    def __init__(self, delay=0.005):
+        self.delay = delay
+        self.calls = Calls()
+        self.fail = set()
+
+    def write(self, switch, what):
+        self.calls.op(switch, what, self.delay)
+        return None if what in self.fail else what
+
+    def add_flow(self, flow):
+        return self.write(flow['switch_id'], ('add', flow['flow_id']))
+
+    def delete_flow(self, name, id):
+        return self.write(name, ('delete', id))
+
+    def put_sr_table(self, name, flows, replace=True, remove=None):
+        return self.write(name, ('table', len(flows)))
+
+    def add_goto_sr_flow(self, name):
+        return self.write(name, ('goto',))
+
+
+class TestFlowPipeline:
+    def test_per_switch_order(self):
+        """ Operations on one switch run one at a time, in order, across passes """
+
+        calls = Calls()
+        pipeline = FlowPipeline(workers=4)
+        passes = []
+        for p in range(2):
+            flow_pass = pipeline.new_pass('pass {}'.format(p))
+            for n in range(10):
+                for switch in ('a', 'b', 'c'):
+                    pipeline.submit(flow_pass, switch, calls.op, switch, p * 10 + n)
+            flow_pass.close()
+            passes.append(flow_pass)
+
+        assert [p.wait(10) for p in passes] == [True, True]
+        pipeline.stop()
+
+        for switch in ('a', 'b', 'c'):
+            assert calls.of(switch) == range(20)
+        assert 1 < calls.most <= 3
+
+    def test_workers(self):
+        """ No more than workers operations run at once """
+
+        calls = Calls()
+        pipeline = FlowPipeline(workers=2)
+        flow_pass = pipeline.new_pass('wide')
+        for switch in range(8):
+            pipeline.submit(flow_pass, switch, calls.op, switch, 0)
+        flow_pass.close()
+
+        assert flow_pass.wait(10)
+        pipeline.stop()
+        assert calls.most == 2
+        assert len(calls.order) == 8
+
+    def test_errors(self):
+        """ A failed operation is counted and the rest still run """
+
+        done = []
+        pipeline = FlowPipeline(workers=1)
+        flow_pass = pipeline.new_pass('failing', on_done=lambda: done.append(True))
+
+        def fail():
+            raise Exception('no')
+        pipeline.submit(flow_pass, 'a', fail)
+        pipeline.submit(flow_pass, 'a', done.append, 'after')
+        flow_pass.close()
+
+        assert flow_pass.wait(10)
+        pipeline.stop()
+        assert done == ['after', True]
+        assert [s for s, e in flow_pass.errors] == ['a']
+        assert (flow_pass.submitted, flow_pass.completed) == (2, 2)
+
+    def test_empty_pass(self):
+        """ A pass closed with nothing in it is done at once """
+
+        pipeline = FlowPipeline(workers=1)
+        flow_pass = pipeline.new_pass('empty')
+        flow_pass.close()
+        pipeline.stop()
+
+        assert flow_pass.done()
+
+
+class TestFlowWriter:
+    def test_order(self):
+        """ Writes to one switch land in the order they were queued """
+
+        client = Client()
+        writer = FlowWriter(client, FlowPipeline(workers=4))
+        for switch in ('openflow:1', 'openflow:2'):
+            writer.add_goto_sr_flow(switch)
+            writer.put_sr_table(switch, [{}, {}])
+            writer.add_flow(flow={'switch_id': switch, 'flow_id': 'flow:1'})
+            writer.delete_flow(switch, 'flow:2')
+
+        assert writer.barrier(10) == []
+        writer.stop()
+        for switch in ('openflow:1', 'openflow:2'):
+            assert client.calls.of(switch) == [('goto',), ('table', 2),
+                                               ('add', 'flow:1'), ('delete', 'flow:2')]
+
+    def test_barrier(self):
+        """ The barrier returns only once everything queued before it has landed """
+
+        client = Client(delay=0.02)
+        writer = FlowWriter(client, FlowPipeline(workers=2))
+        for n in range(5):
+            writer.add_flow(flow={'switch_id': 'openflow:1', 'flow_id': 'flow:{}'.format(n)})
+        writer.mark('first')
+        writer.add_goto_sr_flow('openflow:2')
+
+        assert writer.pending() > 0
+        assert writer.barrier(10) == []
+        assert len(client.calls.order) == 6
+        assert writer.pending() == 0
+        writer.stop()
+
+    def test_timeout(self):
+        """ A barrier that runs out of time says so, and a later one still waits """
+
+        client = Client(delay=0.05)
+        writer = FlowWriter(client, FlowPipeline(workers=1))
+        for n in range(4):
+            writer.add_goto_sr_flow('openflow:1')
+
+        assert writer.barrier(0.01) is None
+        assert writer.barrier(10) == []
+        assert len(client.calls.order) == 4
+        writer.stop()
+
+    def test_errors(self):
+        """ Failed writes are handed back by the next barrier only """
+
+        client = Client()
+        client.fail.add(('goto',))
+        writer = FlowWriter(client, FlowPipeline(workers=2))
+        writer.add_goto_sr_flow('openflow:1')
+        writer.mark()
+        writer.put_sr_table('openflow:2', [])
+
+        errors = writer.barrier(10)
+        writer.stop()
+
+        assert [s for s, e in errors] == ['openflow:1']
+        assert writer.barrier(10) == []
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import networkx as nx
+
+from srmanager.nexthop import NextHopTable
+from srmanager.planner import diff_tables, plan_changes
+
+
+def graph(*links):
+    g = nx.DiGraph()
+    for u, v, port in links:
+        g.add_edge(u, v, **{'source-tp': port})
+        g.add_edge(v, u, **{'source-tp': port + 'r'})
+    return g
+
+
+class TestDiffTables:
+    def test_unchanged(self):
+        """ The same graph needs no flow changes """
+
+        g = graph(('a', 'b', '1'), ('b', 'c', '2'))
+
+        plan = diff_tables(NextHopTable(g), NextHopTable(g.copy()))
+
+        assert len(plan) == 0
+        assert plan.joined == [] and plan.left == []
+
+    def test_add_modify_delete(self):
+        """ Targets are added, rewritten and removed per switch """
+
+        old = NextHopTable(graph(('a', 'b', '1'), ('b', 'c', '2'), ('c', 'd', '3')))
+        new = NextHopTable(graph(('a', 'b', '1'), ('b', 'c', '2'), ('a', 'c', '4'),
+                                 ('b', 'e', '5')))
+
+        plan = diff_tables(old, new)
+
+        assert sorted(plan.add['a']) == ['e']
+        assert plan.modify['a'] == ['c']
+        assert plan.delete['a'] == ['d']
+        assert plan.joined == ['e']
+        assert sorted(plan.add['e']) == ['a', 'b', 'c']
+        assert plan.left == ['d']
+        assert 'd' not in plan.switches()
+        assert plan.ops('a') == 3
+
+    def test_port_change(self):
+        """ A new port towards the same next hop is a rewrite """
+
+        old = NextHopTable(graph(('a', 'b', '1')))
+        new = NextHopTable(graph(('a', 'b', '9')))
+
+        plan = diff_tables(old, new)
+
+        assert plan.modify == {'a': ['b'], 'b': ['a']}
+        assert plan.add == {} and plan.delete == {}
+
+    def test_moved(self):
+        """ Switches whose hops or ports changed are kept for backups """
+
+        old = NextHopTable(graph(('a', 'b', '1'), ('b', 'c', '2'), ('c', 'd', '3')), depths=True)
+        new = NextHopTable(graph(('a', 'b', '1'), ('b', 'c', '2'), ('c', 'd', '3'),
+                                 ('a', 'c', '4')), depths=True)
+
+        assert diff_tables(old, new).moved == set()
+        assert diff_tables(old, new, True).moved == set(['a', 'c', 'd'])
+
+        new = NextHopTable(graph(('a', 'b', '1'), ('b', 'c', '2'), ('c', 'd', '9')), depths=True)
+
+        assert diff_tables(old, new, True).moved == set(['c', 'd'])
+
+
+class TestPlanChanges:
+    def test_changes(self):
+        """ Change reports become adds, rewrites and removes """
+
+        table = NextHopTable(graph(('a', 'b', '1'), ('b', 'c', '2'), ('a', 'd', '3')))
+
+        plan = plan_changes({('a', 'b'): ('c', 'b'),
+                             ('a', 'c'): (None, 'b'),
+                             ('b', 'x'): ('a', None),
+                             ('d', 'a'): (None, 'a'),
+                             ('x', 'a'): ('b', None)},
+                            table, ['d'], ['x'], ['a'])
+
+        assert plan.modify == {'a': ['b']}
+        assert plan.add['a'] == ['c']
+        assert plan.delete == {'b': ['x']}
+        assert sorted(plan.add['d']) == ['a', 'b', 'c']
+        assert plan.joined == ['d'] and plan.left == ['x']
+        assert plan.moved == set(['a'])
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import networkx as nx
+
+from srmanager import client
+from srmanager.groups import GROUP_BASE
+from srmanager.nexthop import NextHopTable
+from srmanager.shadow import Shadow
+from srmanager.sr import SR
+
+SW = 'openflow:1'
+
+
+def ring(n):
+    g = nx.DiGraph()
+    names = ['openflow:{}'.format(i) for i in range(1, n + 1)]
+    for i in range(n):
+        u, v = names[i], names[(i + 1) % n]
+        g.add_edge(u, v, **{'source-tp': u + ':' + v})
+        g.add_edge(v, u, **{'source-tp': v + ':' + u})
+    return g
+
+
+class Recorder:
+    """ Client that records the writes made through it """
+
+    def __init__(self):
+        self.shadow = Shadow()
+        self.calls = []
+
+    def put_group(self, name, id, type, buckets):
+        self.calls.append(('put_group', id))
+        return {'id': id}
+
+    def delete_group(self, name, id):
+        self.calls.append(('delete_group', id))
+        return {'id': id}
+
+    def add_flow(self, flow):
+        self.calls.append(('add_flow', flow['flow_id'], flow.get('group')))
+
+    def delete_flow(self, name, id):
+        self.calls.append(('delete_flow', id))
+
+    def put_sr_table(self, name, flows, replace=True, remove=None):
+        self.calls.append(('put_sr_table', sorted([(f['flow_id'], f.get('group')) for f in flows]),
+                           sorted(remove or [])))
+        return flows
+
+
+def daemon(**config):
+    sr = SR()
+    sr.config.update(config)
+    sr.srm = Recorder()
+    return sr
+
+
+def installed(graph, **config):
+    """ Flows and groups a daemon with a config installed on SW """
+
+    sr = daemon(**config)
+    flows = sr.sr_flows_for_node(graph, SW, sr.next_hop_table(graph))
+    groups = dict([(id, client.group_doc(id, type, buckets))
+                   for id, (type, buckets) in sr.groups.groups(SW).items()])
+    return [client.written_flow_sr(f) for f in flows], groups
+
+
+class TestReconcileGroups:
+    def check_unchanged(self, **config):
+        g = ring(6)
+        flows, groups = installed(g, **config)
+        sr = daemon(**config)
+
+        r = sr.reconcile_sr_flows_for_node(g, SW, sr.next_hop_table(g), flows, True, groups)
+
+        assert groups
+        assert r == (0, 0)
+        assert sr.srm.calls == []
+
+    def test_unchanged_indirect(self):
+        """ A restart on a stable network writes no indirect group """
+
+        self.check_unchanged(indirect=True)
+
+    def test_unchanged_ecmp(self):
+        """ Nor select groups """
+
+        self.check_unchanged(ecmp=True)
+
+    def test_unchanged_frr(self):
+        """ Nor fast failover groups """
+
+        self.check_unchanged(frr=True)
+
+    def test_changed_frr(self):
+        """ After a link went away only the fast failover groups that differ are written """
+
+        g = ring(8)
+        g.add_edge('openflow:3', 'openflow:6', **{'source-tp': 'openflow:3:openflow:6'})
+        g.add_edge('openflow:6', 'openflow:3', **{'source-tp': 'openflow:6:openflow:3'})
+        flows, groups = installed(g, frr=True)
+        g.remove_edge('openflow:3', 'openflow:6')
+        g.remove_edge('openflow:6', 'openflow:3')
+        sr = daemon(frr=True)
+
+        sr.reconcile_sr_flows_for_node(g, SW, sr.next_hop_table(g), flows, True, groups)
+
+        old = set(client.group_key(doc) for doc in groups.values())
+        new = sr.groups.groups(SW)
+        writes = [c[1] for c in sr.srm.calls if c[0] == 'put_group']
+        assert writes and len(writes) < len(new)
+        assert [id for id in writes if new[id] in old] == []
+
+    def test_unknown_groups(self):
+        """ Flows on groups that can't be read move to fresh ids first """
+
+        g = ring(6)
+        flows, groups = installed(g, indirect=True)
+        sr = daemon(indirect=True)
+
+        sr.reconcile_sr_flows_for_node(g, SW, NextHopTable(g), flows, True, None)
+
+        old = sorted(groups)
+        writes = [c[1] for c in sr.srm.calls if c[0] == 'put_group']
+        assert writes and not set(writes) & set(old)
+        assert sr.srm.calls[-len(old):] == [('delete_group', id) for id in old]
+
+    def test_foreign_and_unused(self):
+        """ Groups that are not ours are kept, unused ones of ours deleted """
+
+        g = ring(6)
+        flows, groups = installed(g, indirect=True)
+        sr = daemon(indirect=True)
+        unused = max(groups) + 1
+        foreign = max(groups) + 2
+        groups[unused] = client.group_doc(unused, 'group-indirect', [('openflow:1:x', False, None)])
+        groups[foreign] = {'group-id': foreign, 'group-name': 'other', 'group-type': 'group-all'}
+
+        sr.reconcile_sr_flows_for_node(g, SW, NextHopTable(g), flows, True, groups)
+
+        assert sr.srm.calls == [('delete_group', unused)]
+        assert foreign in sr.groups.taken[SW]
+        assert sr.groups.use(SW, 'flow:1', ('group-indirect', (('openflow:1:y', False, None),))) \
+            == (unused, [])
+
+
+class TestWriteOrder:
+    def test_repointed(self):
+        """ A repointed group goes out after the flows leaving it """
+
+        sr = daemon(indirect=True)
+        leaving = {'flow_id': 'flow:2', 'switch_id': SW, 'label': '2', 'group': GROUP_BASE + 1}
+        groups = [(GROUP_BASE, 'group-indirect', [('p', False, None)]),
+                  (GROUP_BASE + 1, 'group-indirect', [('q', False, None)])]
+
+        sr.write_sr_changes(SW, [leaving], [], groups, [GROUP_BASE + 2], [GROUP_BASE])
+
+        assert sr.srm.calls == [('put_group', GROUP_BASE + 1),
+                                ('add_flow', 'flow:2', GROUP_BASE + 1),
+                                ('put_group', GROUP_BASE),
+                                ('delete_group', GROUP_BASE + 2)]
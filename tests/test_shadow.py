@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+
+from srmanager import client
+from srmanager.client import Client
+from srmanager.shadow import Shadow
+
+SW = 'openflow:1'
+
+
+class Response:
+    def __init__(self, status_code, content=''):
+        self.status_code = status_code
+        self.content = content
+        self.raw = io.BytesIO(content)
+
+    def close(self):
+        pass
+
+
+class FakeController:
+    """ Controller that keeps one SR table and counts the requests made """
+
+    def __init__(self, flows=()):
+        self.config = {'verify': client.VERIFY_NONE}
+        self.connection_losses = 0
+        self.flows = list(flows)
+        self.gets = 0
+        self.puts = 0
+        self.down = False
+
+    def get_config_url(self):
+        return 'http://controller/restconf/config'
+
+    def http_get_request(self, url, stream=False, bulk=False):
+        self.gets += 1
+        if self.down:
+            return None
+        return Response(200, json.dumps({'flow-node-inventory:table': [{'id': 1, 'flow': self.flows}]}))
+
+    def http_put_request(self, url, payload, bulk=False):
+        self.puts += 1
+        self.flows = json.loads(payload)['flow-node-inventory:table'][0]['flow']
+        return Response(200)
+
+
+def sr_flow(label, port):
+    return {'flow_id': 'flow:{}'.format(label), 'switch_id': SW, 'label': label,
+            'port': SW + ':' + port, 'penultimate': False}
+
+
+class TestShadow:
+    def test_unchanged(self):
+        """ A flow is unchanged only for the digest it was last written with """
+
+        shadow = Shadow()
+        shadow.wrote(SW, 1, 'f', Shadow.digest('a'))
+
+        assert shadow.unchanged(SW, 1, 'f', Shadow.digest('a'))
+        assert not shadow.unchanged(SW, 1, 'f', Shadow.digest('b'))
+        assert not Shadow(False).unchanged(SW, 1, 'f', Shadow.digest('a'))
+
+    def test_absent(self):
+        """ Only a complete table tells a flow is not there """
+
+        shadow = Shadow()
+        shadow.wrote(SW, 1, 'f', Shadow.digest('a'))
+        assert not shadow.absent(SW, 1, 'g')
+
+        shadow.wrote_table(SW, 1, {'f': Shadow.digest('a')})
+        assert shadow.absent(SW, 1, 'g')
+        assert not shadow.absent(SW, 1, 'f')
+
+    def test_forget(self):
+        """ Forgetting a flow leaves the table incomplete """
+
+        shadow = Shadow()
+        shadow.wrote_table(SW, 1, {'f': Shadow.digest('a'), 'g': Shadow.digest('b')})
+        shadow.forget(SW, 1, 'f')
+
+        assert shadow.known(SW, 1) is None
+        assert not shadow.unchanged(SW, 1, 'f', Shadow.digest('a'))
+        assert shadow.unchanged(SW, 1, 'g', Shadow.digest('b'))
+
+
+class TestPutSrTable:
+    def test_identical(self):
+        """ Writing the same table again is skipped """
+
+        ctrl = FakeController()
+        c = Client(ctrl=ctrl)
+        flows = [sr_flow('16002', '2'), sr_flow('16003', '3')]
+
+        c.put_sr_table(SW, flows)
+        r = c.put_sr_table(SW, flows)
+
+        assert (ctrl.gets, ctrl.puts) == (1, 1)
+        assert sorted([f['id'] for f in r]) == ['flow:16002', 'flow:16003']
+        assert c.shadow.counts() == {'sent': 1, 'skipped': 1}
+
+    def test_identical_merge(self):
+        """ And so is merging flows that were last written the same """
+
+        ctrl = FakeController()
+        c = Client(ctrl=ctrl)
+        c.put_sr_table(SW, [sr_flow('16002', '2'), sr_flow('16003', '3')])
+
+        c.put_sr_table(SW, [sr_flow('16003', '3')], replace=False, remove=['flow:16004'])
+
+        assert (ctrl.gets, ctrl.puts) == (1, 1)
+
+    def test_forget(self):
+        """ A forgotten table is written again """
+
+        ctrl = FakeController()
+        c = Client(ctrl=ctrl)
+        flows = [sr_flow('16002', '2')]
+        c.put_sr_table(SW, flows)
+
+        c.shadow.forget(SW)
+        c.put_sr_table(SW, flows)
+
+        assert ctrl.puts == 2
+
+    def test_replace_keeps_foreign(self):
+        """ Replacing drops our old node flows and keeps every other flow """
+
+        foreign = {'id': 'other-flow', 'priority': 5}
+        service = {'id': 'sra-' + SW + '-2-17000', 'priority': 1000}
+        ctrl = FakeController([foreign, service, {'id': 'src-flow:16009', 'priority': 2000}])
+        c = Client(ctrl=ctrl)
+
+        c.put_sr_table(SW, [sr_flow('16002', '2')])
+
+        ids = sorted([f['id'] for f in ctrl.flows])
+        assert ids == sorted(['other-flow', service['id'], 'src-flow:16002'])
+        assert foreign in ctrl.flows
+
+
+class TestVerifyFlows:
+    def client(self):
+        ctrl = FakeController()
+        c = Client(ctrl=ctrl, verify=client.VERIFY_DEFERRED)
+        c.put_sr_table(SW, [sr_flow('16002', '2')])
+        return ctrl, c
+
+    def test_landed(self):
+        """ Flows written as expected are checked once """
+
+        ctrl, c = self.client()
+
+        assert c.verify_flows() == {}
+        assert c.pending == {}
+
+    def test_unreadable(self):
+        """ A table that can't be read is neither taken as empty nor dropped """
+
+        ctrl, c = self.client()
+        ctrl.down = True
+
+        assert c.verify_flows() == {}
+        assert ctrl.puts == 1
+        assert list(c.pending[SW]) == ['flow:16002']
+
+        ctrl.down = False
+        assert c.verify_flows() == {}
+        assert c.pending == {}
+
+    def test_mismatch(self):
+        """ A flow that did not land is written again """
+
+        ctrl, c = self.client()
+        ctrl.flows = []
+
+        assert c.verify_flows() == {SW: ['flow:16002']}
+        assert [f['id'] for f in ctrl.flows] == ['src-flow:16002']
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import networkx as nx
+import pytest
+
+from srmanager.sid import SidCollision, SidRegistry, parse_overrides
+from srmanager.sr import SR
+
+
+class TestSidRegistry:
+    def test_default(self):
+        """ A node's sid is the base plus its dpid, and can be looked up either way """
+
+        sids = SidRegistry(16000)
+
+        assert sids.sid('openflow:7') == 16007
+        assert sids.node(16007) == 'openflow:7'
+        assert sids.node('16008') is None
+
+    def test_override(self):
+        """ An override wins over the dpid """
+
+        sids = SidRegistry(16000, 'openflow:1=17001, openflow:2=17002')
+
+        assert sids.sid('openflow:1') == 17001
+        assert sids.node(17002) == 'openflow:2'
+        assert sids.node(16001) is None
+
+    def test_parse(self):
+        """ Overrides come as text or a dict """
+
+        assert parse_overrides('openflow:1=17001,,openflow:2 = 17002') == \
+            {'openflow:1': 17001, 'openflow:2': 17002}
+        assert parse_overrides({'openflow:1': '17001'}) == {'openflow:1': 17001}
+        assert parse_overrides(None) == {}
+
+    def test_collision(self):
+        """ A sid already held by another node is never handed out again """
+
+        sids = SidRegistry(16000, {'openflow:3': 16002})
+
+        with pytest.raises(SidCollision):
+            sids.sid('openflow:2')
+        with pytest.raises(SidCollision):
+            SidRegistry(16000, {'openflow:3': 17000, 'openflow:4': 17000})
+        assert sids.node(16002) == 'openflow:3'
+
+    def test_reassign(self):
+        """ Replacing a node's sid frees the old one """
+
+        sids = SidRegistry(16000)
+        sids.sid('openflow:1')
+        sids.assign('openflow:1', 17001)
+
+        assert sids.node(16001) is None
+        assert sids.assign('openflow:1', 18001, replace=False) == 17001
+        assert sids.sid('openflow:5') == 16005 and len(sids) == 2
+
+
+class TestCollidingTarget:
+    def test_skipped(self, caplog):
+        """ The flows of a target whose sid collides are left out, and it is logged """
+
+        g = nx.DiGraph()
+        for u, v in [('openflow:1', 'openflow:2'), ('openflow:2', 'openflow:3')]:
+            g.add_edge(u, v, **{'source-tp': u + ':' + v})
+            g.add_edge(v, u, **{'source-tp': v + ':' + u})
+        sr = SR()
+        sr.sids = SidRegistry(16000, {'openflow:3': 16002})
+
+        with caplog.at_level(logging.ERROR):
+            flows = sr.sr_flows_for_node(g, 'openflow:1', sr.next_hop_table(g))
+
+        assert [f['label'] for f in flows] == ['16002']
+        assert flows[0]['port'] == 'openflow:1:openflow:2'
+        assert 'no sid for openflow:2' in caplog.text
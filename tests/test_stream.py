@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import socket
+import time
+
+from websocket import ABNF
+
+from srmanager import stream
+from srmanager.stream import IDLE, RESYNC, TopologyStream
+
+
+class Scripted(TopologyStream):
+    """ Stream whose notifications arrive on a script of (delay, notification) """
+
+    def __init__(self, script):
+        TopologyStream.__init__(self, None, keepalive=30, backoff=1, backoff_max=1)
+        self.script = list(script)
+        self.due = None
+
+    def recv(self, timeout=None):
+        if not self.script:
+            self.closed = True
+            raise StopIteration
+        if self.due is None:
+            self.due = time.time() + self.script[0][0]
+        wait = self.due - time.time()
+        if timeout is not None and wait > timeout:
+            time.sleep(timeout)
+            return IDLE
+        time.sleep(max(wait, 0))
+        self.due = None
+        return self.script.pop(0)[1]
+
+
+class WebSocket:
+    """ Websocket that hands out its frames, then fails """
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv_data(self, control_frame=False):
+        if not self.frames:
+            raise socket.error('reset')
+        return ABNF.OPCODE_TEXT, self.frames.pop(0)
+
+    def close(self):
+        pass
+
+
+class TestBatches:
+    def test_coalesce(self):
+        """ Notifications less than window apart make one batch """
+
+        s = Scripted([(0, 'a'), (0.01, 'b'), (0.01, 'c'), (0.3, 'd'), (0.01, 'e')])
+
+        assert list(s.batches(0.1, 5)) == [['a', 'b', 'c'], ['d', 'e']]
+
+    def test_max_delay(self):
+        """ A steady trickle is still cut max_delay after its first notification """
+
+        s = Scripted([(0, n) for n in 'ab'] + [(0.04, n) for n in 'cdefghij'])
+
+        batches = list(s.batches(0.1, 0.15))
+
+        assert len(batches) > 1
+        assert sum(batches, []) == list('abcdefghij')
+        assert len(batches[0]) < 8
+
+    def test_resync(self, monkeypatch):
+        """ RESYNC comes through in its batch after a reconnect """
+
+        sockets = [WebSocket(['a', 'b']), WebSocket(['c'])]
+        s = TopologyStream(None, keepalive=30, backoff=0.01, backoff_max=0.01)
+
+        def connect():
+            if not sockets:
+                s.closed = True
+                return False
+            s.ws = sockets.pop(0)
+            s.connects += 1
+            return True
+        monkeypatch.setattr(s, 'connect', connect)
+        monkeypatch.setattr(stream.time, 'sleep', lambda t: None)
+
+        batches = list(s.batches(0.05, 1))
+
+        assert sum(batches, []) == ['a', 'b', RESYNC, 'c']
+        assert batches[0][:2] == ['a', 'b']
+
+
+class TestOpen:
+    def stream(self, monkeypatch, attempts):
+        """ Stream whose connects succeed or fail as attempts says """
+
+        s = TopologyStream(None, keepalive=30, backoff=0.01, backoff_max=0.01)
+        attempts = list(attempts)
+
+        def connect():
+            if not attempts.pop(0):
+                return False
+            s.ws = WebSocket(['a'])
+            s.connects += 1
+            return True
+        monkeypatch.setattr(s, 'connect', connect)
+        monkeypatch.setattr(stream.time, 'sleep', lambda t: None)
+        return s
+
+    def test_open(self, monkeypatch):
+        """ Opened before the topology is read, the first read gets what came since """
+
+        s = self.stream(monkeypatch, [True])
+
+        assert s.open()
+        assert s.recv() == 'a'
+
+    def test_not_open(self, monkeypatch):
+        """ If it could not be opened the read that connects resyncs first """
+
+        s = self.stream(monkeypatch, [False, False, True])
+
+        assert not s.open()
+        assert s.recv() == RESYNC
+        assert s.recv() == 'a'
+
+    def test_lazy(self):
+        """ Not opened, the first connect is no reconnect """
+
+        s = TopologyStream(None, keepalive=30, backoff=0.01, backoff_max=0.01)
+        s.connect = lambda: setattr(s, 'ws', WebSocket(['a'])) or True
+
+        assert s.recv() == 'a'
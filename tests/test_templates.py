@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import json
+
+from srmanager import client
+
+SW = 'openflow:1'
+
+
+def flow(**kwargs):
+    f = {'switch_id': SW, 'flow_id': 'flow:16002', 'label': '16002',
+         'port': SW + ':2', 'penultimate': False}
+    f.update(kwargs)
+    return f
+
+
+class TestRenderFlowSr:
+    def check(self, f, doc):
+        id, text = client.render_flow_sr(f)
+
+        assert id == 'src-flow:16002'
+        assert json.loads(text) == json.loads(json.dumps(doc))
+
+    def test_port(self):
+        """ The template gives the flow the document builder does """
+
+        self.check(flow(), client.sr_flow_doc('src-flow:16002', '16002', SW + ':2', False))
+
+    def test_php(self):
+        """ With the label popped on the way out """
+
+        for penultimate in (True, 'true', u'True'):
+            self.check(flow(penultimate=penultimate),
+                       client.sr_flow_doc('src-flow:16002', '16002', SW + ':2', True))
+
+    def test_group(self):
+        """ And sending the packet to a group """
+
+        self.check(flow(group=1000), client.sr_group_flow_doc('src-flow:16002', '16002', 1000))
+
+    def test_service_flow_id(self):
+        """ A flow without an id is named by its switch, port and label """
+
+        f = flow()
+        del f['flow_id']
+
+        assert client.render_flow_sr(f)[0] == 'sra-' + SW + '-' + SW + ':2-16002'
+
+    def test_table(self):
+        """ A whole table body holds every flow as rendered """
+
+        flows = [flow(), flow(flow_id='flow:16003', label='16003', penultimate=True)]
+        text = client.TABLE_BODY.render(table=client.SR_TABLE, flows=client.raw_list(
+            [client.render_flow_sr(f)[1] for f in flows]))
+
+        assert json.loads(text) == {'flow-node-inventory:table': [{
+            'id': client.SR_TABLE,
+            'flow': [json.loads(client.render_flow_sr(f)[1]) for f in flows]}]}